@@ -1,19 +1,22 @@
 import sys, os
 sys.path.append(os.path.join(os.path.dirname(__file__), "src"))
 
-import os, uuid, time
+import asyncio, os, uuid, time
 from dotenv import load_dotenv
-import gradio as gr
-from rag_pipeline import RAGEngine
-from memory import MemoryStore
+from startup import get_engine, start_warm, readiness, stage, log_breakdown
+from near_dup import format_equivalents
+with stage("import gradio"):
+    import gradio as gr
 
 load_dotenv()
 
-engine = RAGEngine()
-memory = MemoryStore()
+# The engine (embedding model, Chroma, Gemini client) is built lazily — in the background
+# right after launch when WARM_START is on, otherwise on the first request.
+def get_memory():
+    return get_engine().memory  # the engine's store (and its embedder) backs the UI helpers
 
 def get_sessions(user_id):
-    sessions = memory.list_sessions(user_id=user_id)
+    sessions = get_memory().list_sessions(user_id=user_id)
     session_ids = [s["session_id"] for s in sessions]
     session_labels = [f"{sid[:8]} (msgs:{s['count']})" for sid, s in zip(session_ids, sessions)]
     return session_ids, session_labels
@@ -22,22 +25,7 @@ def start_new_session(user_id):
     session_id = str(uuid.uuid4())
     return session_id
 
-def chat_fn(history, user_id, session_id, include_memory, include_kb, show_citations, query):
-    if not query:
-        return history, gr.update(value=""), ""
-    start = time.time()
-    try:
-        result = engine.answer(user_id=user_id, session_id=session_id, query=query)
-    except Exception as e:
-        return history, gr.update(value=""), f"Error: {e}"
-    elapsed = time.time() - start
-    answer = result.get("answer", "").strip()
-    # Append messages as dicts for Gradio 'messages' format
-    history = history + [
-        {"role": "user", "content": query},
-        {"role": "assistant", "content": answer}
-    ]
-
+def render_citations(result, show_citations, elapsed, ttft=None):
     citations = ""
     if show_citations:
         used_kb = result.get("used_kb", [])
@@ -46,6 +34,9 @@ def chat_fn(history, user_id, session_id, include_memory, include_kb, show_citat
             for i, b in enumerate(used_kb, 1):
                 meta = b.get("meta", {})
                 title = f"{meta.get('act','') } §{meta.get('section_number','')} {meta.get('section_title','')}"
+                equivalents = format_equivalents(meta)
+                if equivalents:
+                    title += f" (equivalent: {equivalents})"
                 citations += f"- [{i}] {title} — source: `{meta.get('source_file','')}`\n"
         else:
             citations += "_No KB snippets used._\n"
@@ -60,8 +51,45 @@ def chat_fn(history, user_id, session_id, include_memory, include_kb, show_citat
     else:
         citations += "_No memory snippets used._\n"
 
-    citations += f"\nResponse generation latency: {elapsed:.2f}s, prompt chars: {result.get('prompt_chars', 'n/a')}"
-    return history, gr.update(value=""), citations
+    citations += f"\nResponse generation latency: {elapsed:.2f}s"
+    if ttft is not None:
+        citations += f" (first token: {ttft:.2f}s)"
+    citations += f", prompt chars: {result.get('prompt_chars', 'n/a')}"
+    if "prompt_tokens" in result:
+        citations += f", prompt tokens: ~{result['prompt_tokens']} (saved ~{result.get('prompt_tokens_saved', 0)})"
+    cache = result.get("cache") or {}
+    if cache.get("hit"):
+        citations += f"\n\n_Answered from cache (similarity {cache['similarity']:.3f}, saved ~{cache['saved_s']:.1f}s)._"
+    return citations
+
+async def chat_fn(history, user_id, session_id, include_memory, include_kb, show_citations, query):
+    if not query:
+        yield history, gr.update(value=""), ""
+        return
+    start = time.time()
+    ttft = None
+    result = {}
+    # Append messages as dicts for Gradio 'messages' format; the assistant turn fills in as tokens stream
+    history = history + [
+        {"role": "user", "content": query},
+        {"role": "assistant", "content": ""}
+    ]
+    try:
+        engine = await asyncio.to_thread(get_engine)
+        async for ev in engine.answer_stream(user_id=user_id, session_id=session_id, query=query):
+            if ev["done"]:
+                result = ev
+                continue
+            if ttft is None:
+                ttft = time.time() - start
+            history[-1] = {"role": "assistant", "content": ev["answer"]}
+            yield history, gr.update(value=""), ""
+    except Exception as e:
+        yield history[:-2], gr.update(value=""), f"Error: {e}"
+        return
+    elapsed = time.time() - start
+    history[-1] = {"role": "assistant", "content": result.get("answer", "").strip()}
+    yield history, gr.update(value=""), render_citations(result, show_citations, elapsed, ttft)
 
 def export_conversation(history, user_id, session_id):
     if not history:
@@ -82,7 +110,7 @@ def export_conversation(history, user_id, session_id):
     return gr.File.update(value=(filename, txt.encode("utf-8")))
 
 def load_recent_memory(user_id, session_id):
-    mem_list = memory.get_recent_memory(user_id=user_id, session_id=session_id, limit=50)
+    mem_list = get_memory().get_recent_memory(user_id=user_id, session_id=session_id, limit=50)
     if not mem_list:
         return "No memory for this user/session yet."
     out = ""
@@ -92,12 +120,12 @@ def load_recent_memory(user_id, session_id):
         out += f"- ({who}) `{ts}` — {item['content'][:300]} ...\n"
     return out
 
-with gr.Blocks(title="LegalAid Chatbot (RAG+Memory)") as demo:
+with stage("build UI"), gr.Blocks(title="LegalAid Chatbot (RAG+Memory)") as demo:
     gr.Markdown("# 🇮🇳 LegalAid — Conversational RAG with Memory (Gemini + Chroma)")
     with gr.Row():
         with gr.Column(scale=1):
             user_id = gr.Textbox(label="User ID", value=f"user_{str(uuid.uuid4())[:8]}", interactive=True)
-            session_ids, session_labels = get_sessions(user_id.value)
+            session_ids, session_labels = [], []  # the default user id is freshly generated: no sessions yet
             session_id = gr.Textbox(label="Session ID", value=str(uuid.uuid4()), interactive=True)
             new_session_btn = gr.Button("🆕 Start new session")
             session_dropdown = gr.Dropdown(
@@ -130,4 +158,38 @@ with gr.Blocks(title="LegalAid Chatbot (RAG+Memory)") as demo:
     clear_btn.click(lambda: [], None, chatbot)
     memory_viewer_btn.click(load_recent_memory, [user_id, session_id], memory_viewer)
 
-demo.launch()
+def create_server():
+    """FastAPI app serving the UI at / plus /healthz (liveness), /readyz (engine loaded) and /metrics."""
+    import fastapi
+    from fastapi.responses import JSONResponse, PlainTextResponse
+    from tracing import render_metrics
+
+    server = fastapi.FastAPI()
+
+    @server.get("/healthz")
+    def healthz():
+        return {"status": "ok"}
+
+    @server.get("/readyz")
+    def readyz():
+        state = readiness()
+        return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
+    @server.get("/metrics")
+    def metrics():
+        return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+    return gr.mount_gradio_app(server, demo, path="/")
+
+if __name__ == "__main__":
+    from config import SERVER_HOST, SERVER_PORT
+
+    log_breakdown("ui")
+    start_warm()
+    # `python app.py --gradio`, or the `gradio app.py` reload CLI: plain Gradio server, UI only
+    if "--gradio" in sys.argv[1:] or os.environ.get("GRADIO_WATCH_DIRS"):
+        demo.launch(server_name=SERVER_HOST, server_port=SERVER_PORT)
+    else:
+        import uvicorn
+
+        uvicorn.run(create_server(), host=SERVER_HOST, port=SERVER_PORT)
@@ -0,0 +1,144 @@
+from __future__ import annotations
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Dict, Any
+import hashlib, sqlite3, threading, time
+
+import numpy as np
+
+from config import ANSWER_CACHE_PATH, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL_HOURS, ANSWER_CACHE_MAX
+from tracing import add_collector
+
+
+def grounding_key(kb_hits: List[Dict[str, Any]], mem_ids: List[str]) -> str:
+    """
+    Fingerprint of what the answer was grounded on: the KB chunk ids (so any
+    re-index invalidates it) plus the ids of the memory blocks the packer put
+    into the prompt (pack_context's stats["memory_ids"]). Memory that was
+    retrieved but not packed doesn't count; with no memory blocks the key is
+    user-independent and shared.
+    """
+    parts = ["kb:" + ",".join(sorted(str(h.get("id", "")) for h in kb_hits))]
+    if mem_ids:
+        parts.append("mem:" + ",".join(sorted(str(i) for i in mem_ids)))
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """
+    Semantic response cache in front of Gemini. A hit needs the same grounding
+    key and a query embedding within `threshold` cosine of a cached query.
+    Entries expire after `ttl_hours`, the least recently used are evicted past
+    `max_entries`, and everything is backed by SQLite so it survives restarts.
+    """
+    def __init__(self, path: Path = ANSWER_CACHE_PATH, threshold: float = ANSWER_CACHE_THRESHOLD,
+                 ttl_hours: float = ANSWER_CACHE_TTL_HOURS, max_entries: int = ANSWER_CACHE_MAX):
+        self.threshold = threshold
+        self.ttl = ttl_hours * 3600.0
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " id INTEGER PRIMARY KEY, grounding TEXT NOT NULL, query TEXT, vec BLOB NOT NULL,"
+            " answer TEXT NOT NULL, gen_s REAL, created REAL, last_used REAL)"
+        )
+        self.conn.commit()
+        # id -> entry, in LRU order; grounding -> ids for the candidate scan
+        self.entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self.by_grounding: Dict[str, List[int]] = {}
+        rows = self.conn.execute(
+            "SELECT id, grounding, query, vec, answer, gen_s, created, last_used FROM answers ORDER BY last_used"
+        ).fetchall()
+        for rid, g, q, vec, ans, gen_s, created, last_used in rows:
+            self._index(rid, {"grounding": g, "query": q, "vec": np.frombuffer(vec, dtype=np.float32),
+                              "answer": ans, "gen_s": gen_s or 0.0, "created": created, "last_used": last_used})
+        self.hits = 0
+        self.misses = 0
+        self.saved_s = 0.0
+        add_collector("answer_cache", self._collect)
+
+    def _index(self, rid: int, entry: Dict[str, Any]):
+        self.entries[rid] = entry
+        self.by_grounding.setdefault(entry["grounding"], []).append(rid)
+
+    def _drop(self, rids: List[int]):
+        for rid in rids:
+            e = self.entries.pop(rid, None)
+            if e is not None:
+                ids = self.by_grounding.get(e["grounding"], [])
+                if rid in ids:
+                    ids.remove(rid)
+                if not ids:
+                    self.by_grounding.pop(e["grounding"], None)
+        self.conn.executemany("DELETE FROM answers WHERE id = ?", ((r,) for r in rids))
+        self.conn.commit()
+
+    @staticmethod
+    def _unit(vec) -> np.ndarray:
+        v = np.asarray(vec, dtype=np.float32)
+        n = float(np.linalg.norm(v))
+        return v / n if n else v
+
+    def lookup(self, q_vec, grounding: str) -> Dict[str, Any] | None:
+        now = time.time()
+        q = self._unit(q_vec)
+        with self._lock:
+            rids = list(self.by_grounding.get(grounding, []))
+            expired = [r for r in rids if now - self.entries[r]["created"] > self.ttl]
+            if expired:
+                self._drop(expired)
+                rids = [r for r in rids if r not in expired]
+            best, best_sim = None, -1.0
+            if rids:
+                sims = np.stack([self.entries[r]["vec"] for r in rids]) @ q
+                i = int(np.argmax(sims))
+                best, best_sim = rids[i], float(sims[i])
+            if best is None or best_sim < self.threshold:
+                self.misses += 1
+                return None
+            entry = self.entries[best]
+            entry["last_used"] = now
+            self.entries.move_to_end(best)
+            self.conn.execute("UPDATE answers SET last_used = ? WHERE id = ?", (now, best))
+            self.conn.commit()
+            self.hits += 1
+            self.saved_s += entry["gen_s"]
+            return {"answer": entry["answer"], "similarity": best_sim, "saved_s": entry["gen_s"], "query": entry["query"]}
+
+    def put(self, q_vec, grounding: str, query: str, answer: str, gen_s: float):
+        if not answer:
+            return
+        now = time.time()
+        vec = self._unit(q_vec)
+        with self._lock:
+            cur = self.conn.execute(
+                "INSERT INTO answers (grounding, query, vec, answer, gen_s, created, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (grounding, query, vec.tobytes(), answer, gen_s, now, now),
+            )
+            self.conn.commit()
+            self._index(cur.lastrowid, {"grounding": grounding, "query": query, "vec": vec, "answer": answer,
+                                        "gen_s": gen_s, "created": now, "last_used": now})
+            overflow = len(self.entries) - self.max_entries
+            if overflow > 0:
+                self._drop(list(self.entries)[:overflow])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "saved_latency_s": self.saved_s,
+            }
+
+    def _collect(self):
+        st = self.stats()
+        return [
+            ("rag_answer_cache_entries", {}, st["entries"]),
+            ("rag_answer_cache_hit_ratio", {}, st["hit_rate"]),
+            ("rag_answer_cache_saved_seconds_total", {}, st["saved_latency_s"]),
+        ]
@@ -0,0 +1,205 @@
+"""
+Bulk answering for intake CSVs.
+
+    python src/batch_answer.py questions.csv answers.jsonl --concurrency 4 --rps 1
+
+The CSV needs a `question` column; `id` (else the row number), `user_id` and
+`session_id` are optional. Questions are retrieved in chunks of
+BATCH_RETRIEVE_SIZE (one batched encode + one kb.query per chunk) while the
+previous chunk's Gemini calls run with bounded concurrency, a requests-per-second
+limit and exponential-backoff retries. Each answer is appended to the JSONL file
+as soon as it is ready; re-running with the same output skips ids already
+answered, so an interrupted batch resumes where it stopped (rows that failed are
+retried; their later line supersedes the error line).
+"""
+from __future__ import annotations
+from pathlib import Path
+from typing import List, Dict, Any, Iterable
+import argparse, asyncio, csv, json, random, time
+
+from config import (
+    BATCH_RETRIEVE_SIZE, BATCH_CONCURRENCY, BATCH_RPS, BATCH_MAX_RETRIES, BATCH_BACKOFF_S,
+)
+from near_dup import parse_equivalents
+
+
+class RateLimiter:
+    """Spaces calls at least 1/rps apart (rps <= 0 disables)."""
+    def __init__(self, rps: float):
+        self.interval = 1.0 / rps if rps > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+def read_questions(path: Path) -> List[Dict[str, str]]:
+    with path.open("r", encoding="utf-8-sig", newline="") as f:
+        rows = []
+        for n, row in enumerate(csv.DictReader(f), 1):
+            q = (row.get("question") or "").strip()
+            if q:
+                rows.append({**row, "id": (row.get("id") or str(n)).strip(), "question": q})
+        return rows
+
+def answered_ids(out_path: Path) -> set:
+    """Ids with a successful answer in an existing output file (torn last line ignored)."""
+    done = set()
+    if out_path.exists():
+        with out_path.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except Exception:
+                    continue
+                if "error" not in rec:
+                    done.add(str(rec.get("id")))
+    return done
+
+def _chunks(rows: List[Dict[str, str]], n: int) -> Iterable[List[Dict[str, str]]]:
+    for i in range(0, len(rows), n):
+        yield rows[i:i + n]
+
+def _citations(kb_hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [
+        {"id": h["id"], **{k: h["meta"].get(k, "") for k in ("act", "section_number", "section_title", "source_file")},
+         "equivalents": [{"section": sec, "equivalent_act": act, "equivalent_section": o_sec}
+                         for sec, act, o_sec in parse_equivalents(h["meta"])]}
+        for h in kb_hits
+    ]
+
+
+class BatchAnswerer:
+    """
+    Runs many questions through a RAGEngine's retrieval, prompt and cache
+    pieces, with its own LLM scheduling. Memory is neither read nor written
+    unless `use_memory` is set (intake questions are independent).
+    """
+    def __init__(self, engine=None, concurrency: int = BATCH_CONCURRENCY, rps: float = BATCH_RPS,
+                 max_retries: int = BATCH_MAX_RETRIES, backoff_s: float = BATCH_BACKOFF_S,
+                 retrieve_size: int = BATCH_RETRIEVE_SIZE, use_memory: bool = False):
+        if engine is None:
+            from rag_pipeline import RAGEngine
+            engine = RAGEngine()
+        self.engine = engine
+        self.concurrency = max(1, concurrency)
+        self.rps = rps
+        self.max_retries = max_retries
+        self.backoff = backoff_s
+        self.retrieve_size = max(1, retrieve_size)
+        self.use_memory = use_memory
+
+    # ---- retrieval (worker thread) ----
+    def _prepare(self, rows: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+        eng = self.engine
+        kb_all = eng.retriever.search_many([r["question"] for r in rows], top_k=eng.kb_top)
+        jobs = []
+        for r, kb_hits in zip(rows, kb_all):
+            mem_hits = []
+            if self.use_memory and r.get("user_id"):
+                mem_hits = eng.memory.search_relevant(user_id=r["user_id"], session_id=r.get("session_id") or "",
+                                                      query=r["question"])
+            prompt, pack = eng._build_prompt(r["question"], kb_hits, mem_hits)
+            q_vec, grounding = eng._cache_key(r["question"], kb_hits, pack)
+            jobs.append({"row": r, "kb": kb_hits, "mem": mem_hits, "prompt": prompt, "pack": pack,
+                         "q_vec": q_vec, "grounding": grounding})
+        return jobs
+
+    # ---- generation ----
+    async def _generate(self, prompt: str, limiter: RateLimiter):
+        for attempt in range(1, self.max_retries + 2):
+            await limiter.wait()
+            try:
+                resp = await self.engine.model.generate_content_async(prompt)
+                return getattr(resp, "text", "").strip(), attempt
+            except Exception as e:
+                if attempt > self.max_retries:
+                    raise
+                delay = self.backoff * (2 ** (attempt - 1)) * (0.5 + random.random())
+                print(f"[batch] LLM call failed ({type(e).__name__}: {e}); retry {attempt} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def _answer(self, job: Dict[str, Any], sem: asyncio.Semaphore, limiter: RateLimiter) -> Dict[str, Any]:
+        eng, r = self.engine, job["row"]
+        rec: Dict[str, Any] = {"id": r["id"], "question": r["question"]}
+        t0 = time.perf_counter()
+        try:
+            # SQLite + numpy scans: off the loop, or they stall every other generation and the limiter
+            cached = await asyncio.to_thread(eng._cache_lookup, job["q_vec"], job["grounding"])
+            if cached:
+                text, attempts = cached["answer"], 0
+            else:
+                async with sem:
+                    g0 = time.perf_counter()
+                    text, attempts = await self._generate(job["prompt"], limiter)
+                await asyncio.to_thread(eng._cache_store, job["q_vec"], job["grounding"], r["question"], text,
+                                        time.perf_counter() - g0)
+            if self.use_memory and r.get("user_id"):
+                await asyncio.to_thread(eng._persist_turn, r["user_id"], r.get("session_id") or "", r["question"], text)
+            rec.update(answer=text, citations=_citations(job["kb"]), prompt_tokens=job["pack"]["prompt_tokens"],
+                       cache_hit=bool(cached), attempts=attempts)
+        except Exception as e:
+            rec["error"] = f"{type(e).__name__}: {e}"
+        rec["latency_s"] = round(time.perf_counter() - t0, 3)
+        return rec
+
+    async def run(self, rows: List[Dict[str, str]], out_path: Path) -> Dict[str, int]:
+        done = answered_ids(out_path)
+        todo = [r for r in rows if r["id"] not in done]
+        print(f"[batch] {len(rows)} questions, {len(done)} already answered, {len(todo)} to go")
+        sem = asyncio.Semaphore(self.concurrency)
+        limiter = RateLimiter(self.rps)
+        stats = {"answered": 0, "failed": 0, "skipped": len(rows) - len(todo)}
+        pending: set = set()
+
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        with out_path.open("a", encoding="utf-8") as out:
+            def write(task: asyncio.Task):
+                if task.cancelled():
+                    return  # Ctrl-C / shutdown: unanswered, so the next run picks it up again
+                rec = task.result()
+                out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                out.flush()
+                stats["failed" if "error" in rec else "answered"] += 1
+
+            for chunk in _chunks(todo, self.retrieve_size):
+                # retrieval for this chunk overlaps with generation for the previous one
+                jobs = await asyncio.to_thread(self._prepare, chunk)
+                for job in jobs:
+                    t = asyncio.create_task(self._answer(job, sem, limiter))
+                    t.add_done_callback(write)
+                    pending.add(t)
+                    t.add_done_callback(pending.discard)
+                while len(pending) > 2 * self.retrieve_size:
+                    await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if pending:
+                await asyncio.wait(pending)
+        return stats
+
+
+def answer_csv(csv_path: Path, out_path: Path, engine=None, **kwargs) -> Dict[str, int]:
+    """Python entry point: answer every question in `csv_path` into `out_path` (JSONL, resumable)."""
+    rows = read_questions(csv_path)
+    return asyncio.run(BatchAnswerer(engine, **kwargs).run(rows, out_path))
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("csv", type=Path)
+    ap.add_argument("out", type=Path)
+    ap.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    ap.add_argument("--rps", type=float, default=BATCH_RPS, help="LLM requests per second (0 = unlimited)")
+    ap.add_argument("--retries", type=int, default=BATCH_MAX_RETRIES)
+    ap.add_argument("--retrieve-size", type=int, default=BATCH_RETRIEVE_SIZE)
+    ap.add_argument("--use-memory", action="store_true", help="read/write memory for rows with a user_id")
+    args = ap.parse_args()
+    stats = answer_csv(args.csv, args.out, concurrency=args.concurrency, rps=args.rps, max_retries=args.retries,
+                       retrieve_size=args.retrieve_size, use_memory=args.use_memory)
+    print(f"✓ {stats['answered']} answered, {stats['failed']} failed, {stats['skipped']} already done → {args.out}")
@@ -0,0 +1,244 @@
+"""
+Offline retrieval benchmark + load test (no network: a stub LLM replaces Gemini).
+
+    python src/benchmark.py --queries 200 --users 8 --turns 5 --out bench.json
+
+1. Query set: section headings found in data/processed ("103. Punishment for
+   murder.—") become queries ("Punishment for murder under the bharatiya nyaya
+   sanhita") labelled with (act, section); relevant chunks come from the section
+   index. Deterministic for a given --seed.
+2. Retrieval: recall@k (a chunk of the labelled section in the top k), same-act
+   hit@k and MRR from Retriever.search.
+3. Load: N simulated users ask --turns questions each, concurrently, through
+   RAGEngine.answer; reports throughput and end-to-end / per-stage p50/p95/p99
+   (from tracing spans). Benchmark users' memory is deleted afterwards.
+
+Results are printed (and written to --out) as JSON for comparison across commits.
+"""
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Dict, Any
+import argparse, json, random, re, subprocess, threading, time, uuid
+
+import numpy as np
+
+import config
+from config import DATA_PROCESSED, SECTION_INDEX_PATH
+from utils import soft_clean
+from section_index import ACT_ALIASES, HEADING_STRICT, SectionIndex, _key
+import tracing
+
+_TITLE = re.compile(r"^\s*(?:\d+\[)?(\d{1,3}[A-Z]{0,3})\.\s+(.*?)\s*[.:]\s?[—–-]{1,2}\s*$", re.DOTALL)
+
+
+class StubLLM:
+    """Stands in for genai.GenerativeModel: fixed latency, canned answer, same sync/async/stream surface."""
+    def __init__(self, latency_ms: float = 0.0, answer: str = "This is a benchmark answer."):
+        self.latency = latency_ms / 1000.0
+        self.answer = answer
+
+    class _Resp:
+        def __init__(self, text: str):
+            self.text = text
+
+    def generate_content(self, prompt: str):
+        time.sleep(self.latency)
+        return self._Resp(self.answer)
+
+    async def generate_content_async(self, prompt: str, stream: bool = False):
+        import asyncio
+        await asyncio.sleep(self.latency)
+        if not stream:
+            return self._Resp(self.answer)
+
+        async def chunks():
+            for w in self.answer.split(" "):
+                yield self._Resp(w + " ")
+        return chunks()
+
+
+# ---- query set ----
+def _act_phrase(act: str) -> str:
+    aliases = ACT_ALIASES.get(act)
+    return max(aliases, key=len) if aliases else act
+
+def derive_queries(n: int = 200, seed: int = 0) -> List[Dict[str, Any]]:
+    """[{query, act, section, relevant: [chunk ids]}] from statute headings that the section index knows."""
+    index = SectionIndex.load(SECTION_INDEX_PATH)
+    if index is None:
+        raise SystemExit(f"{SECTION_INDEX_PATH} missing — run build_or_update_index.py first.")
+    seen, out = set(), []
+    for jf in sorted(DATA_PROCESSED.glob("*.jsonl")):
+        act = jf.stem
+        with jf.open("r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                rec = json.loads(line)
+                act = rec.get("act", jf.stem)
+                text = soft_clean(rec.get("content") or rec.get("text", ""))
+                for m in HEADING_STRICT.finditer(text):
+                    t = _TITLE.match(m.group(0))
+                    if not t:
+                        continue
+                    sec, title = t.group(1).upper(), " ".join(t.group(2).split())
+                    key = _key(act, sec)
+                    if key in seen or not (3 <= len(title.split()) <= 15) or key not in index.sections:
+                        continue
+                    seen.add(key)
+                    out.append({"query": f"{title} under the {_act_phrase(act)}", "act": act, "section": sec,
+                                "relevant": index.sections[key]})
+    random.Random(seed).shuffle(out)
+    return out[:n]
+
+
+# ---- stats ----
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    a = np.asarray(values, dtype=np.float64)
+    return {"count": int(a.size), "mean": float(a.mean()), "p50": float(np.percentile(a, 50)),
+            "p95": float(np.percentile(a, 95)), "p99": float(np.percentile(a, 99)), "max": float(a.max())}
+
+class SpanCollector:
+    """Tracing sink: raw per-stage durations (ms) of every finished trace."""
+    def __init__(self):
+        self.stages: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, rec: Dict[str, Any]) -> None:
+        with self._lock:
+            self.stages.setdefault(rec["name"], []).append(rec["total_ms"])
+            for s in rec["spans"]:
+                self.stages.setdefault(s["name"], []).append(s["ms"])
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {name: percentiles(v) for name, v in sorted(self.stages.items())}
+
+
+# ---- benchmarks ----
+def bench_retrieval(retriever, queries: List[Dict[str, Any]], ks: List[int]) -> Dict[str, Any]:
+    kmax = max(ks)
+    hits = {k: 0 for k in ks}
+    act_hits = {k: 0 for k in ks}
+    rr, lat = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        items = retriever.search(q["query"], top_k=kmax)
+        lat.append((time.perf_counter() - t0) * 1000)
+        relevant = set(q["relevant"])
+        ranks = [i for i, it in enumerate(items) if it["id"] in relevant]
+        rr.append(1.0 / (ranks[0] + 1) if ranks else 0.0)
+        for k in ks:
+            hits[k] += bool(ranks and ranks[0] < k)
+            act_hits[k] += any(it["meta"].get("act") == q["act"] for it in items[:k])
+    n = max(1, len(queries))
+    return {
+        "queries": len(queries),
+        **{f"recall@{k}": hits[k] / n for k in ks},
+        **{f"act_hit@{k}": act_hits[k] / n for k in ks},
+        "mrr": float(np.mean(rr)) if rr else 0.0,
+        "search_ms": percentiles(lat),
+    }
+
+def bench_load(engine, queries: List[Dict[str, Any]], users: int, turns: int) -> Dict[str, Any]:
+    run = uuid.uuid4().hex[:8]
+    user_ids = [f"bench_{run}_{u}" for u in range(users)]
+    lat: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def simulate(u: int):
+        nonlocal errors
+        session = str(uuid.uuid4())
+        for t in range(turns):
+            q = queries[(u * turns + t) % len(queries)]["query"]
+            t0 = time.perf_counter()
+            try:
+                engine.answer(user_id=user_ids[u], session_id=session, query=q)
+            except Exception as e:
+                with lock:
+                    errors += 1
+                print(f"[bench] user {u} turn {t} failed: {e}")
+                continue
+            with lock:
+                lat.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        list(pool.map(simulate, range(users)))
+    wall = time.perf_counter() - t0
+
+    engine.memory.flush()
+    for uid in user_ids:
+        engine.memory.delete_user(uid)
+    return {
+        "users": users,
+        "turns_per_user": turns,
+        "requests": len(lat),
+        "errors": errors,
+        "wall_s": wall,
+        "throughput_rps": len(lat) / wall if wall else 0.0,
+        "latency_ms": percentiles(lat),
+    }
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+def run(n_queries: int = 200, ks=(1, 3, 5, 10), users: int = 8, turns: int = 5, llm_latency_ms: float = 300.0,
+        seed: int = 0, with_cache: bool = False, skip_load: bool = False) -> Dict[str, Any]:
+    from rag_pipeline import RAGEngine
+
+    queries = derive_queries(n_queries, seed)
+    if not queries:
+        raise SystemExit("No labelled queries could be derived from data/processed.")
+    engine = RAGEngine(llm=StubLLM(llm_latency_ms))
+    if not with_cache:
+        engine.cache = None  # repeated benchmark queries would otherwise skip generation
+
+    tracing.enable(True)
+    collector = SpanCollector()
+    tracing.add_sink(collector)
+    try:
+        retrieval = bench_retrieval(engine.retriever, queries, list(ks))
+        load = None if skip_load else bench_load(engine, queries, users, turns)
+    finally:
+        tracing.remove_sink(collector)
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.time(),
+        "config": {name: getattr(config, name) for name in (
+            "EMB_MODEL", "EMB_BACKEND", "MAX_CHARS", "OVERLAP", "TOP_KB_SNIPPETS", "TOP_MEMORY_AFTER_SCORE",
+            "MAX_MEMORY_CANDIDATES", "HYBRID_SEARCH", "HYBRID_CANDIDATES", "RERANK_ENABLED",
+            "CONTEXT_TOKEN_BUDGET")},
+        "params": {"queries": len(queries), "seed": seed, "llm_latency_ms": llm_latency_ms, "with_cache": with_cache},
+        "retrieval": retrieval,
+        "load": load,
+        "stages_ms": collector.summary(),
+    }
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", default="1,3,5,10", help="comma-separated cutoffs for recall@k")
+    ap.add_argument("--users", type=int, default=8, help="concurrent simulated users")
+    ap.add_argument("--turns", type=int, default=5, help="questions per user")
+    ap.add_argument("--llm-latency-ms", type=float, default=300.0, help="stub LLM response time")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--with-cache", action="store_true", help="keep the semantic answer cache on")
+    ap.add_argument("--skip-load", action="store_true", help="retrieval metrics only")
+    ap.add_argument("--out", type=Path, help="also write the JSON report here")
+    args = ap.parse_args()
+    report = run(args.queries, [int(k) for k in args.k.split(",")], args.users, args.turns, args.llm_latency_ms,
+                 args.seed, args.with_cache, args.skip_load)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        args.out.write_text(text, encoding="utf-8")
@@ -1,14 +1,22 @@
 import json, glob
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
-import chromadb
-from sentence_transformers import SentenceTransformer
 from tqdm import tqdm
 
-from config import DATA_PROCESSED, NOTES_DIR, VECTOR_DIR, KB_COLLECTION, EMB_MODEL, MAX_CHARS, OVERLAP, STATE_DIR
+from config import (
+    DATA_PROCESSED, NOTES_DIR, VECTOR_DIR, KB_COLLECTION, MAX_CHARS, OVERLAP, STATE_DB, LEGACY_STATE_JSON,
+    INDEX_BATCH_SIZE, LEXICAL_DIR, SECTION_INDEX_PATH, CHUNKER, NEAR_DUP_ENABLED, NEAR_DUP_ACT_PAIRS,
+)
 from utils import soft_clean, sliding_chunks, sha256_text
+from chunker import structure_chunks
+from near_dup import EquivalenceMap, build_equivalences
 from state_registry import StateRegistry
+from embeddings import get_embedder
+from vector_store import get_client, finish_swap
+from lexical_index import build_lexical_index, iter_collection
+from section_index import SectionIndexBuilder
 
 def load_jsonl(path: Path):
     with path.open("r", encoding="utf-8") as f:
@@ -26,7 +34,33 @@ def load_notes():
             "source_file": str(p)
         }
 
-def make_docs():
+def chunk_text(raw: str, skip_sections=frozenset()):
+    # PDF-extracted statute text: layout-normalised, boundary-aware chunks
+    if CHUNKER == "structure":
+        return structure_chunks(raw, skip_sections=skip_sections)
+    return sliding_chunks(soft_clean(raw), MAX_CHARS, OVERLAP)
+
+def near_duplicates() -> EquivalenceMap:
+    """Sections of superseded acts that their 2023 replacement re-enacts (folded, not embedded twice)."""
+    if not NEAR_DUP_ENABLED or CHUNKER != "structure":
+        return EquivalenceMap()
+    acts = {a for pair in NEAR_DUP_ACT_PAIRS for a in pair}
+    texts = {}
+    for jf in sorted(DATA_PROCESSED.glob("*.jsonl")):
+        for rec in load_jsonl(jf):
+            act = rec.get("act", jf.stem)
+            if act in acts:
+                texts.setdefault(act, []).append(rec.get("content") or rec.get("text",""))
+    eq = build_equivalences(texts, NEAR_DUP_ACT_PAIRS)
+    print(f"✓ Near-duplicates: {eq.folded()} sections folded into their 2023 equivalents")
+    return eq
+
+def record_id(content: str) -> str:
+    # lineage of a chunk: which source record it was cut from (context_builder merges on it)
+    return sha256_text(content)[:16]
+
+def make_docs(eq: EquivalenceMap | None = None):
+    eq = eq or EquivalenceMap()
     # All law sections from jsonl
     for jf in sorted(DATA_PROCESSED.glob("*.jsonl")):
         for rec in load_jsonl(jf):
@@ -34,22 +68,29 @@ def make_docs():
             act = rec.get("act", jf.stem)
             sec = (rec.get("section_number") or "").strip()
             title = (rec.get("section_title") or "").strip()
-            content = soft_clean(rec.get("content") or rec.get("text",""))
+            content = rec.get("content") or rec.get("text","")
 
-            if not content:
+            if not content.strip():
                 continue
 
             base_meta = {
                 "act": act,
                 "section_number": sec,
                 "section_title": title,
-                "source_file": jf.name
+                "source_file": jf.name,
+                "record": record_id(content),  # sub_index counts within this record
             }
+            if CHUNKER == "structure":
+                base_meta["chunker"] = "structure"
             # Sub-chunk if extremely long
-            for idx, chunk in enumerate(sliding_chunks(content, MAX_CHARS, OVERLAP)):
+            for idx, chunk in enumerate(chunk_text(content, eq.skip.get(act, frozenset()))):
+                meta = {**base_meta, "sub_index": idx}
+                equivalents = eq.for_chunk(act, chunk)
+                if equivalents:
+                    meta["equivalents"] = equivalents
                 yield {
                     "text": chunk,
-                    "meta": {**base_meta, "sub_index": idx}
+                    "meta": meta
                 }
 
     # Add manual notes
@@ -59,7 +100,8 @@ def make_docs():
             "act": rec["act"],
             "section_number": rec["section_number"],
             "section_title": rec["section_title"],
-            "source_file": rec["source_file"]
+            "source_file": rec["source_file"],
+            "record": record_id(rec["content"]),
         }
         for idx, chunk in enumerate(sliding_chunks(content, MAX_CHARS, OVERLAP)):
             yield {
@@ -67,55 +109,126 @@ def make_docs():
                 "meta": {**base_meta, "sub_index": idx}
             }
 
-def main():
+def doc_id_for(chunk_sha: str) -> str:
+    # Compose ID from sha (stable & unique)
+    return f"sha:{chunk_sha[:32]}"
+
+def batched(it, n: int):
+    buf = []
+    for x in it:
+        buf.append(x)
+        if len(buf) >= n:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
+
+def commit_batch(kb, state, docs, embs, metas, ids, shas, added_at):
+    # Chroma first, then the registry checkpoint: a crash in between only means the
+    # batch is re-upserted (same ids) on the next run.
+    kb.upsert(documents=docs, embeddings=embs, metadatas=metas, ids=ids)
+    state.add_many((sha, {"meta": m, "added_at": added_at}) for sha, m in zip(shas, metas))
+    state.save()
+
+def relabel_batch(kb, state, ids, shas, metas, prevs):
+    # metadata-only changes: same text (same id and embedding), so nothing is re-encoded;
+    # keys the chunk no longer has are removed (None deletes a metadata key in Chroma)
+    kb.update(ids=ids, metadatas=[{**{k: None for k in p["meta"] if k not in m}, **m} for m, p in zip(metas, prevs)])
+    state.add_many((sha, {**p, "meta": m}) for sha, m, p in zip(shas, metas, prevs))
+    state.save()
+
+def main(batch_size: int = INDEX_BATCH_SIZE):
     # Persistent vector client
-    client = chromadb.PersistentClient(path=str(VECTOR_DIR))
+    client = get_client()
+    finish_swap(client, KB_COLLECTION)  # before get_or_create would add to an empty stand-in
     kb = client.get_or_create_collection(
         name=KB_COLLECTION,
         metadata={"hnsw:space": "cosine"}
     )
 
     # State registry
-    state = StateRegistry(STATE_DIR / "kb_chunks.json")
+    state = StateRegistry(STATE_DB, legacy_json=LEGACY_STATE_JSON)
 
     # Embedder
-    model = SentenceTransformer(EMB_MODEL)
+    model = get_embedder()
 
-    # Gather new docs
-    new_docs, new_metas, new_ids = [], [], []
+    # Stream docs through fixed-size batches: dedup -> encode -> add -> checkpoint.
+    # The Chroma write + registry commit of batch N runs on a worker thread while
+    # batch N+1 is being encoded; memory stays bounded by ~2 batches.
     now = datetime.utcnow().isoformat()
+    total = 0
+    sections = SectionIndexBuilder()  # rebuilt from every chunk, indexed before or not
+    inflight = None
+    live = set()
+    relabeled = 0
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        for batch in batched(tqdm(make_docs(near_duplicates()), desc="Scanning docs"), batch_size):
+            docs, metas, ids, shas = [], [], [], []
+            re_ids, re_shas, re_metas, re_prevs = [], [], [], []
+            for doc in batch:
+                text = doc["text"].strip()
+                meta = doc["meta"]
+
+                chunk_sha = sha256_text(text)
+                doc_id = doc_id_for(chunk_sha)
+                sections.add(doc_id, text, meta)
+
+                # Hash for dedup (this run — the same text twice keeps its first meta — then the registry)
+                if chunk_sha in live:
+                    continue
+                live.add(chunk_sha)
+                prev = state.get(chunk_sha)
+                if prev is not None:
+                    old = prev.get("meta") or {}
+                    new = {**meta, "chunk_sha": chunk_sha, "added_at": old.get("added_at", now)}
+                    if new != old:  # e.g. indexed before `record`/`equivalents` existed
+                        re_ids.append(doc_id)
+                        re_shas.append(chunk_sha)
+                        re_metas.append(new)
+                        re_prevs.append(prev)
+                    continue
+
+                docs.append(text)
+                metas.append({**meta, "chunk_sha": chunk_sha, "added_at": now})
+                ids.append(doc_id)
+                shas.append(chunk_sha)
+
+            if re_ids:
+                relabel_batch(kb, state, re_ids, re_shas, re_metas, re_prevs)
+                relabeled += len(re_ids)
+            if not docs:
+                continue
+
+            embs = model.encode(docs, batch_size=64)
+            if inflight is not None:
+                inflight.result()  # surface errors from the previous batch before continuing
+            inflight = writer.submit(commit_batch, kb, state, docs, embs, metas, ids, shas, now)
+            total += len(docs)
 
-    for doc in tqdm(make_docs(), desc="Scanning docs"):
-        text = doc["text"].strip()
-        meta = doc["meta"]
+        if inflight is not None:
+            inflight.result()
 
-        # Hash for dedup
-        chunk_sha = sha256_text(text)
-        if state.has(chunk_sha):
-            continue
+    n = sections.save(SECTION_INDEX_PATH)
+    print(f"✓ Section index: {n} (act, section) keys → {SECTION_INDEX_PATH}")
 
-        # Compose ID from sha (stable & unique)
-        doc_id = f"sha:{chunk_sha[:32]}"
+    if relabeled:
+        print(f"✓ Updated metadata of {relabeled} indexed chunks (not re-embedded)")
 
-        new_docs.append(text)
-        new_metas.append({**meta, "chunk_sha": chunk_sha, "added_at": now})
-        new_ids.append(doc_id)
+    if total or relabeled or not (LEXICAL_DIR / "terms.json").exists():
+        # BM25 is rebuilt from the collection itself so it always mirrors what's searchable
+        n = build_lexical_index(iter_collection(kb), LEXICAL_DIR)
+        print(f"✓ BM25 index: {n} chunks → {LEXICAL_DIR}/")
 
-        # Add to state memory (we’ll persist after successful add)
-        state.add(chunk_sha, {"meta": meta, "added_at": now})
+    stale = sum(1 for sha in state.shas() if sha not in live)
+    if stale:
+        print(f"! {stale} indexed chunks are no longer produced by the sources — "
+              f"review with `python src/reconcile.py`, remove with --apply")
 
-    if not new_docs:
+    if not total:
         print("No new/changed chunks to index. You're up-to-date.")
         return
 
-    print(f"Encoding {len(new_docs)} new chunks ...")
-    embs = model.encode(new_docs, batch_size=64, show_progress_bar=True)
-
-    print("Adding to Chroma ...")
-    kb.add(documents=new_docs, embeddings=embs, metadatas=new_metas, ids=new_ids)
-
-    state.save()
-    print(f"✓ Indexed {len(new_docs)} chunks into '{KB_COLLECTION}' at {VECTOR_DIR}/")
+    print(f"✓ Indexed {total} chunks into '{KB_COLLECTION}' at {VECTOR_DIR}/")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,181 @@
+"""
+Structure-aware chunking for statute text.
+
+    python src/chunker.py --report      # compare with the old sliding-window chunker
+
+`normalize_layout` removes PDF layout noise (whitespace-only line runs and
+page breaks, `-----` rules, the duplicated marginal note before a section
+heading; amendment footnotes that interrupt the running text are moved to the
+end) and unwraps hard line breaks, keeping one line per structural unit:
+section heading, sub-section "(1)", clause "(a)"/"(iv)", Explanation,
+Illustration, proviso. `structure_chunks` packs those units into chunks of
+about CHUNK_TOKENS. A full chunk is cut at its last section heading (if at
+least CHUNK_MIN_TOKENS precede it) so sections move to the next chunk whole,
+and a unit is only split internally (at sentence or semicolon ends) when it
+alone is over budget. No overlap is needed since chunks end on boundaries.
+"""
+from __future__ import annotations
+from typing import List, Dict, Any, Iterable, Set, Tuple
+import argparse, json, math, re
+
+from config import CHUNK_TOKENS, CHUNK_MIN_TOKENS, CHARS_PER_TOKEN, DATA_PROCESSED, MAX_CHARS, OVERLAP
+from utils import soft_clean, sliding_chunks
+
+RULE_LINE = re.compile(r"(?m)^[ \t]*[-_=*]{5,}[ \t]*$")
+BLANK_RUN = re.compile(r"\n(?:[ \t]*\n)+")
+HEADING = re.compile(r"^(?:\d+\[)?(\d{1,3}[A-Z]{0,3})\.\s")
+UNIT_START = re.compile(
+    r"^(?:"
+    r"(?:\d+\[)?\d{1,3}[A-Z]{0,3}\.(?:\s|$)"          # 302. Punishment for murder.—
+    r"|\d*\*?\[?\(\d{1,3}[A-Z]{0,2}\)"                 # (1) sub-section, 2[(1A)
+    r"|\d*\*?\[?\((?:[a-z]{1,2}|[ivxl]{1,5})\)"        # (a) clause, (iv) sub-clause
+    r"|Explanations?\b|Illustrations?\b|Provided\b|Exception\b"
+    r"|CHAPTER\b|PART\b|SCHEDULE\b"
+    r")"
+)
+FOOTNOTE = re.compile(r"^\d{1,3}\.\s+(?:Subs\.|Ins\.|Rep\.|Added by|Omitted|Renumbered|The words?\b|The proviso\b)")
+LAYOUT_NOISE = re.compile(r"\s{2,}|[-_=*]{5,}")   # whitespace runs / rules beyond a single separator
+SENTENCE_END = re.compile(r"(?<=[.;:])\s+(?=[A-Z(\"'])")
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, math.ceil(len(text) / CHARS_PER_TOKEN))
+
+def normalize_layout(text: str) -> str:
+    """One line per structural unit, no layout filler."""
+    text = soft_clean(text)
+    text = RULE_LINE.sub("", text)
+    text = "\n".join(line.strip() for line in text.split("\n"))
+    text = BLANK_RUN.sub("\n\n", text)
+
+    out: List[str] = []
+    notes: List[str] = []
+    for line in text.split("\n"):
+        if not line:
+            continue  # blank runs are page/layout breaks, often mid-sentence
+        if FOOTNOTE.match(line):
+            notes.append(line)  # page-bottom amendment note: moved out of the running text
+            continue
+        if not out or UNIT_START.match(line):
+            out.append(line)
+        else:
+            # hard-wrapped continuation of the previous unit (re-join hyphenated words)
+            prev = out[-1]
+            out[-1] = prev[:-1] + line if prev.endswith("-") and not prev.endswith("--") and line[:1].islower() \
+                else prev + " " + line
+    # marginal note: "231. Counterfeiting coin." right before "231. Counterfeiting coin.--Whoever ..."
+    out = [u for u, nxt in zip(out, out[1:] + [""])
+           if not (HEADING.match(u) and len(u) < 250 and nxt != u and nxt.startswith(u.rstrip(". ")))]
+    return "\n".join(out + notes).strip()
+
+def section_units(text: str, normalized: bool = False) -> List[Tuple[str | None, str]]:
+    """(section number the unit belongs to, unit) in order; None before the first heading and for footnotes."""
+    out, sec = [], None
+    for u in (text if normalized else normalize_layout(text)).split("\n"):
+        if not u:
+            continue
+        if FOOTNOTE.match(u):
+            out.append((None, u))
+            continue
+        m = HEADING.match(u)
+        if m:
+            sec = m.group(1).upper()
+        out.append((sec, u))
+    return out
+
+def _split_unit(unit: str, budget: int) -> List[str]:
+    """Break an over-budget unit at sentence/semicolon ends, then at words as a last resort."""
+    parts, cur = [], ""
+    for sent in SENTENCE_END.split(unit):
+        if cur and estimate_tokens(cur + " " + sent) > budget:
+            parts.append(cur)
+            cur = sent
+        else:
+            cur = f"{cur} {sent}" if cur else sent
+    if cur:
+        parts.append(cur)
+    out = []
+    max_chars = int(budget * CHARS_PER_TOKEN)
+    for p in parts:
+        while len(p) > max_chars:
+            cut = p.rfind(" ", 0, max_chars)
+            cut = cut if cut > max_chars // 2 else max_chars
+            out.append(p[:cut].strip())
+            p = p[cut:].strip()
+        if p:
+            out.append(p)
+    return out
+
+def structure_chunks(text: str, max_tokens: int = CHUNK_TOKENS, min_tokens: int = CHUNK_MIN_TOKENS,
+                     skip_sections: Set[str] = frozenset()) -> List[str]:
+    """`skip_sections`: section numbers left out entirely (folded near-duplicates, see near_dup.py)."""
+    units: List[str] = []
+    for sec, line in section_units(text):
+        if sec in skip_sections:
+            continue
+        units.extend(_split_unit(line, max_tokens) if estimate_tokens(line) > max_tokens else [line])
+
+    chunks: List[str] = []
+    cur: List[str] = []
+    toks: List[int] = []
+    for u in units:
+        t = estimate_tokens(u)
+        if cur and sum(toks) + t > max_tokens:
+            # break at the last section heading in the chunk so the section moves over whole
+            cut = len(cur)
+            for i in range(len(cur) - 1, 0, -1):
+                if HEADING.match(cur[i]):
+                    if sum(toks[:i]) >= min_tokens:
+                        cut = i
+                    break
+            chunks.append("\n".join(cur[:cut]))
+            cur, toks = cur[cut:], toks[cut:]
+            if cur and sum(toks) + t > max_tokens:
+                chunks.append("\n".join(cur))
+                cur, toks = [], []
+        cur.append(u)
+        toks.append(t)
+    cur_tok = sum(toks)
+    if cur:
+        if chunks and cur_tok < min_tokens and estimate_tokens(chunks[-1]) + cur_tok <= max_tokens:
+            chunks[-1] += "\n" + "\n".join(cur)  # fold a short tail into the previous chunk
+        else:
+            chunks.append("\n".join(cur))
+    return chunks
+
+
+# ---- comparison report ----
+def _stats(chunks: Iterable[str], dim: int, hnsw_m: int) -> Dict[str, Any]:
+    n = chars = noise = 0
+    for c in chunks:
+        n += 1
+        chars += len(c)
+        noise += sum(len(m) - 1 for m in LAYOUT_NOISE.findall(c))
+    vec_bytes = n * dim * 4
+    # HNSW: the float32 vector plus ~2*M neighbour ids (int32) per node at layer 0
+    index_bytes = n * (dim * 4 + 2 * hnsw_m * 4)
+    return {"chunks": n, "chars": chars, "est_tokens": math.ceil(chars / CHARS_PER_TOKEN),
+            "layout_noise_ratio": noise / chars if chars else 0.0,
+            "vector_bytes": vec_bytes, "est_index_bytes": index_bytes}
+
+def report(dim: int = 384, hnsw_m: int = 16) -> Dict[str, Any]:
+    """Old sliding-window vs structure-aware chunking over data/processed."""
+    texts = []
+    for jf in sorted(DATA_PROCESSED.glob("*.jsonl")):
+        with jf.open("r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    rec = json.loads(line)
+                    texts.append(rec.get("content") or rec.get("text", ""))
+    old = _stats((c for t in texts for c in sliding_chunks(soft_clean(t), MAX_CHARS, OVERLAP)), dim, hnsw_m)
+    new = _stats((c for t in texts for c in structure_chunks(t)), dim, hnsw_m)
+    saved = {k: old[k] - new[k] for k in ("chunks", "chars", "est_tokens", "vector_bytes", "est_index_bytes")}
+    return {"sliding": old, "structure": new, "saved": saved,
+            "saved_ratio": {k: (saved[k] / old[k] if old[k] else 0.0) for k in saved}}
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--report", action="store_true", help="print the chunk/vector/index savings as JSON")
+    ap.add_argument("--dim", type=int, default=384, help="embedding dimension (all-MiniLM-L6-v2: 384)")
+    args = ap.parse_args()
+    print(json.dumps(report(args.dim), indent=2))
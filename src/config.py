@@ -6,24 +6,114 @@ DATA_PROCESSED = ROOT / "data" / "processed"
 NOTES_DIR = ROOT / "data" / "manual_notes"
 VECTOR_DIR = ROOT / "vectorstore"
 STATE_DIR = ROOT / "state"
+STATE_DB = STATE_DIR / "kb_chunks.sqlite3"        # chunk registry (see state_registry.py)
+LEGACY_STATE_JSON = STATE_DIR / "kb_chunks.json"  # pre-SQLite registry, migrated once
 
 # Collections
 KB_COLLECTION = "kb_india_law"
 MEMORY_COLLECTION = "conversation_memory"
 
+# Generation model (Gemini)
+GEMINI_MODEL = "gemini-1.5-flash"
+
 # Embedding model (swap later if needed)
 EMB_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# Inference backend: "torch" (SentenceTransformer), "onnx" (ONNX Runtime, no torch import)
+# or "onnx-int8" (dynamically quantized once into EMB_ONNX_DIR). Check drift with validate_embedder.py.
+EMB_BACKEND = "torch"
+EMB_ONNX_DIR = STATE_DIR / "onnx"
+EMB_MAX_SEQ_LEN = 256   # all-MiniLM-L6-v2's max_seq_length
+EMB_ONNX_THREADS = 0    # intra-op threads for ONNX Runtime (0 = runtime default)
+EMB_CACHE_SIZE = 2048   # recent query/message vectors kept in the LRU cache
+EMB_BATCH_WINDOW_MS = 5 # micro-batch window for concurrent encodes (0 = encode inline)
+EMB_MAX_BATCH = 64      # flush a micro-batch early once this many texts are queued
 
 # Chunking safeguards (applied to very long sections)
 MAX_CHARS = 1800
 OVERLAP = 150
 
+# Structure-aware chunking (see chunker.py); "sliding" keeps the MAX_CHARS/OVERLAP windows
+CHUNKER = "structure"
+CHUNK_TOKENS = 512       # target chunk size in estimated tokens (the old 1800-char window was ~450 incl. noise)
+CHUNK_MIN_TOKENS = 350   # a full chunk is only cut back to a section heading past this many tokens
+
+# Cross-act near-duplicates (see near_dup.py): sections of a superseded act that the 2023 code
+# re-enacts are folded into the canonical chunk (needs CHUNKER = "structure")
+NEAR_DUP_ENABLED = True
+NEAR_DUP_ACT_PAIRS = [("IPC", "BNS_2023"), ("CrPC", "BNSS_2023"), ("IEA1872", "BSA_2023")]  # (old, canonical)
+NEAR_DUP_JACCARD = 0.7     # exact word-3-shingle Jaccard needed to fold a candidate pair
+NEAR_DUP_SHINGLE = 3
+NEAR_DUP_NUM_PERM = 128
+NEAR_DUP_BANDS = 32        # 4 rows per band: pairs above ~0.45 Jaccard become LSH candidates
+
+# Hybrid retrieval: BM25 lexical index fused with vector search (RRF)
+LEXICAL_DIR = STATE_DIR / "bm25"
+HYBRID_SEARCH = True
+HYBRID_CANDIDATES = 30   # per-retriever pool fed into the fusion
+RRF_K = 60
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Exact citation lookup ("IPC 302", "Article 21") that skips vector search
+SECTION_INDEX_PATH = STATE_DIR / "section_index.json"
+
+# Optional cross-encoder rerank of a wider retrieval pool (see reranker.py)
+RERANK_ENABLED = False
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_BACKEND = "onnx"          # "onnx" (falls back to torch if unavailable) or "torch"
+RERANK_ONNX_FILE = "onnx/model_qint8_avx512.onnx"  # int8 export shipped in the model repo
+RERANK_POOL = 20                 # candidates retrieved before reranking down to top_k
+RERANK_BATCH_SIZE = 16
+RERANK_BUDGET_MS = 250           # per request; beyond this the fused order is kept
+RERANK_CACHE_SIZE = 20_000       # cached (query, chunk id) scores
+RERANK_MAX_CHARS = 1200          # chunk text fed to the cross-encoder (~256 tokens)
+
+# Startup: with WARM_START the UI comes up first and the engine (embedding model,
+# Chroma client, HNSW segments) is loaded in a background thread
+WARM_START = True
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 7860
+
+# Shared retrieval server (see retrieval_server.py): set the URL to have every web worker use it
+# instead of opening vectorstore/ and loading the embedder itself
+RETRIEVAL_SERVER_URL = None      # e.g. "http://127.0.0.1:7861"
+RETRIEVAL_SERVER_HOST = "127.0.0.1"
+RETRIEVAL_SERVER_PORT = 7861
+RETRIEVAL_SERVER_TIMEOUT_S = 30.0
+
+# Tracing / metrics (see tracing.py); near-zero overhead when disabled
+TRACING_ENABLED = False
+TRACE_LOG = None                 # e.g. STATE_DIR / "traces.jsonl" for one JSON line per request
+METRICS_HOST = SERVER_HOST       # "0.0.0.0" only if a scraper on another host needs it
+METRICS_PORT = None              # standalone /metrics port for non-web processes (web app serves /metrics)
+
+# Batch answering (see batch_answer.py)
+BATCH_RETRIEVE_SIZE = 64         # questions embedded + searched per kb.query call
+BATCH_CONCURRENCY = 4            # LLM calls in flight
+BATCH_RPS = 1.0                  # LLM requests per second (keep under the Gemini quota)
+BATCH_MAX_RETRIES = 5
+BATCH_BACKOFF_S = 2.0            # first retry delay; doubles per attempt, with jitter
+
+# Index build: chunks encoded + written + checkpointed per batch
+INDEX_BATCH_SIZE = 256
+
+# Reconcile / GC (see reconcile.py)
+RECONCILE_BATCH_SIZE = 500        # orphan ids deleted (and checkpointed) per batch
+COMPACT_TOMBSTONE_RATIO = 0.2     # deleted / (live + deleted) at which the collection is rebuilt
+
 
 # -------- Step 4 additions --------
 # Context window budget (characters) for Gemini 1.5 Flash prompts
 # (Gemini handles large contexts; we still budget to keep prompts fast)
 CONTEXT_CHAR_BUDGET = 24_000
 
+# Token-aware packing (context_builder.pack_context); the char budget above is kept as the baseline
+CONTEXT_TOKEN_BUDGET = 6_000
+CHARS_PER_TOKEN = 4.0
+MIN_MERGE_OVERLAP = 40        # min shared chars before two sub-chunks are stitched together
+MEMORY_DEDUP_JACCARD = 0.80   # 3-gram shingle Jaccard above which memory snippets are duplicates
+MEMORY_BLOCK_WEIGHT = 0.60    # memory relevance relative to KB when filling the budget
+
 # Memory scoring knobs
 SIM_WEIGHT = 0.60       # semantic similarity weight
 RECENCY_WEIGHT = 0.20   # freshness
@@ -36,14 +126,43 @@ RECENCY_HALFLIFE_HOURS = 24.0
 # Role weights
 ROLE_SCORES = {
     "assistant": 1.00,
-    "user": 0.90
+    "user": 0.90,
+    "summary": 0.95,   # compacted session (memory_compactor.py)
 }
 
 # Session continuity bonus
 SAME_SESSION_BONUS = 1.00
 DIFFERENT_SESSION_BONUS = 0.60
 
+# Write-behind memory persistence (see memory_writer.py)
+MEMORY_FLUSH_EVERY = 32          # flush once this many messages are queued...
+MEMORY_FLUSH_MS = 200            # ...or at least this often
+MEMORY_JOURNAL = STATE_DIR / "memory_journal.jsonl"
+MEMORY_JOURNAL_FSYNC = True      # fsync each journal append (crash-safe turns)
+
+# Memory sharding: users hashed over small collections; small histories searched exactly
+MEMORY_BUCKETS = 32              # conversation_memory_00 .. _31
+MEMORY_EXACT_MAX = 2000          # users up to this many messages skip ANN (brute-force cosine)
+MEMORY_USER_CACHE = 256          # users whose vectors are kept in RAM (LRU)
+MEMORY_CATALOG_DB = STATE_DIR / "memory_catalog.sqlite3"  # session list + time-ordered message index
+
+# Memory compaction (see memory_compactor.py): old turns of closed sessions -> one summary per session
+MEMORY_RECENT_TURNS = 50         # newest raw turns per user that are never folded
+MEMORY_SESSION_IDLE_HOURS = 6.0  # a session with no message for this long is closed
+MEMORY_SUMMARISER = "extractive" # or "gemini"
+MEMORY_SUMMARY_SENTENCES = 8
+MEMORY_SUMMARY_MAX_CHARS = 1200
+MEMORY_SUMMARY_TOP = 2           # summary tier: at most this many of the memory snippets in a prompt
+
+# Semantic answer cache in front of Gemini (see answer_cache.py)
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_PATH = STATE_DIR / "answer_cache.sqlite3"
+ANSWER_CACHE_THRESHOLD = 0.95    # min cosine between the new and the cached query
+ANSWER_CACHE_TTL_HOURS = 24 * 7
+ANSWER_CACHE_MAX = 5000          # LRU-evicted beyond this many entries
+
 # Limits
-MAX_MEMORY_CANDIDATES = 30   # pull this many from Chroma before scoring trim
+MAX_MEMORY_CANDIDATES = 64   # pull this many from Chroma before scoring trim
+MAX_MEMORY_CANDIDATES_CAP = 512  # adaptive pool growth stops here
 TOP_MEMORY_AFTER_SCORE = 8   # final memory snippets to include in prompt
 TOP_KB_SNIPPETS = 6          # legal chunks to include
\ No newline at end of file
@@ -1,7 +1,13 @@
 from __future__ import annotations
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
+import json, math
 
-from config import CONTEXT_CHAR_BUDGET, TOP_KB_SNIPPETS, TOP_MEMORY_AFTER_SCORE
+from config import (
+    CONTEXT_CHAR_BUDGET, CONTEXT_TOKEN_BUDGET, CHARS_PER_TOKEN, TOP_KB_SNIPPETS, TOP_MEMORY_AFTER_SCORE,
+    OVERLAP, MIN_MERGE_OVERLAP, MEMORY_DEDUP_JACCARD, MEMORY_BLOCK_WEIGHT
+)
+from near_dup import parse_equivalents, format_equivalents
+from tracing import span
 
 def _clip_char_budget(blocks: List[Dict[str, str]], budget: int) -> List[Dict[str, str]]:
     total = 0
@@ -20,23 +26,160 @@ def _clip_char_budget(blocks: List[Dict[str, str]], budget: int) -> List[Dict[st
             break
     return out
 
-def build_context_blocks(
+def estimate_tokens(text: str) -> int:
+    # ~4 chars/token for English legal text; close enough to budget Gemini prompts
+    return max(1, math.ceil(len(text) / CHARS_PER_TOKEN))
+
+def _overlap(a: str, b: str, max_k: int) -> int:
+    """Length of the longest suffix of `a` that is a prefix of `b` (0 if below MIN_MERGE_OVERLAP)."""
+    for k in range(min(len(a), len(b), max_k), MIN_MERGE_OVERLAP - 1, -1):
+        if a.endswith(b[:k]):
+            return k
+    return 0
+
+def _merge_adjacent(kb_sel: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Stitch consecutive sub-chunks of the same source record back into one block,
+    dropping the repeated sliding-window overlap (structure chunks have none and
+    are joined line-wise). Blocks keep the rank of their best part.
+
+    sub_index counts within a record, so parts are grouped by the `record`
+    lineage id. Chunks indexed without one fall back to (act, section, file),
+    which doesn't identify a record: those only merge when the overlap proves
+    adjacency.
+    """
+    groups: Dict[tuple, List[Dict[str, Any]]] = {}
+    for b in kb_sel:
+        m = b["meta"]
+        key = ("record", m["record"]) if m.get("record") else (m.get("act"), m.get("section_number"), m.get("source_file"))
+        groups.setdefault(key, []).append(b)
+    merged = []
+    for parts in groups.values():
+        parts.sort(key=lambda b: b["meta"].get("sub_index", 0))
+        cur = dict(parts[0])
+        for nxt in parts[1:]:
+            joined = None
+            if nxt["meta"].get("sub_index", 0) == cur["meta"].get("sub_index_end", cur["meta"].get("sub_index", 0)) + 1:
+                if nxt["meta"].get("chunker") == "structure":
+                    # no overlap to check: adjacent only if both come from the same record
+                    if nxt["meta"].get("record") and nxt["meta"].get("record") == cur["meta"].get("record"):
+                        joined = cur["content"] + "\n" + nxt["content"]
+                else:
+                    k = _overlap(cur["content"], nxt["content"], 2 * OVERLAP)
+                    joined = cur["content"] + nxt["content"][k:] if k else None
+            if joined is not None:
+                cur["content"] = joined
+                cur["meta"] = {**cur["meta"], "sub_index_end": nxt["meta"].get("sub_index", 0)}
+                if nxt["meta"].get("equivalents"):
+                    eqs = parse_equivalents(cur["meta"]) + parse_equivalents(nxt["meta"])
+                    cur["meta"]["equivalents"] = json.dumps([list(e) for e in dict.fromkeys(eqs)])
+                cur["relevance"] = max(cur["relevance"], nxt["relevance"])
+                cur["rank"] = min(cur["rank"], nxt["rank"])
+            else:
+                merged.append(cur)
+                cur = dict(nxt)
+        merged.append(cur)
+    return merged
+
+def _shingles(text: str, n: int = 3) -> set:
+    words = text.lower().split()
+    return {" ".join(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+
+def _drop_near_duplicates(mem_sel: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # exact shingle Jaccard — with <= TOP_MEMORY_AFTER_SCORE snippets this is cheaper than MinHash
+    kept, kept_sh = [], []
+    for b in mem_sel:
+        sh = _shingles(b["content"])
+        if any(len(sh & k) / max(1, len(sh | k)) >= MEMORY_DEDUP_JACCARD for k in kept_sh):
+            continue
+        kept.append(b)
+        kept_sh.append(sh)
+    return kept
+
+def _relevance(hits: List[Dict[str, Any]], get) -> List[float]:
+    vals = [get(h) for h in hits]
+    vals = [v if isinstance(v, (int, float)) else 0.0 for v in vals]
+    top = max(vals, default=0.0)
+    # normalise within the source; rank-decay keeps order meaningful when scores tie or are missing
+    return [((v / top) if top > 0 else 1.0) / (1.0 + 0.1 * i) for i, v in enumerate(vals)]
+
+def pack_context(
     *,
     kb_hits: List[Dict[str, Any]],
     mem_hits: List[Dict[str, Any]],
     kb_top: int = TOP_KB_SNIPPETS,
     mem_top: int = TOP_MEMORY_AFTER_SCORE,
-    budget_chars: int = CONTEXT_CHAR_BUDGET
-) -> List[Dict[str, Any]]:
-    # Select top-N from each source
-    kb_sel = [{"type":"kb", "content": h["content"], "meta": h["meta"]} for h in kb_hits[:kb_top]]
-    mem_sel = [{"type":"memory", "content": h["content"], "meta": h["meta"]} for h in mem_hits[:mem_top]]
+    budget_tokens: int = CONTEXT_TOKEN_BUDGET
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Token-budgeted context: merge overlapping KB sub-chunks, drop near-duplicate
+    memory turns, then fill the budget greedily by relevance per token with whole
+    blocks only. Returns (blocks, stats) where stats compares against the old
+    character-clipped packing.
+    """
+    with span("context.pack") as sp:
+        blocks, stats = _pack(kb_hits, mem_hits, kb_top, mem_top, budget_tokens)
+        sp.set(candidates=stats["blocks"] + stats["dropped_blocks"], context_tokens=stats["context_tokens"])
+    return blocks, stats
+
+def _pack(kb_hits, mem_hits, kb_top: int, mem_top: int, budget_tokens: int):
+    kb_hits, mem_hits = kb_hits[:kb_top], mem_hits[:mem_top]
+    kb_rel = _relevance(kb_hits, lambda h: h.get("score"))
+    mem_rel = _relevance(mem_hits, lambda h: h.get("scores", {}).get("final"))
+    kb_sel = [{"type": "kb", "content": h["content"], "meta": h["meta"], "relevance": r, "rank": i}
+              for i, (h, r) in enumerate(zip(kb_hits, kb_rel))]
+    mem_sel = [{"type": "memory", "content": h["content"], "meta": h["meta"], "relevance": MEMORY_BLOCK_WEIGHT * r,
+                "rank": i, "id": h.get("id")} for i, (h, r) in enumerate(zip(mem_hits, mem_rel))]
+
+    candidates = _merge_adjacent(kb_sel) + _drop_near_duplicates(mem_sel)
+    for c in candidates:
+        c["tokens"] = estimate_tokens(c["content"])
+
+    chosen, used = [], 0
+    best_kb = min((c for c in candidates if c["type"] == "kb"), key=lambda c: c["rank"], default=None)
+    if best_kb is not None and best_kb["tokens"] <= budget_tokens:
+        chosen.append(best_kb)  # the top legal chunk always goes in when it fits
+        used += best_kb["tokens"]
+    for c in sorted(candidates, key=lambda c: c["relevance"] / c["tokens"], reverse=True):
+        if c is best_kb:
+            continue
+        if used + c["tokens"] <= budget_tokens:
+            chosen.append(c)
+            used += c["tokens"]
 
     # Interleave: KB first (authoritative), then Memory (personalization)
-    blocks = kb_sel + mem_sel
+    chosen.sort(key=lambda c: (c["type"] != "kb", c["rank"]))
+    blocks = [{"type": c["type"], "content": c["content"], "meta": c["meta"]} for c in chosen]
+
+    baseline = _clip_char_budget(
+        [{"type": "kb", "content": h["content"], "meta": h["meta"]} for h in kb_hits] +
+        [{"type": "memory", "content": h["content"], "meta": h["meta"]} for h in mem_hits],
+        CONTEXT_CHAR_BUDGET,
+    )
+    baseline_tokens = sum(estimate_tokens(b["content"]) for b in baseline)
+    stats = {
+        "context_tokens": used,
+        "baseline_tokens": baseline_tokens,
+        "tokens_saved": max(0, baseline_tokens - used),
+        "blocks": len(blocks),
+        "dropped_blocks": len(candidates) - len(chosen),
+        "merged_kb_chunks": len(kb_sel) - sum(1 for c in candidates if c["type"] == "kb"),
+        "dropped_duplicate_memory": len(mem_sel) - sum(1 for c in candidates if c["type"] == "memory"),
+        "memory_ids": [c["id"] for c in chosen if c["type"] == "memory"],
+    }
+    return blocks, stats
 
-    # Enforce char budget
-    return _clip_char_budget(blocks, budget_chars)
+def build_context_blocks(
+    *,
+    kb_hits: List[Dict[str, Any]],
+    mem_hits: List[Dict[str, Any]],
+    kb_top: int = TOP_KB_SNIPPETS,
+    mem_top: int = TOP_MEMORY_AFTER_SCORE,
+    budget_tokens: int = CONTEXT_TOKEN_BUDGET
+) -> List[Dict[str, Any]]:
+    blocks, _ = pack_context(kb_hits=kb_hits, mem_hits=mem_hits, kb_top=kb_top, mem_top=mem_top,
+                             budget_tokens=budget_tokens)
+    return blocks
 
 def render_prompt(query: str, blocks: List[Dict[str, Any]]) -> str:
     # Compose a grounded, citation-friendly prompt
@@ -52,6 +195,10 @@ def render_prompt(query: str, blocks: List[Dict[str, Any]]) -> str:
         meta = b.get("meta", {})
         if b["type"] == "kb":
             title = f"{meta.get('act','Law')} &{meta.get('section_number','')} {meta.get('section_title','')}".strip()
+            equivalents = format_equivalents(meta)
+            if equivalents:
+                # folded near-duplicates: the same text also answers for the old-code section
+                title += f"\nEquivalent provisions: {equivalents}"
             parts.append(f"[KB {i}] {title}\n{b['content']}\n")
         else:
             who = meta.get("role", "user")
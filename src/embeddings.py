@@ -0,0 +1,293 @@
+from __future__ import annotations
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import List, Sequence, Any, Callable
+import os, queue, threading, time
+
+import numpy as np
+
+from config import (
+    EMB_MODEL, EMB_BACKEND, EMB_ONNX_DIR, EMB_MAX_SEQ_LEN, EMB_ONNX_THREADS, EMB_CACHE_SIZE,
+    EMB_BATCH_WINDOW_MS, EMB_MAX_BATCH,
+)
+from utils import sha256_text
+from tracing import span, add_collector
+
+
+class OnnxEncoder:
+    """
+    Sentence-transformers compatible encoder on ONNX Runtime (no torch import):
+    tokenizer.json + onnx/model.onnx from the model repo, mean pooling over the
+    attention mask and L2 normalisation — the same pipeline as all-MiniLM-L6-v2's
+    modules.json, so vectors stay comparable with the existing collections.
+    With `int8=True` the graph is dynamically quantized once into `cache_dir`.
+    """
+    def __init__(self, model_name: str = EMB_MODEL, int8: bool = False, cache_dir: Path = EMB_ONNX_DIR,
+                 max_seq_len: int = EMB_MAX_SEQ_LEN, threads: int = EMB_ONNX_THREADS):
+        import onnxruntime as ort
+        from huggingface_hub import hf_hub_download
+        from tokenizers import Tokenizer
+
+        model_path = Path(hf_hub_download(model_name, "onnx/model.onnx"))
+        if int8:
+            model_path = self._quantized(model_path, cache_dir / model_name.replace("/", "__"))
+        self.tokenizer = Tokenizer.from_file(hf_hub_download(model_name, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_seq_len)
+        self.tokenizer.enable_padding()
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(str(model_path), opts, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    @staticmethod
+    def _quantized(src: Path, out_dir: Path) -> Path:
+        dst = out_dir / "model_int8.onnx"
+        if not dst.exists():
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            out_dir.mkdir(parents=True, exist_ok=True)
+            tmp = dst.with_suffix(".tmp.onnx")
+            quantize_dynamic(str(src), str(tmp), weight_type=QuantType.QInt8)
+            os.replace(tmp, dst)
+            print(f"[embeddings] int8 model written to {dst}")
+        return dst
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        enc = self.tokenizer.encode_batch(texts)
+        ids = np.array([e.ids for e in enc], dtype=np.int64)
+        mask = np.array([e.attention_mask for e in enc], dtype=np.int64)
+        feeds = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in enc], dtype=np.int64)
+        hidden = self.session.run(None, feeds)[0]                     # (batch, seq, dim)
+        m = mask[..., None].astype(np.float32)
+        pooled = (hidden * m).sum(axis=1) / np.clip(m.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def encode(self, texts, batch_size: int = 32, show_progress_bar: bool = False, **_) -> np.ndarray:
+        texts = [texts] if isinstance(texts, str) else list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        # sort by length so padding per batch stays small, then restore input order
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        out: List[np.ndarray] = [None] * len(texts)  # type: ignore[list-item]
+        for start in range(0, len(order), max(1, batch_size)):
+            idx = order[start:start + batch_size]
+            for i, v in zip(idx, self._encode_batch([texts[i] for i in idx])):
+                out[i] = v
+        return np.stack(out).astype(np.float32)
+
+
+def load_encoder(model_name: str = EMB_MODEL, backend: str = EMB_BACKEND):
+    """Encoder object with a SentenceTransformer-style `encode` for the configured backend."""
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxEncoder(model_name, int8=(backend == "onnx-int8"))
+    if backend != "torch":
+        raise ValueError(f"Unknown EMB_BACKEND {backend!r} (expected 'torch', 'onnx' or 'onnx-int8')")
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+
+class EmbeddingBatcher:
+    """
+    Micro-batching scheduler: encode requests from concurrent sessions are
+    collected for up to `window_ms` (or until `max_batch` texts are queued)
+    and run as one forward pass; each caller gets its own vector via a Future.
+    """
+    def __init__(self, encode_fn: Callable[[List[str]], Any], window_ms: float = EMB_BATCH_WINDOW_MS,
+                 max_batch: int = EMB_MAX_BATCH):
+        self.encode_fn = encode_fn
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._q: "queue.Queue[tuple[str, Future]]" = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.max_seen = 0
+        self.size_hist: dict = {}   # batch size -> count
+
+    def _ensure_worker(self) -> None:
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="emb-batcher", daemon=True)
+                    self._thread.start()
+
+    def submit(self, texts: Sequence[str]) -> List[Future]:
+        self._ensure_worker()
+        futs = []
+        for t in texts:
+            f: Future = Future()
+            self._q.put((t, f))
+            futs.append(f)
+        return futs
+
+    def _collect(self) -> list:
+        batch = [self._q.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._q.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            try:
+                vecs = self.encode_fn([t for t, _ in batch])
+            except Exception as e:
+                for _, f in batch:
+                    f.set_exception(e)
+            else:
+                for (_, f), v in zip(batch, vecs):
+                    f.set_result(v)
+            with self._stats_lock:
+                n = len(batch)
+                self.batches += 1
+                self.items += n
+                self.max_seen = max(self.max_seen, n)
+                self.size_hist[n] = self.size_hist.get(n, 0) + 1
+
+    def metrics(self) -> dict:
+        with self._stats_lock:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": (self.items / self.batches) if self.batches else 0.0,
+                "max_batch_size": self.max_seen,
+                "batch_size_hist": dict(sorted(self.size_hist.items())),
+                "queue_depth": self._q.qsize(),
+            }
+
+
+class EmbeddingService:
+    """
+    Single embedding model per process, shared by the retriever, the memory
+    store and the index builder. Short texts (queries, chat messages) go through
+    an LRU cache keyed by text hash, so a query is encoded once per chat turn.
+    Cache misses are micro-batched across threads (see EmbeddingBatcher) unless
+    EMB_BATCH_WINDOW_MS is 0.
+    """
+    def __init__(self, model_name: str = EMB_MODEL, cache_size: int = EMB_CACHE_SIZE, backend: str = EMB_BACKEND):
+        self.model_name = model_name
+        self.backend = backend
+        self.model = load_encoder(model_name, backend)
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight: dict = {}   # text hash -> Future, so concurrent identical texts share one encode
+        self.hits = 0
+        self.misses = 0
+        self.batcher = (
+            EmbeddingBatcher(lambda texts: self.model.encode(texts, batch_size=len(texts)))
+            if EMB_BATCH_WINDOW_MS > 0 else None
+        )
+        if self.batcher is not None:
+            add_collector("embeddings", self._collect)
+
+    # ---- cache ----
+    def _get_cached(self, key: str):
+        with self._lock:
+            vec = self._cache.get(key)
+            if vec is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return vec
+
+    def _put_cached(self, key: str, vec) -> None:
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            self._cache[key] = vec
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # ---- encode ----
+    def embed(self, text: str):
+        """Vector for one query/message (cached)."""
+        return self.embed_many([text])[0]
+
+    def embed_many(self, texts: Sequence[str]) -> List[Any]:
+        """Vectors for a few short texts; only cache misses hit the model, in one batch."""
+        keys = [sha256_text(t) for t in texts]
+        out: List[Any] = [self._get_cached(k) for k in keys]
+        missing = [i for i, v in enumerate(out) if v is None]
+        if missing:
+            with span("embed", candidates=len(missing)):
+                # encode each distinct missing text once
+                uniq = list(dict.fromkeys(keys[i] for i in missing))
+                by_key = {keys[i]: texts[i] for i in missing}
+                if self.batcher is None:
+                    fresh = dict(zip(uniq, self.model.encode([by_key[k] for k in uniq])))
+                else:
+                    fresh = self._encode_batched(uniq, by_key)
+            for k, v in fresh.items():
+                self._put_cached(k, v)
+            for i in missing:
+                out[i] = fresh[keys[i]]
+        return out
+
+    def _encode_batched(self, keys: List[str], by_key: dict) -> dict:
+        futs = {}
+        with self._lock:
+            owned = [k for k in keys if k not in self._inflight]
+            for k in keys:
+                if k in self._inflight:
+                    futs[k] = self._inflight[k]
+            # queue puts only; cheap enough to do under the lock so a text is never submitted twice
+            for k, f in zip(owned, self.batcher.submit([by_key[k] for k in owned])):
+                futs[k] = self._inflight[k] = f
+        try:
+            return {k: futs[k].result() for k in keys}
+        finally:
+            with self._lock:
+                for k in owned:
+                    if self._inflight.get(k) is futs[k]:
+                        del self._inflight[k]
+
+    def encode(self, texts: Sequence[str], batch_size: int = 64, show_progress_bar: bool = False):
+        """Bulk, uncached encode (index builds) — avoids flooding the query cache."""
+        return self.model.encode(list(texts), batch_size=batch_size, show_progress_bar=show_progress_bar)
+
+    def cache_info(self) -> dict:
+        with self._lock:
+            return {"size": len(self._cache), "max": self.cache_size, "hits": self.hits, "misses": self.misses}
+
+    def batch_metrics(self) -> dict:
+        return self.batcher.metrics() if self.batcher else {}
+
+    def _collect(self):
+        m = self.batch_metrics()
+        return [
+            ("rag_embed_batches_total", {}, m["batches"]),
+            ("rag_embed_items_total", {}, m["items"]),
+            ("rag_embed_batch_size_avg", {}, m["avg_batch_size"]),
+            ("rag_embed_batch_size_max", {}, m["max_batch_size"]),
+            ("rag_embed_queue_depth", {}, m["queue_depth"]),
+        ]
+
+
+_service: EmbeddingService | None = None
+_service_lock = threading.Lock()
+
+def get_embedder() -> EmbeddingService:
+    """Process-wide EmbeddingService (model loaded on first use)."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = EmbeddingService()
+    return _service
@@ -1,5 +1,6 @@
 # src/ingest_laws.py
-import os, pathlib, re, json, requests
+import argparse, hashlib, os, pathlib, re, json, requests
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pypdf import PdfReader
 from tqdm import tqdm
 
@@ -49,13 +50,15 @@ def pdf_to_text(pdf_path):
         #print(page.extract_text())
     return "\n".join(text)
 
-def clean_text(s):
+def _clean(s):
     s = s.replace("\x00", "")
     s = re.sub(r"[ \t]+", " ", s)
     s = re.sub(r"\n{3,}", "\n\n", s)
     s = re.sub(r"\n\d+\s*/\s*\d+\s*\n", "\n", s)
-    #print(s.strip())
-    return s.strip()
+    return s
+
+def clean_text(s):
+    return _clean(s).strip()
 
 SEP_PATTERN = re.compile(r"(?m)^(Section|Article)\s+(\d+[A-Za-z\-]*)\b.*",re.IGNORECASE)
 
@@ -75,11 +78,184 @@ def save_jsonl(sections, outf):
         for sec in sections:
             w.write(json.dumps({"text": sec}, ensure_ascii=False) + "\n")
 
-if __name__ == "__main__":
-    download_pdfs()
-    for pdf in tqdm(sorted(RAW.glob("*.pdf"))):
-        txt = clean_text(pdf_to_text(pdf))
-        secs = split_sections(txt)
+# ---------------- parallel / incremental ingest ----------------
+
+MANIFEST = pathlib.Path("state/ingest_manifest.json")
+SHARD_PAGES = 150  # PDFs longer than this are split into page-range shards
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def page_texts(pdf_path, start=0, end=None):
+    """Yield the raw text of pages [start, end), as pdf_to_text() would join them."""
+    reader = PdfReader(str(pdf_path))
+    for page in reader.pages[start:end]:
+        yield page.extract_text() or ""
+
+def extract_shard(pdf_path, start, end):
+    return list(page_texts(pdf_path, start, end))
+
+def _last_cut(s):
+    # start of the last line beginning with no digit, whitespace or "/": no clean_text
+    # pattern (space runs, blank-line runs, "12 / 340" page-number lines) can span it
+    i = len(s)
+    while True:
+        i = s.rfind("\n", 0, i)
+        if i < 0:
+            return 0
+        if i + 1 < len(s) and not (s[i + 1].isspace() or s[i + 1].isdigit() or s[i + 1] == "/"):
+            return i + 1
+
+def clean_stream(pages):
+    """
+    clean_text("\n".join(pages)), yielded in pieces: the joined text is cleaned
+    up to the last line that can't take part in a match, the rest waits for
+    the next page. Concatenated, the pieces equal the serial path exactly.
+    """
+    buf, first, ws = "", True, ""
+    def emit(part):
+        nonlocal first, ws
+        if first:
+            part = part.lstrip()
+            if not part:
+                return None
+            first = False
+        body = part.rstrip()
+        if not body:  # trailing whitespace only survives if more text follows
+            ws += part
+            return None
+        out, ws = ws + body, part[len(body):]
+        return out
+    for i, page in enumerate(pages):
+        page = page.replace("\x00", "")  # before choosing a cut: a NUL can hide a blank line
+        buf = buf + "\n" + page if i else page
+        cut = _last_cut(buf)
+        if cut:
+            out = emit(_clean(buf[:cut]))
+            buf = buf[cut:]
+            if out:
+                yield out
+    out = emit(_clean(buf))
+    if out:
+        yield out
+
+def clean_pages(pdf_path, start=0, end=None):
+    """Yield cleaned text for pages [start, end) — never the whole document at once."""
+    return clean_stream(page_texts(pdf_path, start, end))
+
+_HEAD_PENDING = re.compile(r"(?im)^(?:Section|Article)\s*\Z")
+
+def iter_sections(chunks):
+    r"""
+    Streaming split_sections over pieces of one text: holds only the section
+    currently being read. A heading counts once the line after it has started
+    (`\b` and `\s+` could still change with the next piece); until the first
+    one, only a tail that could still become a heading is kept.
+    """
+    buf = ""
+    for chunk in chunks:
+        buf += chunk
+        heads = [m.start() for m in SEP_PATTERN.finditer(buf) if m.end() < len(buf)]
+        if not heads:
+            # nothing confirmed yet: text before the first heading is dropped, as in split_sections
+            last = list(SEP_PATTERN.finditer(buf)) or list(_HEAD_PENDING.finditer(buf))
+            buf = buf[last[-1].start() if last else buf.rfind("\n") + 1:]
+            continue
+        for a, b in zip(heads, heads[1:]):
+            yield buf[a:b].strip()
+        buf = buf[heads[-1]:]
+    heads = [m.start() for m in SEP_PATTERN.finditer(buf)] + [len(buf)]
+    for a, b in zip(heads, heads[1:]):
+        yield buf[a:b].strip()
+
+def write_sections(sections, outf):
+    n = 0
+    tmp = pathlib.Path(str(outf) + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as w:
+        for sec in sections:
+            w.write(json.dumps({"text": sec}, ensure_ascii=False) + "\n")
+            n += 1
+    os.replace(tmp, outf)
+    return n
+
+def process_pdf(pdf_path):
+    out = PROC / (pathlib.Path(pdf_path).stem + ".jsonl")
+    return write_sections(iter_sections(clean_pages(pdf_path)), out)
+
+def load_manifest():
+    try:
+        return json.loads(MANIFEST.read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+
+def save_manifest(manifest):
+    MANIFEST.parent.mkdir(parents=True, exist_ok=True)
+    MANIFEST.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+
+def ingest_parallel(workers=None, shard_pages=SHARD_PAGES, force=False):
+    manifest = load_manifest()
+    todo = []
+    for pdf in sorted(RAW.glob("*.pdf")):
+        digest = file_sha256(pdf)
         out = PROC / (pdf.stem + ".jsonl")
-        save_jsonl(secs, out)
-        print(f"➡ {pdf.name}: {len(secs)} sections → {out}")
+        if not force and manifest.get(pdf.name, {}).get("sha256") == digest and out.exists():
+            print(f"= {pdf.name}: unchanged, skipped")
+            continue
+        todo.append((pdf, digest, len(PdfReader(str(pdf)).pages)))
+    if not todo:
+        print("All PDFs up-to-date.")
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        whole, sharded = {}, {}
+        # biggest first so the long PDFs don't end up as the tail
+        for pdf, digest, n_pages in sorted(todo, key=lambda t: -t[2]):
+            if n_pages > shard_pages:
+                sharded[pdf] = (digest, [pool.submit(extract_shard, pdf, a, min(a + shard_pages, n_pages))
+                                         for a in range(0, n_pages, shard_pages)])
+            else:
+                whole[pool.submit(process_pdf, pdf)] = (pdf, digest)
+
+        def done(pdf, digest, n):
+            manifest[pdf.name] = {"sha256": digest, "sections": n}
+            save_manifest(manifest)
+            print(f"➡ {pdf.name}: {n} sections → {PROC / (pdf.stem + '.jsonl')}")
+
+        # sharded PDFs: stitch shards back in page order through the streaming splitter
+        for pdf, (digest, futs) in sharded.items():
+            def shard_pages_in_order(futs=futs):
+                for i, f in enumerate(futs):
+                    yield from f.result()
+                    futs[i] = None  # release the shard's pages once consumed
+            # shards return raw page text: cleaning runs across shard boundaries like the serial path
+            secs = iter_sections(clean_stream(shard_pages_in_order()))
+            done(pdf, digest, write_sections(secs, PROC / (pdf.stem + ".jsonl")))
+
+        for f in as_completed(whole):
+            pdf, digest = whole[f]
+            done(pdf, digest, f.result())
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Download and split law PDFs into data/processed/*.jsonl")
+    ap.add_argument("--workers", type=int, default=None, help="process pool size (default: CPU count)")
+    ap.add_argument("--shard-pages", type=int, default=SHARD_PAGES, help="pages per shard for large PDFs")
+    ap.add_argument("--force", action="store_true", help="re-process PDFs even if their hash is unchanged")
+    ap.add_argument("--serial", action="store_true", help="original single-process path")
+    ap.add_argument("--no-download", action="store_true")
+    args = ap.parse_args()
+
+    if not args.no_download:
+        download_pdfs()
+    if args.serial:
+        for pdf in tqdm(sorted(RAW.glob("*.pdf"))):
+            txt = clean_text(pdf_to_text(pdf))
+            secs = split_sections(txt)
+            out = PROC / (pdf.stem + ".jsonl")
+            save_jsonl(secs, out)
+            print(f"➡ {pdf.name}: {len(secs)} sections → {out}")
+    else:
+        ingest_parallel(workers=args.workers, shard_pages=args.shard_pages, force=args.force)
@@ -0,0 +1,125 @@
+from __future__ import annotations
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, List, Tuple, Dict, Any
+import json, math, os, re, shutil
+
+import numpy as np
+
+from config import BM25_K1, BM25_B
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def tokenize(s: str) -> List[str]:
+    # "Section 498A" -> ["section", "498a"]; keeps statute numbers as single tokens
+    return TOKEN_RE.findall(s.lower())
+
+def doc_terms(text: str, meta: Dict[str, Any]) -> List[str]:
+    # metadata is indexed with the body so "IPC 302"-style queries hit on act/section too
+    head = f"{meta.get('act', '')} {meta.get('section_number', '')} {meta.get('section_title', '')}"
+    return tokenize(head) + tokenize(text)
+
+
+class LexicalIndex:
+    """
+    BM25 over the KB chunks, stored as flat arrays so it loads with mmap:
+
+        terms.json        {term: [offset, df]} into the postings arrays
+        postings_doc.npy  int32 doc numbers, grouped by term
+        postings_tf.npy   uint16 term frequencies, parallel to postings_doc
+        doc_len.npy       int32 token count per doc
+        doc_ids.json      doc number -> Chroma id
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        self.terms: Dict[str, list] = json.loads((path / "terms.json").read_text(encoding="utf-8"))
+        self.doc_ids: List[str] = json.loads((path / "doc_ids.json").read_text(encoding="utf-8"))
+        self.p_doc = np.load(path / "postings_doc.npy", mmap_mode="r")
+        self.p_tf = np.load(path / "postings_tf.npy", mmap_mode="r")
+        self.doc_len = np.load(path / "doc_len.npy", mmap_mode="r")
+        self.n_docs = len(self.doc_ids)
+        self.avgdl = float(self.doc_len.mean()) if self.n_docs else 0.0
+
+    @classmethod
+    def load(cls, path: Path) -> "LexicalIndex | None":
+        return cls(path) if (path / "terms.json").exists() else None
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        if not self.n_docs:
+            return []
+        scores = None
+        for term in set(tokenize(query)):
+            entry = self.terms.get(term)
+            if not entry:
+                continue
+            off, df = entry
+            docs = self.p_doc[off:off + df]
+            tf = self.p_tf[off:off + df].astype(np.float32)
+            idf = math.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self.doc_len[docs] / self.avgdl)
+            if scores is None:
+                scores = np.zeros(self.n_docs, dtype=np.float32)
+            scores[docs] += idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+        if scores is None:
+            return []
+        k = min(k, self.n_docs)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.doc_ids[i], float(scores[i])) for i in top if scores[i] > 0]
+
+
+def build_lexical_index(docs: Iterable[Tuple[str, str, Dict[str, Any]]], path: Path) -> int:
+    """Build from (id, text, meta) triples into `path`, replacing any previous index atomically."""
+    postings: Dict[str, List[Tuple[int, int]]] = {}
+    doc_ids, doc_len = [], []
+    for n, (doc_id, text, meta) in enumerate(docs):
+        toks = doc_terms(text, meta or {})
+        doc_ids.append(doc_id)
+        doc_len.append(len(toks))
+        for term, tf in Counter(toks).items():
+            postings.setdefault(term, []).append((n, min(tf, 65535)))
+
+    terms, p_doc, p_tf = {}, [], []
+    for term in sorted(postings):
+        plist = postings[term]
+        terms[term] = [len(p_doc), len(plist)]
+        p_doc.extend(d for d, _ in plist)
+        p_tf.extend(tf for _, tf in plist)
+
+    tmp = path.with_name(path.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    np.save(tmp / "postings_doc.npy", np.asarray(p_doc, dtype=np.int32))
+    np.save(tmp / "postings_tf.npy", np.asarray(p_tf, dtype=np.uint16))
+    np.save(tmp / "doc_len.npy", np.asarray(doc_len, dtype=np.int32))
+    (tmp / "doc_ids.json").write_text(json.dumps(doc_ids), encoding="utf-8")
+    (tmp / "terms.json").write_text(json.dumps(terms, ensure_ascii=False), encoding="utf-8")
+
+    old = path.with_name(path.name + ".old")
+    shutil.rmtree(old, ignore_errors=True)
+    if path.exists():
+        os.replace(path, old)
+    os.replace(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+    return len(doc_ids)
+
+
+def iter_collection(col, page: int = 1000):
+    """(id, document, metadata) for every row of a Chroma collection, paged."""
+    offset = 0
+    while True:
+        res = col.get(include=["documents", "metadatas"], limit=page, offset=offset)
+        ids = res.get("ids", [])
+        if not ids:
+            return
+        yield from zip(ids, res.get("documents", []), res.get("metadatas", []))
+        offset += len(ids)
+
+
+def rrf_fuse(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Reciprocal rank fusion of several ranked id lists."""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)
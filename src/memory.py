@@ -1,65 +1,206 @@
 from __future__ import annotations
+from collections import OrderedDict
 from typing import List, Dict, Any
 from datetime import datetime, timezone
-import math, uuid
+import hashlib, math, threading, time, uuid
 
-import chromadb
-from sentence_transformers import SentenceTransformer
+import numpy as np
 
+from embeddings import get_embedder
+from vector_store import get_client
+from memory_writer import MemoryWriter
+from session_catalog import SessionCatalog
+from tracing import span, annotate
 from config import (
-    VECTOR_DIR, MEMORY_COLLECTION, EMB_MODEL,
+    MEMORY_COLLECTION, MEMORY_JOURNAL, MEMORY_CATALOG_DB,
     SIM_WEIGHT, RECENCY_WEIGHT, ROLE_WEIGHT, SESSION_WEIGHT,
     RECENCY_HALFLIFE_HOURS, ROLE_SCORES, SAME_SESSION_BONUS, DIFFERENT_SESSION_BONUS,
-    MAX_MEMORY_CANDIDATES
+    MAX_MEMORY_CANDIDATES, MAX_MEMORY_CANDIDATES_CAP, TOP_MEMORY_AFTER_SCORE,
+    MEMORY_BUCKETS, MEMORY_EXACT_MAX, MEMORY_USER_CACHE, MEMORY_SUMMARY_TOP
 )
 
+_LARGE = object()  # user-cache marker: history too big for the exact path, use ANN
+
 def utcnow_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
+def memory_bucket(user_id: str) -> int:
+    return int(hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:8], 16) % MEMORY_BUCKETS
+
+def memory_collection_name(user_id: str) -> str:
+    """Users are sharded over MEMORY_BUCKETS small collections by user-id hash."""
+    return f"{MEMORY_COLLECTION}_{memory_bucket(user_id):02d}"
+
+def _unit_rows(embs) -> np.ndarray:
+    m = np.asarray(embs, dtype=np.float32).reshape(len(embs), -1)
+    n = np.linalg.norm(m, axis=1, keepdims=True)
+    return m / np.where(n == 0, 1.0, n)
+
 class MemoryStore:
     def __init__(self):
-        self.client = chromadb.PersistentClient(path=str(VECTOR_DIR))
+        self.client = get_client()
+        self._cols: Dict[str, Any] = {}
+        self._col_lock = threading.Lock()
+        # user_id -> {"ids", "docs", "mets", "embs", "cver"} (or _LARGE), LRU-evicted; exact search for small users
+        self._users: "OrderedDict[str, Any]" = OrderedDict()
+        self._users_lock = threading.Lock()
+        self._user_ver: Dict[str, int] = {}  # bumped by every flush/forget touching the user
+        self.embedder = get_embedder()
+        self.catalog = SessionCatalog(MEMORY_CATALOG_DB)
+        self.writer = MemoryWriter(self.col_for, self.embedder, MEMORY_JOURNAL, on_flush=self._on_flush)
+        self._warn_legacy()
+
+    def _warn_legacy(self):
         try:
-            self.col = self.client.get_collection(MEMORY_COLLECTION)
-        except:
-            self.col = self.client.create_collection(MEMORY_COLLECTION, metadata={"hnsw:space":"cosine"})
-        self.embedder = SentenceTransformer(EMB_MODEL)
+            n = self.client.get_collection(MEMORY_COLLECTION).count()
+        except Exception:
+            return
+        if n:
+            print(f"[memory] '{MEMORY_COLLECTION}' still holds {n} unsharded messages; run `python src/migrate_memory.py`.")
+
+    def col_for(self, user_id: str):
+        name = memory_collection_name(user_id)
+        col = self._cols.get(name)
+        if col is None:
+            with self._col_lock:
+                col = self._cols.get(name)
+                if col is None:
+                    col = self.client.get_or_create_collection(name, metadata={"hnsw:space": "cosine"})
+                    self._cols[name] = col
+        return col
+
+    # ---- per-user exact-search cache ----
+    def _user_vectors(self, user_id: str) -> Dict[str, Any] | None:
+        for _ in range(3):
+            cver = self.catalog.version(user_id)  # bumped by removals in any process
+            with self._users_lock:
+                hit = self._users.get(user_id)
+                if hit is not None and (hit is _LARGE or hit["cver"] == cver):
+                    self._users.move_to_end(user_id)
+                    return None if hit is _LARGE else hit
+                if hit is not None:
+                    self._users.pop(user_id)  # compacted/trimmed/deleted elsewhere, e.g. by memory_compactor.py
+                ver = self._user_ver.get(user_id, 0)
+            # read outside the lock; a flush landing meanwhile has no entry to update, so check after
+            res = self.col_for(user_id).get(
+                where={"user_id": user_id},
+                limit=MEMORY_EXACT_MAX + 1,
+                include=["documents", "metadatas", "embeddings"],
+            )
+            ids = list(res.get("ids", []))
+            if len(ids) > MEMORY_EXACT_MAX:
+                entry = _LARGE
+            else:
+                embs = res.get("embeddings")
+                entry = {
+                    "ids": ids,
+                    "docs": list(res.get("documents", [])),
+                    "mets": list(res.get("metadatas", [])),
+                    "embs": _unit_rows(embs) if ids else np.zeros((0, 0), dtype=np.float32),
+                    "cver": cver,
+                }
+            with self._users_lock:
+                if self._user_ver.get(user_id, 0) != ver:
+                    continue  # the read may predate that write: read again
+                self._users[user_id] = entry
+                self._users.move_to_end(user_id)
+                while len(self._users) > MEMORY_USER_CACHE:
+                    self._users.popitem(last=False)
+                return None if entry is _LARGE else entry
+        # still being written to: answer from the last read (the caller took the pending
+        # buffer before it) but don't cache it
+        return None if entry is _LARGE else entry
+
+    def _on_flush(self, batch: List[Dict[str, Any]], embs: List[Any]):
+        # keep cached users in sync with what was just written
+        with self._users_lock:
+            for e, v in zip(batch, embs):
+                uid = e["metadata"].get("user_id", "")
+                self._user_ver[uid] = self._user_ver.get(uid, 0) + 1
+                cur = self._users.get(uid)
+                if cur is None or cur is _LARGE or e["id"] in cur["ids"]:
+                    continue
+                if len(cur["ids"]) >= MEMORY_EXACT_MAX:
+                    self._users[uid] = _LARGE
+                    continue
+                row = _unit_rows([v])
+                cur = {
+                    "ids": cur["ids"] + [e["id"]],
+                    "docs": cur["docs"] + [e["document"]],
+                    "mets": cur["mets"] + [e["metadata"]],
+                    "embs": np.vstack([cur["embs"], row]) if cur["embs"].size else row,
+                    "cver": cur["cver"],
+                }
+                self._users[uid] = cur
+
+    def _forget_user(self, user_id: str):
+        with self._users_lock:
+            self._users.pop(user_id, None)
+            self._user_ver[user_id] = self._user_ver.get(user_id, 0) + 1
 
     # ---- write ----
-    def save_message(self, *, user_id: str, session_id: str, role: str, content: str) -> str:
-        emb = self.embedder.encode([content])[0]
-        mid = str(uuid.uuid4())
-        self.col.add(
-            documents=[content],
-            embeddings=[emb],
-            metadatas=[{
-                "user_id": user_id,
-                "session_id": session_id,
-                "role": role,
-                "timestamp": utcnow_iso()
-            }],
-            ids=[mid]
-        )
+    def save_message(self, *, user_id: str, session_id: str, role: str, content: str,
+                     message_id: str | None = None) -> str:
+        # Queued + journaled; embedded and added to Chroma in batches by MemoryWriter.
+        # A caller-chosen message_id makes a retried call a no-op (upsert + INSERT OR IGNORE).
+        mid = message_id or str(uuid.uuid4())
+        meta = {
+            "user_id": user_id,
+            "session_id": session_id,
+            "role": role,
+            "timestamp": utcnow_iso(),
+            "ts": time.time()  # epoch seconds, for vectorised recency scoring
+        }
+        with span("memory.save_message"):
+            self.writer.enqueue(mid=mid, document=content, metadata=meta)
+            self.catalog.record(message_id=mid, content=content, meta=meta)
         return mid
 
+    def flush(self) -> int:
+        return self.writer.flush()
+
     # ---- read + score ----
-    def _recency_score(self, iso_ts: str) -> float:
-        try:
-            t = datetime.fromisoformat(iso_ts.replace("Z","")).astimezone(timezone.utc)
+    @staticmethod
+    def _ts_epoch(meta: Dict[str, Any]) -> float:
+        ts = meta.get("ts")
+        if isinstance(ts, (int, float)):
+            return float(ts)
+        try:  # rows written before "ts" was stored
+            return datetime.fromisoformat(meta.get("timestamp", "").replace("Z","")).astimezone(timezone.utc).timestamp()
         except Exception:
-            return 0.5
-        age_hours = (datetime.now(timezone.utc) - t).total_seconds() / 3600.0
-        # exponential decay to [0..1], 1 when fresh, ~0 as it gets old
-        if RECENCY_HALFLIFE_HOURS <= 0:
-            return 0.5
-        decay = 0.5 ** (age_hours / RECENCY_HALFLIFE_HOURS)
-        return max(0.0, min(1.0, decay))
+            return math.nan
 
-    def _role_score(self, role: str) -> float:
-        return ROLE_SCORES.get(role, 0.8)
+    def _score(self, sims: np.ndarray, mets: List[Dict[str, Any]], session_id: str) -> Dict[str, np.ndarray]:
+        now = time.time()
+        ts = np.fromiter((self._ts_epoch(m) for m in mets), dtype=np.float64, count=len(mets))
+        if RECENCY_HALFLIFE_HOURS > 0:
+            # exponential decay to [0..1], 1 when fresh, ~0 as it gets old; 0.5 when unknown
+            age_hours = (now - ts) / 3600.0
+            rec = np.clip(np.power(0.5, age_hours / RECENCY_HALFLIFE_HOURS), 0.0, 1.0)
+            rec = np.where(np.isnan(rec), 0.5, rec)
+        else:
+            rec = np.full(len(mets), 0.5)
+        role = np.fromiter((ROLE_SCORES.get(m.get("role", "user"), 0.8) for m in mets), dtype=np.float64, count=len(mets))
+        sess = np.where(
+            np.fromiter((m.get("session_id", "") == session_id for m in mets), dtype=bool, count=len(mets)),
+            SAME_SESSION_BONUS, DIFFERENT_SESSION_BONUS,
+        )
+        final = SIM_WEIGHT * sims + RECENCY_WEIGHT * rec + ROLE_WEIGHT * role + SESSION_WEIGHT * sess
+        return {"sim": sims, "recency": rec, "role": role, "session": sess, "final": final}
 
-    def _session_bonus(self, mem_session_id: str, current_session_id: str) -> float:
-        return SAME_SESSION_BONUS if mem_session_id == current_session_id else DIFFERENT_SESSION_BONUS
+    def _query_candidates(self, q_emb, user_id: str, n: int, kind: str | None = None):
+        where = {"user_id": user_id} if kind is None else {"$and": [{"user_id": user_id}, {"kind": kind}]}
+        res = self.col_for(user_id).query(
+            query_embeddings=[q_emb],
+            n_results=n,
+            where=where,
+        )
+        return (
+            list(res.get("ids", [[]])[0]),
+            list(res.get("documents", [[]])[0]),
+            list(res.get("metadatas", [[]])[0]),
+            np.asarray(res.get("distances", [[]])[0], dtype=np.float64),  # cosine distance [0..2]
+        )
 
     def search_relevant(
         self,
@@ -67,107 +208,137 @@ class MemoryStore:
         user_id: str,
         session_id: str,
         query: str,
-        n_candidates: int = MAX_MEMORY_CANDIDATES
+        n_candidates: int = MAX_MEMORY_CANDIDATES,
+        top_k: int = TOP_MEMORY_AFTER_SCORE
     ) -> List[Dict[str, Any]]:
-        q_emb = self.embedder.encode([query])[0]
-        res = self.col.query(
-            query_embeddings=[q_emb],
-            n_results=n_candidates,
-            where={"user_id": user_id},
-        )
-        docs = res.get("documents", [[]])[0]
-        mets = res.get("metadatas", [[]])[0]
-        dists = res.get("distances", [[]])[0]  # cosine distance [0..2]
-        items = []
-        for d, m, dist in zip(docs, mets, dists):
-            # Convert distance to similarity in [0..1] (approx)
-            sim = 1.0 - float(dist)
-            rec = self._recency_score(m.get("timestamp", ""))
-            rscore = self._role_score(m.get("role", "user"))
-            sbonus = self._session_bonus(m.get("session_id", ""), session_id)
-
-            final = (
-                SIM_WEIGHT * sim +
-                RECENCY_WEIGHT * rec +
-                ROLE_WEIGHT * rscore +
-                SESSION_WEIGHT * sbonus
+        with span("memory.search_relevant") as sp:
+            items = self._search_relevant(user_id, session_id, query, n_candidates, top_k)
+            sp.set(results=len(items))
+            return items
+
+    def _search_relevant(self, user_id: str, session_id: str, query: str, n_candidates: int,
+                         top_k: int) -> List[Dict[str, Any]]:
+        """
+        Top `top_k` memories by the combined sim/recency/role/session score.
+
+        Candidates come from the ANN search by similarity only. When an unseen
+        message could still beat the k-th best of the first `n_candidates` (it
+        has sim <= the weakest candidate's, and at most the maximum
+        recency/role/session terms), the search is re-run once at
+        MAX_MEMORY_CANDIDATES_CAP. `top_k=0` means all candidates.
+        Compacted session summaries (memory_compactor.py) form a second tier
+        with at most MEMORY_SUMMARY_TOP of the `top_k` slots.
+        """
+        q_emb = self.embedder.embed(query)
+        # read the write-behind buffer first: a message flushed meanwhile then shows up twice
+        # (deduped by id below) rather than not at all
+        pending = self.writer.pending_for(user_id)
+
+        uv = self._user_vectors(user_id)
+        if uv is not None:
+            # small history: exact scan over the user's cached vectors
+            ids, docs, mets = list(uv["ids"]), list(uv["docs"]), list(uv["mets"])
+            sims = (uv["embs"] @ _unit_rows([q_emb])[0]).astype(np.float64) if ids else np.zeros(0)
+        else:
+            bonus_cap = (
+                RECENCY_WEIGHT * 1.0 +
+                ROLE_WEIGHT * max([0.8, *ROLE_SCORES.values()]) +
+                SESSION_WEIGHT * max(SAME_SESSION_BONUS, DIFFERENT_SESSION_BONUS)
             )
-            items.append({
-                "content": d,
-                "meta": m,
-                "scores": {"sim": sim, "recency": rec, "role": rscore, "session": sbonus, "final": final}
-            })
-
-        # sort by final score descending
-        items.sort(key=lambda x: x["scores"]["final"], reverse=True)
-        return items
-    
+            n = max(n_candidates, top_k)
+            ids, docs, mets, dists = self._query_candidates(q_emb, user_id, n)
+            sims = 1.0 - dists  # Convert distance to similarity in [0..1] (approx)
+            if len(ids) == n and n < MAX_MEMORY_CANDIDATES_CAP:  # else: history exhausted (or cap reached)
+                settled = False
+                if top_k > 0:
+                    scores = self._score(sims, mets, session_id)["final"]
+                    kth = np.partition(scores, len(scores) - top_k)[len(scores) - top_k]
+                    settled = kth >= SIM_WEIGHT * float(sims.min()) + bonus_cap
+                if not settled:
+                    # ANN results can't be paged, so go straight to the cap: growing the pool
+                    # step by step would re-run the whole search at every step
+                    ids, docs, mets, dists = self._query_candidates(q_emb, user_id, MAX_MEMORY_CANDIDATES_CAP)
+                    sims = 1.0 - dists
+            if MEMORY_SUMMARY_TOP:
+                # summary tier: session summaries are few, so they get their own small query
+                # instead of having to outrank hundreds of raw turns in the pool above
+                s_ids, s_docs, s_mets, s_dists = self._query_candidates(q_emb, user_id, MEMORY_SUMMARY_TOP, "summary")
+                have = set(ids)
+                new = [j for j, i in enumerate(s_ids) if i not in have]
+                ids += [s_ids[j] for j in new]
+                docs += [s_docs[j] for j in new]
+                mets += [s_mets[j] for j in new]
+                sims = np.concatenate([sims, 1.0 - s_dists[new]])
+
+        # read-your-writes: include messages still waiting in the write-behind buffer
+        seen = set(ids)
+        pending = [e for e in pending if e["id"] not in seen]
+        if pending:
+            p_embs = _unit_rows(self.embedder.embed_many([e["document"] for e in pending]))
+            p_sims = (p_embs @ _unit_rows([q_emb])[0]).astype(np.float64)
+            ids += [e["id"] for e in pending]
+            docs += [e["document"] for e in pending]
+            mets += [e["metadata"] for e in pending]
+            sims = np.concatenate([sims, p_sims])
+
+        annotate(candidates=len(ids), pending=len(pending), exact=uv is not None)
+        if not ids:
+            return []
+        sc = self._score(sims, mets, session_id)
+        final = sc["final"]
+        top = self._two_tier(final, mets, top_k)
+        return [
+            {
+                "id": ids[i],
+                "content": docs[i],
+                "meta": mets[i],
+                "scores": {name: float(v[i]) for name, v in sc.items()}
+            }
+            for i in top
+        ]
+
+    @staticmethod
+    def _two_tier(final: np.ndarray, mets: List[Dict[str, Any]], top_k: int) -> np.ndarray:
+        """
+        Best-first indices: the best MEMORY_SUMMARY_TOP session summaries get their
+        slots even when fresher raw turns outscore them; raw turns fill the rest.
+        """
+        order = np.argsort(-final, kind="stable")
+        k = min(top_k, len(final)) if top_k else len(final)
+        is_summ = np.fromiter((m.get("kind") == "summary" for m in mets), dtype=bool, count=len(mets))
+        summ = [i for i in order if is_summ[i]][:min(MEMORY_SUMMARY_TOP, k)]
+        turns = [i for i in order if not is_summ[i]][:k - len(summ)]
+        top = np.asarray(summ + turns, dtype=np.int64)
+        return top[np.argsort(-final[top], kind="stable")]
+
         # Delete all memory for a user (GDPR-style)
     def delete_user(self, user_id: str):
-        res = self.col.get(where={"user_id": user_id})
-        ids = res.get("ids", [])
-        if ids:
-            self.col.delete(ids=ids)
+        self.writer.drop_user(user_id)
+        self.col_for(user_id).delete(where={"user_id": user_id})
+        self.catalog.delete_user(user_id)
+        self._forget_user(user_id)
 
     # Trim oldest messages beyond a cap
     def trim_user(self, user_id: str, keep_last: int = 500):
-        res = self.col.get(where={"user_id": user_id})
-        ids = res.get("ids", [])
-        mets = res.get("metadatas", [])
-        if not ids: return
-        # sort by timestamp ascending, remove oldest
-        pairs = sorted(zip(ids, mets), key=lambda x: x[1].get("timestamp", ""))
-        if len(pairs) > keep_last:
-            drop = [pid for pid, _ in pairs[:-keep_last]]
-            self.col.delete(ids=drop)
-    
-    # inside class MemoryStore (append these methods)
+        drop = self.catalog.ids_beyond(user_id, keep_last)
+        if not drop: return
+        self.writer.flush()  # the oldest may still be queued
+        self.col_for(user_id).delete(ids=drop)
+        self.catalog.delete_messages(user_id, drop)
+        self._forget_user(user_id)
 
     def list_sessions(self, *, user_id: str, limit: int = 50):
         """
         Return list of sessions for the given user_id ordered by most recent.
-        Each item: {"session_id": str, "last_ts": iso, "count": int}
+        Each item: {"session_id": str, "last_ts": iso, "count": int, ...}
         """
-        # fetch all metadatas for this user
-        try:
-            res = self.col.get(where={"user_id": user_id})
-        except Exception:
-            return []
+        return self.catalog.list_sessions(user_id, limit=limit)
 
-        mets = res.get("metadatas", []) or []
-        ids = res.get("ids", []) or []
-        if not mets:
-            return []
-
-        # aggregate session stats
-        sessions = {}
-        for mid, m in zip(ids, mets):
-            sid = m.get("session_id")
-            ts = m.get("timestamp") or ""
-            sessions.setdefault(sid, {"count": 0, "last_ts": ts})
-            sessions[sid]["count"] += 1
-            # update last_ts if later
-            if ts and ts > sessions[sid]["last_ts"]:
-                sessions[sid]["last_ts"] = ts
-
-        out = [{"session_id": sid, "last_ts": sessions[sid]["last_ts"], "count": sessions[sid]["count"]} for sid in sessions]
-        out.sort(key=lambda x: x["last_ts"] or "", reverse=True)
-        return out[:limit]
-
-    def get_recent_memory(self, *, user_id: str, session_id: str = None, limit: int = 50):
+    def get_recent_memory(self, *, user_id: str, session_id: str = None, limit: int = 50,
+                          before_ts: float | None = None):
         """
-        Return raw memory items (content + meta) filtered by user and optionally session.
+        Return raw memory items (content + meta), newest first, filtered by user and
+        optionally session. Page with before_ts=<last item's meta["ts"]>.
         Useful for the memory viewer in the UI.
         """
-        where = {"user_id": user_id}
-        if session_id:
-            where["session_id"] = session_id
-        res = self.col.get(where=where, limit=limit)
-        docs = res.get("documents", [])
-        mets = res.get("metadatas", [])
-        items = []
-        for d, m in zip(docs, mets):
-            items.append({"content": d, "meta": m})
-        return items
-
-
+        return self.catalog.recent(user_id, session_id=session_id, limit=limit, before_ts=before_ts)
@@ -0,0 +1,210 @@
+"""
+Roll old conversation turns up into per-session summary records.
+
+    python src/memory_compactor.py                   # every user
+    python src/memory_compactor.py --user alice --dry-run
+
+A user's newest MEMORY_RECENT_TURNS messages stay raw, and so does every
+session that is still open (last message within MEMORY_SESSION_IDLE_HOURS).
+Older turns of closed sessions are summarised into one record per session:
+role "summary", kind "summary", id `summary:<session_id>`, with its own
+embedding in the user's bucket collection and a row in the session catalog.
+The raw vectors and catalog rows are then deleted. If a session is compacted
+again later, its earlier summary is fed back in with the newly closed turns.
+MemoryStore.search_relevant searches summaries and recent turns as two tiers.
+
+With RETRIEVAL_SERVER_URL set, the CLI asks the retrieval server to compact
+(it owns memory writes and the cached user vectors). Otherwise it works on
+vectorstore/ directly: stop the app first. A running app notices the change
+through the catalog's per-user version and reloads those users, but Chroma's
+persistent client isn't meant to be written by two processes at once.
+
+Summarisers are callables `(turns) -> str`, where turns are [{"content",
+"meta"}] oldest first. `extractive_summary` is the offline default.
+MEMORY_SUMMARISER = "gemini" asks the LLM instead.
+"""
+from __future__ import annotations
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Callable
+import argparse, re, time
+
+from config import (
+    MEMORY_RECENT_TURNS, MEMORY_SESSION_IDLE_HOURS, MEMORY_SUMMARISER,
+    MEMORY_SUMMARY_SENTENCES, MEMORY_SUMMARY_MAX_CHARS,
+)
+from tracing import span
+
+Summariser = Callable[[List[Dict[str, Any]]], str]
+
+_SENT = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])")
+_WORD = re.compile(r"[a-z][a-z0-9']+")
+_STOP = frozenset("""
+a an the and or but if then so of to in on at by for with from as is are was were be been being it its this that
+these those i you he she we they me my your our their what which who whom how when where why can could would should
+will shall may might do does did not no yes have has had there here about into than also just any some such
+""".split())
+_PREFIX = {"user": "User", "assistant": "Assistant", "summary": "Earlier"}
+
+
+# ---- summarisers ----
+def extractive_summary(turns: List[Dict[str, Any]], max_sentences: int = MEMORY_SUMMARY_SENTENCES,
+                       max_chars: int = MEMORY_SUMMARY_MAX_CHARS) -> str:
+    """
+    Frequency-based sentence extraction (Luhn style): sentences whose content
+    words recur most across the session win, and they are kept in their
+    original order and labelled with their speaker. Needs no model or network.
+    """
+    sents = []  # (order, role, sentence, words)
+    for t in turns:
+        role = t["meta"].get("role", "user")
+        for s in _SENT.split(" ".join(t["content"].split())):
+            words = [w for w in _WORD.findall(s.lower()) if w not in _STOP]
+            if words:
+                sents.append((len(sents), role, s, set(words)))
+    if not sents:
+        return ""
+    freq: Dict[str, int] = {}
+    for _, _, _, words in sents:
+        for w in words:
+            freq[w] = freq.get(w, 0) + 1
+    ranked = sorted(sents, key=lambda x: -sum(freq[w] for w in x[3]) / len(x[3]) ** 0.5)
+
+    picked, size = [], 0
+    for s in ranked:
+        if len(picked) >= max_sentences or size + len(s[2]) > max_chars:
+            continue
+        if any(len(s[3] & p[3]) / len(s[3] | p[3]) >= 0.7 for p in picked):
+            continue  # repeats a sentence already picked (users re-ask, answers restate)
+        picked.append(s)
+        size += len(s[2])
+    picked.sort()
+    return " ".join(f"{_PREFIX.get(role, role.title())}: {s}" for _, role, s, _ in picked)
+
+def gemini_summariser(model=None) -> Summariser:
+    """LLM summaries via Gemini (network + quota); the model is loaded on first use."""
+    state = {"model": model}
+
+    def summarise(turns: List[Dict[str, Any]]) -> str:
+        if state["model"] is None:
+            from rag_pipeline import load_gemini
+            state["model"] = load_gemini()
+        convo = "\n".join(f"{_PREFIX.get(t['meta'].get('role', 'user'), 'User')}: {t['content']}" for t in turns)
+        prompt = (
+            "Summarise this legal-aid conversation for later reference in at most "
+            f"{MEMORY_SUMMARY_SENTENCES} sentences. Keep the user's facts, the laws and sections "
+            "discussed and any advice given.\n\n" + convo
+        )
+        text = getattr(state["model"].generate_content(prompt), "text", "").strip()
+        return text[:MEMORY_SUMMARY_MAX_CHARS]
+    return summarise
+
+def load_summariser(name: str = MEMORY_SUMMARISER) -> Summariser:
+    if name == "gemini":
+        return gemini_summariser()
+    if name == "extractive":
+        return extractive_summary
+    raise ValueError(f"Unknown MEMORY_SUMMARISER {name!r} (use 'extractive' or 'gemini')")
+
+
+# ---- compaction ----
+def summary_id(session_id: str) -> str:
+    return f"summary:{session_id}"
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+class MemoryCompactor:
+    def __init__(self, store, summariser: Summariser | None = None, keep_recent: int = MEMORY_RECENT_TURNS,
+                 idle_hours: float = MEMORY_SESSION_IDLE_HOURS):
+        self.store = store
+        self.summarise = summariser or load_summariser()
+        self.keep_recent = keep_recent
+        self.idle_s = idle_hours * 3600.0
+
+    def plan(self, user_id: str) -> Dict[str, List[Dict[str, Any]]]:
+        """session_id -> messages to fold (a previous summary first, then old raw turns)."""
+        cat = self.store.catalog
+        old = set(cat.ids_beyond(user_id, self.keep_recent))  # raw turns only; summaries don't take recent slots
+        cutoff = time.time() - self.idle_s
+        out = {}
+        for s in cat.list_sessions(user_id, limit=1_000_000):
+            if (s["last_epoch"] or 0) > cutoff:
+                continue  # session still open
+            msgs = cat.session_messages(user_id, s["session_id"])
+            # an earlier summary is always re-folded, or the new one would overwrite it
+            fold = [m for m in msgs if m["id"] in old or m["meta"].get("role") == "summary"]
+            if any(m["meta"].get("role") != "summary" for m in fold):
+                out[s["session_id"]] = fold
+        return out
+
+    def compact_user(self, user_id: str, dry_run: bool = False) -> Dict[str, int]:
+        store = self.store
+        store.flush()  # turns still in the write-behind buffer are not in the catalog's vectors yet
+        plan = self.plan(user_id)
+        stats = {"sessions": len(plan), "turns_folded": sum(len(v) for v in plan.values()), "vectors_removed": 0}
+        if dry_run or not plan:
+            return stats
+        col = store.col_for(user_id)
+        with span("memory.compact", candidates=stats["turns_folded"]):
+            for session_id, msgs in plan.items():
+                sid = summary_id(session_id)
+                had_summary = any(m["id"] == sid for m in msgs)
+                if had_summary:  # the catalog row lacks first_ts; Chroma has it
+                    prev = (col.get(ids=[sid], include=["metadatas"]).get("metadatas") or [None])[0] or {}
+                    msgs = [{**m, "meta": {**m["meta"], **prev}} if m["id"] == sid else m for m in msgs]
+                text = self.summarise(msgs)
+                if not text:
+                    continue
+                first = min(m["meta"].get("first_ts") or m["meta"]["ts"] for m in msgs)
+                last = max(m["meta"]["ts"] for m in msgs)
+                turns = sum(int(m["meta"].get("turns") or 1) for m in msgs)
+                meta = {"user_id": user_id, "session_id": session_id, "role": "summary", "kind": "summary",
+                        "timestamp": _iso(last), "ts": last, "first_ts": first, "turns": turns}
+                col.upsert(ids=[sid], documents=[text], metadatas=[meta],
+                           embeddings=[store.embedder.embed(text)])
+                raw = [m["id"] for m in msgs if m["id"] != sid]
+                if raw:
+                    col.delete(ids=raw)
+                store.catalog.delete_messages(user_id, [m["id"] for m in msgs])
+                store.catalog.record(message_id=sid, content=text, meta=meta)
+                stats["vectors_removed"] += len(raw) - (0 if had_summary else 1)
+        store._forget_user(user_id)
+        return stats
+
+    def compact_all(self, dry_run: bool = False) -> Dict[str, int]:
+        total = {"users": 0, "sessions": 0, "turns_folded": 0, "vectors_removed": 0}
+        for user_id in self.store.catalog.users():
+            st = self.compact_user(user_id, dry_run)
+            if st["sessions"]:
+                total["users"] += 1
+                for k in ("sessions", "turns_folded", "vectors_removed"):
+                    total[k] += st[k]
+        return total
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--user", help="only this user (default: everyone in the session catalog)")
+    ap.add_argument("--keep-recent", type=int, default=MEMORY_RECENT_TURNS, help="newest raw turns kept per user")
+    ap.add_argument("--idle-hours", type=float, default=MEMORY_SESSION_IDLE_HOURS,
+                    help="sessions quiet this long count as closed")
+    ap.add_argument("--summariser", default=MEMORY_SUMMARISER, choices=["extractive", "gemini"])
+    ap.add_argument("--dry-run", action="store_true", help="report what would be folded, change nothing")
+    args = ap.parse_args()
+
+    from config import RETRIEVAL_SERVER_URL
+    if RETRIEVAL_SERVER_URL:
+        from retrieval_client import RemoteMemoryStore
+        stats = RemoteMemoryStore(RETRIEVAL_SERVER_URL).compact(
+            args.user, args.dry_run, keep_recent=args.keep_recent, idle_hours=args.idle_hours,
+            summariser=args.summariser)
+    else:
+        from memory import MemoryStore
+        store = MemoryStore()
+        comp = MemoryCompactor(store, load_summariser(args.summariser), args.keep_recent, args.idle_hours)
+        stats = comp.compact_user(args.user, args.dry_run) if args.user else comp.compact_all(args.dry_run)
+        store.writer.close()
+    verb = "would fold" if args.dry_run else "folded"
+    print(f"✓ {verb} {stats['turns_folded']} messages from {stats['sessions']} sessions into summaries "
+          f"({stats['vectors_removed']} vectors removed)")
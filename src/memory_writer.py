@@ -0,0 +1,202 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import List, Dict, Any, Callable
+import atexit, json, os, threading
+
+from config import MEMORY_FLUSH_EVERY, MEMORY_FLUSH_MS, MEMORY_JOURNAL_FSYNC
+from tracing import span
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        return False  # os.kill(pid, 0) would signal it; a live writer's open journal can't be renamed there anyway
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MemoryWriter:
+    """
+    Write-behind buffer for conversation memory.
+
+    Messages from all sessions are appended to an on-disk journal (so a crash
+    does not lose turns) and kept in `pending`. A background thread flushes them
+    every `flush_every` messages or `flush_ms` milliseconds with one batched
+    encode and one `upsert` per target collection, then compacts the journal.
+
+    Each process writes its own journal, `<stem>.<pid>.jsonl` next to
+    `journal_path`, so a second process (e.g. a maintenance CLI) never
+    rewrites or unlinks the file another one is appending to. On startup the
+    journals of processes that are no longer running are adopted (renamed to
+    ours, so only one process replays them) and flushed.
+
+    `col_for(user_id)` picks the collection a message belongs to; `on_flush`
+    is called with (entries, embeddings) after each successful write.
+    """
+    def __init__(self, col_for: Callable[[str], Any], embedder, journal_path: Path,
+                 flush_every: int = MEMORY_FLUSH_EVERY, flush_ms: int = MEMORY_FLUSH_MS,
+                 on_flush: Callable[[List[Dict[str, Any]], List[Any]], None] | None = None):
+        self.col_for = col_for
+        self.embedder = embedder
+        self.on_flush = on_flush
+        self.journal_path = journal_path.with_name(f"{journal_path.stem}.{os.getpid()}{journal_path.suffix}")
+        self.flush_every = max(1, flush_every)
+        self.flush_interval = max(1, flush_ms) / 1000.0
+        self.pending: List[Dict[str, Any]] = []   # {"id", "document", "metadata"}
+        self._lock = threading.Lock()        # guards pending + journal file
+        self._flush_lock = threading.Lock()  # one flush at a time
+        self._wake = threading.Event()
+        self._stop = False
+
+        self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+        adopted = self._adopt_journals(journal_path)
+        self.pending.extend(self._read_journal(adopted))
+        self._journal = self.journal_path.open("a", encoding="utf-8")
+        if adopted:
+            with self._lock:
+                self._rewrite_journal()  # recovered entries now live in our own journal
+            for p in adopted:
+                if p != self.journal_path:
+                    p.unlink(missing_ok=True)
+        if self.pending:
+            self.flush()
+
+        self._thread = threading.Thread(target=self._run, name="memory-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ---- journal ----
+    def _adopt_journals(self, base: Path) -> List[Path]:
+        """Claim the journals of dead processes (and a pre-per-process `base` journal)."""
+        me = os.getpid()
+        out = []
+        for i, p in enumerate([base] + sorted(base.parent.glob(f"{base.stem}.*{base.suffix}"))):
+            if not p.exists():
+                continue
+            owner = p.name[len(base.stem) + 1:].split(".")[0] if p != base else ""
+            if owner.isdigit() and int(owner) == me:
+                out.append(p)  # ours: left by an earlier process with our pid, or adopted and not yet replayed
+                continue
+            if owner.isdigit() and _pid_alive(int(owner)):
+                continue
+            dst = base.with_name(f"{base.stem}.{me}.{i}{base.suffix}")
+            try:
+                os.replace(p, dst)  # atomic: of two processes starting together only one gets it
+            except OSError:
+                continue            # claimed by someone else first, or still open by its writer (Windows)
+            out.append(dst)
+        return out
+
+    def _read_journal(self, paths: List[Path]) -> List[Dict[str, Any]]:
+        entries, seen = [], set()
+        for path in paths:
+            with path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        e = json.loads(line)
+                    except Exception:
+                        continue  # torn last line from a crash mid-write
+                    if e.get("id") and e["id"] not in seen:
+                        seen.add(e["id"])
+                        entries.append(e)
+        return entries
+
+    def _append_journal(self, entry: Dict[str, Any]) -> None:
+        self._journal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        if MEMORY_JOURNAL_FSYNC:
+            os.fsync(self._journal.fileno())
+
+    def _rewrite_journal(self) -> None:
+        # called with self._lock held: keep only entries that are still pending
+        tmp = self.journal_path.with_suffix(".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            for e in self.pending:
+                f.write(json.dumps(e, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal.close()
+        os.replace(tmp, self.journal_path)
+        self._journal = self.journal_path.open("a", encoding="utf-8")
+
+    # ---- write ----
+    def enqueue(self, *, mid: str, document: str, metadata: Dict[str, Any]) -> None:
+        entry = {"id": mid, "document": document, "metadata": metadata}
+        with self._lock:
+            self._append_journal(entry)
+            self.pending.append(entry)
+            full = len(self.pending) >= self.flush_every
+        if full:
+            self._wake.set()
+
+    def flush(self) -> int:
+        """Persist everything queued so far; returns the number of messages written."""
+        with self._flush_lock:
+            with self._lock:
+                batch = list({e["id"]: e for e in self.pending}.values())  # a retried save is queued twice
+            if not batch:
+                return 0
+            with span("memory.flush", candidates=len(batch)):
+                embs = self.embedder.embed_many([e["document"] for e in batch])
+                groups: Dict[int, list] = {}
+                for e, v in zip(batch, embs):
+                    col = self.col_for(e["metadata"].get("user_id", ""))
+                    groups.setdefault(id(col), [col, []])[1].append((e, v))
+                for col, rows in groups.values():
+                    col.upsert(
+                        ids=[e["id"] for e, _ in rows],
+                        documents=[e["document"] for e, _ in rows],
+                        embeddings=[v for _, v in rows],
+                        metadatas=[e["metadata"] for e, _ in rows],
+                    )
+            if self.on_flush is not None:
+                self.on_flush(batch, embs)
+            done = {e["id"] for e in batch}
+            with self._lock:
+                self.pending = [e for e in self.pending if e["id"] not in done]
+                self._rewrite_journal()
+            return len(batch)
+
+    def drop_user(self, user_id: str) -> None:
+        # wait out an in-flight flush so it can't re-add this user's messages afterwards
+        with self._flush_lock, self._lock:
+            self.pending = [e for e in self.pending if e["metadata"].get("user_id") != user_id]
+            self._rewrite_journal()
+
+    # ---- read-your-writes ----
+    def pending_for(self, user_id: str, session_id: str | None = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                e for e in self.pending
+                if e["metadata"].get("user_id") == user_id
+                and (session_id is None or e["metadata"].get("session_id") == session_id)
+            ]
+
+    # ---- background ----
+    def _run(self) -> None:
+        while not self._stop:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # entries stay pending (and journaled); retried on the next tick
+                print(f"[memory-writer] flush failed: {e}")
+
+    def close(self) -> None:
+        if self._stop:
+            return
+        self._stop = True
+        self._wake.set()
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"[memory-writer] final flush failed, {len(self.pending)} message(s) kept in journal: {e}")
+        with self._lock:
+            self._journal.close()
+            if not self.pending:
+                self.journal_path.unlink(missing_ok=True)
@@ -0,0 +1,98 @@
+"""
+One-off migration: move messages from the single `conversation_memory` collection
+into the per-user-hash bucket collections used by MemoryStore.
+
+    python src/migrate_memory.py            # copy (idempotent, safe to re-run)
+    python src/migrate_memory.py --drop-old # copy, then delete the old collection
+    python src/migrate_memory.py --rebuild-catalog  # (re)fill the session catalog from the buckets
+"""
+from __future__ import annotations
+import argparse, time
+from datetime import datetime, timezone
+
+
+from config import MEMORY_COLLECTION, MEMORY_BUCKETS, MEMORY_CATALOG_DB
+from memory import memory_collection_name
+from session_catalog import SessionCatalog
+from vector_store import get_client
+
+def _with_ts(meta: dict) -> dict:
+    if "ts" in meta:
+        return meta
+    try:
+        ts = datetime.fromisoformat(meta.get("timestamp", "").replace("Z", "")).astimezone(timezone.utc).timestamp()
+    except Exception:
+        ts = time.time()
+    return {**meta, "ts": ts}
+
+def migrate(page: int = 1000, drop_old: bool = False) -> int:
+    client = get_client()
+    try:
+        old = client.get_collection(MEMORY_COLLECTION)
+    except Exception:
+        print(f"No '{MEMORY_COLLECTION}' collection — nothing to migrate.")
+        return 0
+
+    buckets = {}
+    moved, offset = 0, 0
+    while True:
+        res = old.get(include=["documents", "metadatas", "embeddings"], limit=page, offset=offset)
+        ids = res.get("ids", [])
+        if not ids:
+            break
+        groups = {}
+        for i, d, m, e in zip(ids, res["documents"], res["metadatas"], res["embeddings"]):
+            name = memory_collection_name(m.get("user_id", ""))
+            groups.setdefault(name, []).append((i, d, _with_ts(m), e))
+        for name, rows in groups.items():
+            col = buckets.get(name) or buckets.setdefault(
+                name, client.get_or_create_collection(name, metadata={"hnsw:space": "cosine"}))
+            col.upsert(
+                ids=[r[0] for r in rows],
+                documents=[r[1] for r in rows],
+                metadatas=[r[2] for r in rows],
+                embeddings=[r[3] for r in rows],
+            )
+        moved += len(ids)
+        offset += len(ids)
+        print(f"  copied {moved} messages ...")
+
+    if drop_old:
+        client.delete_collection(MEMORY_COLLECTION)
+        print(f"Deleted '{MEMORY_COLLECTION}'.")
+    print(f"✓ Migrated {moved} messages into {len(buckets)} bucket collections.")
+    return moved
+
+def rebuild_catalog(page: int = 1000) -> int:
+    """Backfill the session catalog from every bucket (existing rows are kept)."""
+    client = get_client()
+    catalog = SessionCatalog(MEMORY_CATALOG_DB)
+    total = 0
+    for b in range(MEMORY_BUCKETS):
+        try:
+            col = client.get_collection(f"{MEMORY_COLLECTION}_{b:02d}")
+        except Exception:
+            continue
+        offset = 0
+        while True:
+            res = col.get(include=["documents", "metadatas"], limit=page, offset=offset)
+            ids = res.get("ids", [])
+            if not ids:
+                break
+            catalog.record_many((i, d, _with_ts(m)) for i, d, m in zip(ids, res["documents"], res["metadatas"]))
+            offset += len(ids)
+            total += len(ids)
+    print(f"✓ Catalogued {total} messages → {MEMORY_CATALOG_DB}")
+    return total
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--page", type=int, default=1000)
+    ap.add_argument("--drop-old", action="store_true", help="delete the unsharded collection afterwards")
+    ap.add_argument("--rebuild-catalog", action="store_true", help="only backfill the session catalog")
+    args = ap.parse_args()
+    if args.rebuild_catalog:
+        rebuild_catalog(page=args.page)
+    else:
+        migrate(page=args.page, drop_old=args.drop_old)
+        rebuild_catalog(page=args.page)
@@ -0,0 +1,147 @@
+"""
+Cross-act near-duplicate sections (IPC↔BNS, CrPC↔BNSS, IEA↔BSA).
+
+The 2023 codes re-enact most of the old ones nearly verbatim under new
+numbers. At build time every section of a superseded act is MinHashed
+(word 3-shingles, digits dropped so renumbered cross-references still
+match), candidate pairs come from LSH banding against the replacing act, and
+pairs whose exact shingle Jaccard reaches NEAR_DUP_JACCARD are folded: the
+old section is not chunked or embedded at all, and the chunk holding its
+canonical (new-act) section carries an `equivalents` metadata entry instead.
+
+    equivalents = '[["103", "IPC", "302"], ...]'   # [canonical section, act, section]
+
+The section index maps the old citation to the canonical chunk, and
+`format_equivalents` expands the entry back into citations at answer time.
+"""
+from __future__ import annotations
+from typing import Dict, List, Tuple, Iterable, Any
+import hashlib, json, re
+
+import numpy as np
+
+from config import NEAR_DUP_JACCARD, NEAR_DUP_NUM_PERM, NEAR_DUP_BANDS, NEAR_DUP_SHINGLE
+from chunker import HEADING, section_units
+
+_PRIME = (1 << 31) - 1
+_WORDS = re.compile(r"[^a-z ]+")
+
+
+def shingles(text: str, n: int = NEAR_DUP_SHINGLE) -> set:
+    words = _WORDS.sub(" ", text.lower()).split()
+    return {" ".join(words[i:i + n]) for i in range(max(0, len(words) - n + 1))}
+
+
+class MinHasher:
+    """Universal hashing (a*x + b) mod p over 32-bit shingle hashes."""
+    def __init__(self, num_perm: int = NEAR_DUP_NUM_PERM, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64)
+
+    def signature(self, sh: Iterable[str]) -> np.ndarray:
+        x = np.fromiter((int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+                         for s in sh), dtype=np.uint64)
+        if not x.size:
+            return np.full(self.a.size, _PRIME, dtype=np.uint64)
+        return (((x[:, None] * self.a) + self.b) % _PRIME).min(axis=0)
+
+
+class LSHIndex:
+    """Band the signatures; keys sharing any band bucket are candidates."""
+    def __init__(self, bands: int = NEAR_DUP_BANDS):
+        self.bands = bands
+        self.buckets: Dict[Tuple[int, bytes], List[Any]] = {}
+
+    def _keys(self, sig: np.ndarray):
+        rows = sig.size // self.bands
+        for b in range(self.bands):
+            yield b, sig[b * rows:(b + 1) * rows].tobytes()
+
+    def add(self, key: Any, sig: np.ndarray) -> None:
+        for k in self._keys(sig):
+            self.buckets.setdefault(k, []).append(key)
+
+    def candidates(self, sig: np.ndarray) -> set:
+        out = set()
+        for k in self._keys(sig):
+            out.update(self.buckets.get(k, ()))
+        return out
+
+
+def _jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+def sections_of(texts: Iterable[str], min_shingles: int = 8) -> Dict[str, set]:
+    """section number -> shingles of its text (table-of-contents line + body merged)."""
+    body: Dict[str, List[str]] = {}
+    for text in texts:
+        for sec, unit in section_units(text):
+            if sec is not None:
+                body.setdefault(sec, []).append(unit)
+    out = {}
+    for sec, units in body.items():
+        sh = shingles(" ".join(units))
+        if len(sh) >= min_shingles:
+            out[sec] = sh
+    return out
+
+def find_equivalents(old: Dict[str, set], new: Dict[str, set], threshold: float = NEAR_DUP_JACCARD,
+                     hasher: MinHasher | None = None) -> Dict[str, Tuple[str, float]]:
+    """old section -> (best new section, Jaccard) for every pair at or above `threshold`."""
+    hasher = hasher or MinHasher()
+    lsh = LSHIndex()
+    for sec, sh in new.items():
+        lsh.add(sec, hasher.signature(sh))
+    out = {}
+    for sec, sh in old.items():
+        best = max(((_jaccard(sh, new[c]), c) for c in lsh.candidates(hasher.signature(sh))), default=None)
+        if best and best[0] >= threshold:
+            out[sec] = (best[1], best[0])
+    return out
+
+
+class EquivalenceMap:
+    """Folded sections for the (superseded act, canonical act) pairs of one build."""
+    def __init__(self):
+        self.skip: Dict[str, set] = {}                                   # old act -> sections not chunked
+        self.canonical: Dict[str, Dict[str, List[Tuple[str, str]]]] = {}  # new act -> sec -> [(old act, sec)]
+
+    def add(self, old_act: str, new_act: str, pairs: Dict[str, Tuple[str, float]]) -> None:
+        self.skip.setdefault(old_act, set()).update(pairs)
+        canon = self.canonical.setdefault(new_act, {})
+        for old_sec, (new_sec, _) in sorted(pairs.items()):
+            canon.setdefault(new_sec, []).append((old_act, old_sec))
+
+    def folded(self) -> int:
+        return sum(len(s) for s in self.skip.values())
+
+    def for_chunk(self, act: str, text: str) -> str | None:
+        """`equivalents` metadata for a chunk of `act` (None when it holds no canonical section)."""
+        canon = self.canonical.get(act)
+        if not canon:
+            return None
+        secs = dict.fromkeys(m.group(1).upper() for m in map(HEADING.match, text.split("\n")) if m)
+        rows = [[sec, o_act, o_sec] for sec in secs for o_act, o_sec in canon.get(sec, ())]
+        return json.dumps(rows) if rows else None
+
+
+def build_equivalences(texts_by_act: Dict[str, List[str]], pairs: List[Tuple[str, str]]) -> EquivalenceMap:
+    eq = EquivalenceMap()
+    hasher = MinHasher()
+    for old_act, new_act in pairs:
+        if old_act in texts_by_act and new_act in texts_by_act:
+            found = find_equivalents(sections_of(texts_by_act[old_act]), sections_of(texts_by_act[new_act]),
+                                     hasher=hasher)
+            eq.add(old_act, new_act, found)
+    return eq
+
+def parse_equivalents(meta: Dict[str, Any]) -> List[Tuple[str, str, str]]:
+    try:
+        return [tuple(r) for r in json.loads(meta.get("equivalents") or "[]")]
+    except (TypeError, ValueError):
+        return []
+
+def format_equivalents(meta: Dict[str, Any]) -> str:
+    """'s.103 ≡ IPC s.302; s.80 ≡ IPC s.304B' (empty when the chunk has no folded sections)."""
+    return "; ".join(f"s.{sec} ≡ {act} s.{o_sec}" for sec, act, o_sec in parse_equivalents(meta))
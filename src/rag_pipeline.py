@@ -1,48 +1,193 @@
 from __future__ import annotations
-import os
-from typing import Dict, Any, List
+import asyncio, os, time
+from typing import Dict, Any, List, AsyncIterator
 
-import google.generativeai as genai
 from dotenv import load_dotenv
 
 from retriever import Retriever
 from memory import MemoryStore
-from context_builder import build_context_blocks, render_prompt
-from config import TOP_KB_SNIPPETS, TOP_MEMORY_AFTER_SCORE
+from context_builder import pack_context, render_prompt, estimate_tokens
+from answer_cache import AnswerCache, grounding_key
+from tracing import trace, span, record
+from config import TOP_KB_SNIPPETS, TOP_MEMORY_AFTER_SCORE, ANSWER_CACHE_ENABLED, GEMINI_MODEL, RETRIEVAL_SERVER_URL
 
-# Configure Gemini
 load_dotenv()
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+
+def load_gemini(model_name: str = GEMINI_MODEL):
+    # google.generativeai (grpc, protobuf) is slow to import; only pay for it when a model is needed
+    import google.generativeai as genai
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    return genai.GenerativeModel(model_name)
 
 class RAGEngine:
-    def __init__(self, kb_top: int = TOP_KB_SNIPPETS, mem_top: int = TOP_MEMORY_AFTER_SCORE):
-        self.retriever = Retriever(top_k=kb_top)
-        self.memory = MemoryStore()
+    def __init__(self, kb_top: int = TOP_KB_SNIPPETS, mem_top: int = TOP_MEMORY_AFTER_SCORE, llm=None):
+        if RETRIEVAL_SERVER_URL:
+            # another process owns the index, the embedder and memory writes (retrieval_server.py)
+            from retrieval_client import RemoteRetriever, RemoteMemoryStore
+            self.retriever = RemoteRetriever(RETRIEVAL_SERVER_URL, top_k=kb_top)
+            self.memory = RemoteMemoryStore(RETRIEVAL_SERVER_URL)
+        else:
+            self.retriever = Retriever(top_k=kb_top)
+            self.memory = MemoryStore()
         self.kb_top = kb_top
         self.mem_top = mem_top
-        self.model = genai.GenerativeModel("gemini-1.5-flash")
-
-    def answer(self, *, user_id: str, session_id: str, query: str) -> Dict[str, Any]:
-        # 1) Retrieve
-        kb_hits = self.retriever.search(query, top_k=self.kb_top)
-        mem_hits_scored = self.memory.search_relevant(user_id=user_id, session_id=session_id, query=query)
+        self._model = llm  # anything with Gemini's generate_content(_async); None = Gemini, loaded lazily
+        self.cache = AnswerCache() if ANSWER_CACHE_ENABLED else None
+        self._bg_tasks: set = set()  # write-behind persistence tasks (keep refs so they aren't GC'd)
 
-        # 2) Build context blocks under budget
-        blocks = build_context_blocks(kb_hits=kb_hits, mem_hits=mem_hits_scored)
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = load_gemini()
+        return self._model
 
-        # 3) Render prompt & query Gemini
-        prompt = render_prompt(query, blocks)
-        resp = self.model.generate_content(prompt)
-        text = getattr(resp, "text", "").strip()
+    def _build_prompt(self, query: str, kb_hits, mem_hits):
+        with span("prompt.build") as sp:
+            blocks, stats = pack_context(kb_hits=kb_hits, mem_hits=mem_hits, kb_top=self.kb_top, mem_top=self.mem_top)
+            prompt = render_prompt(query, blocks)
+            stats["prompt_tokens"] = estimate_tokens(prompt)
+            sp.set(prompt_tokens=stats["prompt_tokens"], blocks=stats["blocks"])
+        return prompt, stats
 
-        # 4) Persist Q&A to memory
-        self.memory.save_message(user_id=user_id, session_id=session_id, role="user", content=query)
-        self.memory.save_message(user_id=user_id, session_id=session_id, role="assistant", content=text)
+    def _persist_turn(self, user_id: str, session_id: str, query: str, text: str) -> None:
+        with span("memory.persist"):
+            self.memory.save_message(user_id=user_id, session_id=session_id, role="user", content=query)
+            self.memory.save_message(user_id=user_id, session_id=session_id, role="assistant", content=text)
 
-        # 5) Return structured result
+    def _result(self, text: str, kb_hits, mem_hits, prompt: str, pack: Dict[str, Any],
+                cache: Dict[str, Any] | None = None) -> Dict[str, Any]:
         return {
             "answer": text,
             "used_kb": kb_hits[:self.kb_top],
-            "used_memory": mem_hits_scored[:self.mem_top],
-            "prompt_chars": len(prompt)
+            "used_memory": mem_hits[:self.mem_top],
+            "prompt_chars": len(prompt),
+            "prompt_tokens": pack["prompt_tokens"],
+            "prompt_tokens_saved": pack["tokens_saved"],
+            "packing": pack,
+            "cache": cache or {"hit": False}
         }
+
+    # ---- semantic answer cache ----
+    def _cache_key(self, query: str, kb_hits, pack: Dict[str, Any]):
+        if self.cache is None:
+            return None, None
+        q_vec = self.retriever.embedder.embed(query)  # already cached by retrieval
+        return q_vec, grounding_key(kb_hits[:self.kb_top], pack.get("memory_ids", []))
+
+    def _cache_lookup(self, q_vec, grounding) -> Dict[str, Any] | None:
+        if self.cache is None:
+            return None
+        with span("cache.lookup") as sp:
+            hit = self.cache.lookup(q_vec, grounding)
+            sp.set(cache_hit=bool(hit))
+        return {"hit": True, **hit} if hit else None
+
+    def _cache_store(self, q_vec, grounding, query: str, text: str, gen_s: float) -> None:
+        if self.cache is not None:
+            self.cache.put(q_vec, grounding, query, text, gen_s)
+
+    def answer(self, *, user_id: str, session_id: str, query: str) -> Dict[str, Any]:
+        with trace("answer", user_id=user_id, session_id=session_id):
+            # 1) Retrieve
+            kb_hits = self.retriever.search(query, top_k=self.kb_top)
+            mem_hits_scored = self.memory.search_relevant(user_id=user_id, session_id=session_id, query=query)
+
+            # 2) Build context blocks under budget, 3) render prompt & query Gemini (unless cached)
+            prompt, pack = self._build_prompt(query, kb_hits, mem_hits_scored)
+            q_vec, grounding = self._cache_key(query, kb_hits, pack)
+            cached = self._cache_lookup(q_vec, grounding)
+            if cached:
+                text = cached["answer"]
+            else:
+                with span("llm.generate"):
+                    t0 = time.perf_counter()
+                    resp = self.model.generate_content(prompt)
+                    text = getattr(resp, "text", "").strip()
+                self._cache_store(q_vec, grounding, query, text, time.perf_counter() - t0)
+
+            # 4) Persist Q&A to memory
+            self._persist_turn(user_id, session_id, query, text)
+
+            # 5) Return structured result
+            return self._result(text, kb_hits, mem_hits_scored, prompt, pack, cached)
+
+    # ---- async / streaming ----
+    async def _retrieve_async(self, *, user_id: str, session_id: str, query: str):
+        # KB and memory lookups are independent: run them concurrently off the event loop
+        return await asyncio.gather(
+            asyncio.to_thread(self.retriever.search, query, top_k=self.kb_top),
+            asyncio.to_thread(self.memory.search_relevant, user_id=user_id, session_id=session_id, query=query),
+        )
+
+    def _persist_in_background(self, user_id: str, session_id: str, query: str, text: str) -> None:
+        task = asyncio.create_task(asyncio.to_thread(self._persist_turn, user_id, session_id, query, text))
+        self._bg_tasks.add(task)
+        task.add_done_callback(self._persist_done)
+
+    def _persist_done(self, task: asyncio.Task) -> None:
+        self._bg_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            # nobody awaits these tasks: report the failure, or the turn is silently lost
+            e = task.exception()
+            print(f"[rag] memory persist failed: {type(e).__name__}: {e}")
+
+    async def answer_stream(self, *, user_id: str, session_id: str, query: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yields {"done": False, "delta", "answer"} events as Gemini tokens arrive, then one
+        final {"done": True, ...} event shaped like answer(). The memory write is scheduled
+        as a background task just before the final event and runs concurrently with it
+        (a consumer may stop iterating at "done", so nothing is left after that yield).
+        """
+        tr = trace("answer_stream", user_id=user_id, session_id=session_id).start()
+        error = None
+        try:
+            kb_hits, mem_hits_scored = await self._retrieve_async(user_id=user_id, session_id=session_id, query=query)
+            # packing, the query embedding (an RPC in remote mode) and the cache's SQLite/numpy
+            # work all block: keep them off the event loop too
+            prompt, pack = await asyncio.to_thread(self._build_prompt, query, kb_hits, mem_hits_scored)
+            q_vec, grounding = await asyncio.to_thread(self._cache_key, query, kb_hits, pack)
+            cached = await asyncio.to_thread(self._cache_lookup, q_vec, grounding)
+            if cached:
+                text = cached["answer"]
+                yield {"done": False, "delta": text, "answer": text}
+                self._persist_in_background(user_id, session_id, query, text)
+                yield {"done": True, **self._result(text, kb_hits, mem_hits_scored, prompt, pack, cached)}
+                return
+
+            parts: List[str] = []
+            t0 = time.perf_counter()
+            ttft = None
+            resp = await self.model.generate_content_async(prompt, stream=True)
+            async for chunk in resp:
+                try:
+                    delta = chunk.text
+                except ValueError:
+                    # chunk without text parts (e.g. safety/finish metadata only)
+                    continue
+                if not delta:
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - t0
+                parts.append(delta)
+                yield {"done": False, "delta": delta, "answer": "".join(parts)}
+
+            text = "".join(parts).strip()
+            gen_s = time.perf_counter() - t0
+            # timed by hand: a span can't stay open across the yields above
+            record("llm.generate", gen_s, stream=True, first_token_ms=round((ttft or gen_s) * 1000, 3))
+            await asyncio.to_thread(self._cache_store, q_vec, grounding, query, text, gen_s)
+            self._persist_in_background(user_id, session_id, query, text)
+            yield {"done": True, **self._result(text, kb_hits, mem_hits_scored, prompt, pack)}
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            tr.finish(error)
+
+    async def answer_async(self, *, user_id: str, session_id: str, query: str) -> Dict[str, Any]:
+        result: Dict[str, Any] = {}
+        async for ev in self.answer_stream(user_id=user_id, session_id=session_id, query=query):
+            if ev["done"]:
+                result = ev
+        result.pop("done", None)
+        return result
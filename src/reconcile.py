@@ -0,0 +1,183 @@
+"""
+Garbage-collect KB chunks that the current sources no longer produce.
+
+    python src/reconcile.py            # dry run: print the diff, change nothing
+    python src/reconcile.py --apply    # delete orphans, compact if needed, rebuild BM25 + section index
+
+The live set is every chunk make_docs() yields from data/processed + notes
+today (same chunker, same near-duplicate folding, same sha ids as the build).
+Ids in `kb_india_law` or the registry outside that set are orphans: edited
+sections' old text, removed acts, chunks of an older chunker. They are deleted
+in batches of RECONCILE_BATCH_SIZE, Chroma first and then the registry, so an
+interrupted run just finds the rest on the next one.
+
+Chroma's HNSW index only marks deleted vectors, so the graph keeps their
+nodes. Deletions are counted in the registry and, once they reach
+COMPACT_TOMBSTONE_RATIO of the collection, the live rows (with their stored
+embeddings, nothing is re-encoded) are copied into a fresh collection that
+then takes over the name. The old collection is dropped only once the copy's
+row count matches; if the process dies before the rename, the next run (or
+build, or app start) finds the name missing or empty and finishes the rename
+instead of discarding the copy. Run --apply with the app stopped: the swap
+replaces the collection the app has open.
+"""
+from __future__ import annotations
+from typing import Dict, Any, List
+import argparse, collections
+
+from config import (
+    KB_COLLECTION, STATE_DB, LEGACY_STATE_JSON, LEXICAL_DIR, SECTION_INDEX_PATH,
+    RECONCILE_BATCH_SIZE, COMPACT_TOMBSTONE_RATIO,
+)
+from utils import sha256_text
+from state_registry import StateRegistry
+from vector_store import get_client, finish_swap
+from lexical_index import build_lexical_index, iter_collection
+from section_index import SectionIndexBuilder
+from build_or_update_index import make_docs, near_duplicates, doc_id_for
+
+DELETED_KEY = "kb_deleted_since_compact"
+
+
+def live_chunks(sections: SectionIndexBuilder | None = None) -> Dict[str, Dict[str, Any]]:
+    """doc id -> meta for every chunk the current sources produce (feeds `sections` on the way)."""
+    live = {}
+    for doc in make_docs(near_duplicates()):
+        text = doc["text"].strip()
+        doc_id = doc_id_for(sha256_text(text))
+        if sections is not None:
+            sections.add(doc_id, text, doc["meta"])
+        live[doc_id] = doc["meta"]
+    return live
+
+def collection_ids(col, page: int = 5000) -> Dict[str, Dict[str, Any]]:
+    out, offset = {}, 0
+    while True:
+        res = col.get(include=["metadatas"], limit=page, offset=offset)
+        ids = res.get("ids", [])
+        if not ids:
+            return out
+        out.update(zip(ids, res.get("metadatas", [])))
+        offset += len(ids)
+
+
+def diff(col, state: StateRegistry, live: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    in_kb = collection_ids(col)
+    reg = {doc_id_for(sha): sha for sha in state.shas()}
+    orphan_kb = sorted(set(in_kb) - set(live))
+    orphan_reg = sorted(set(reg) - set(live))
+    by_act = collections.Counter((in_kb.get(i) or {}).get("act", "?") for i in orphan_kb)
+    return {
+        "live": len(live),
+        "in_collection": len(in_kb),
+        "in_registry": len(reg),
+        "orphan_ids": orphan_kb,
+        "orphan_shas": [reg[i] for i in orphan_reg],
+        "orphans_by_act": dict(by_act.most_common()),
+        "missing": len(set(live) - set(in_kb)),   # not indexed yet: run build_or_update_index.py
+    }
+
+def print_diff(d: Dict[str, Any], show: int = 10) -> None:
+    print(f"Live chunks from sources : {d['live']}")
+    print(f"In '{KB_COLLECTION}'     : {d['in_collection']}  ({len(d['orphan_ids'])} orphaned)")
+    print(f"In registry              : {d['in_registry']}  ({len(d['orphan_shas'])} orphaned)")
+    if d["missing"]:
+        print(f"Not indexed yet          : {d['missing']}  (run build_or_update_index.py)")
+    for act, n in d["orphans_by_act"].items():
+        print(f"  - {act}: {n}")
+    for i in d["orphan_ids"][:show]:
+        print(f"    {i}")
+    if len(d["orphan_ids"]) > show:
+        print(f"    ... {len(d['orphan_ids']) - show} more")
+
+
+# ---- apply ----
+def _batched(xs: List[str], n: int):
+    for i in range(0, len(xs), n):
+        yield xs[i:i + n]
+
+def delete_orphans(col, state: StateRegistry, d: Dict[str, Any], batch_size: int = RECONCILE_BATCH_SIZE) -> int:
+    deleted = 0
+    for ids in _batched(d["orphan_ids"], batch_size):
+        col.delete(ids=ids)
+        deleted += len(ids)
+        state.set_info(DELETED_KEY, str(int(state.get_info(DELETED_KEY) or 0) + len(ids)))
+        state.save()
+    for shas in _batched(d["orphan_shas"], batch_size):
+        state.remove_many(shas)
+        state.save()
+    return deleted
+
+def tombstone_ratio(col, state: StateRegistry) -> float:
+    deleted = int(state.get_info(DELETED_KEY) or 0)
+    total = col.count() + deleted
+    return deleted / total if total else 0.0
+
+def compact(client, col, state: StateRegistry, page: int = RECONCILE_BATCH_SIZE):
+    """Copy live rows into a fresh collection (new HNSW graph, no tombstones) and swap it in."""
+    tmp_name = f"{KB_COLLECTION}__compact"
+    try:
+        client.delete_collection(tmp_name)  # unfinished copy of an interrupted run (`col` still has the rows)
+    except Exception:
+        pass
+    tmp = client.create_collection(tmp_name, metadata={"hnsw:space": "cosine"})
+    offset = 0
+    while True:
+        res = col.get(include=["documents", "metadatas", "embeddings"], limit=page, offset=offset)
+        ids = res.get("ids", [])
+        if not ids:
+            break
+        tmp.add(ids=ids, documents=res["documents"], metadatas=res["metadatas"], embeddings=res["embeddings"])
+        offset += len(ids)
+    if tmp.count() != col.count():
+        client.delete_collection(tmp_name)
+        raise RuntimeError(f"compaction copied {tmp.count()} of {col.count()} rows; original left untouched")
+    # from here a crash leaves a verified copy: finish_swap() completes the rename on the next start
+    client.delete_collection(KB_COLLECTION)
+    tmp.modify(name=KB_COLLECTION)
+    state.set_info(DELETED_KEY, "0")
+    state.save()
+    print(f"✓ Compacted '{KB_COLLECTION}': {tmp.count()} rows in a fresh index")
+    return client.get_collection(KB_COLLECTION)
+
+
+def main(apply: bool = False, force_compact: bool = False, show: int = 10) -> Dict[str, Any]:
+    client = get_client()
+    swapped = finish_swap(client, KB_COLLECTION)
+    col = client.get_or_create_collection(KB_COLLECTION, metadata={"hnsw:space": "cosine"})
+    state = StateRegistry(STATE_DB, legacy_json=LEGACY_STATE_JSON)
+    if swapped:
+        state.set_info(DELETED_KEY, "0")
+        state.save()
+    sections = SectionIndexBuilder()
+
+    live = live_chunks(sections)
+    d = diff(col, state, live)
+    print_diff(d, show)
+    if not apply:
+        if d["orphan_ids"] or d["orphan_shas"]:
+            print("Dry run — nothing changed. Re-run with --apply to delete the orphans.")
+        return d
+
+    deleted = delete_orphans(col, state, d)
+    print(f"✓ Deleted {deleted} orphaned chunks from '{KB_COLLECTION}', {len(d['orphan_shas'])} from the registry")
+    ratio = tombstone_ratio(col, state)
+    print(f"Tombstone ratio: {ratio:.1%} (compaction at {COMPACT_TOMBSTONE_RATIO:.0%})")
+    compacted = force_compact or ratio >= COMPACT_TOMBSTONE_RATIO
+    if compacted:
+        col = compact(client, col, state)
+
+    n = sections.save(SECTION_INDEX_PATH)
+    print(f"✓ Section index: {n} (act, section) keys → {SECTION_INDEX_PATH}")
+    if deleted or compacted:
+        n = build_lexical_index(iter_collection(col), LEXICAL_DIR)
+        print(f"✓ BM25 index: {n} chunks → {LEXICAL_DIR}/")
+    return d
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--apply", action="store_true", help="delete orphans (default: dry run)")
+    ap.add_argument("--compact", action="store_true", help="compact even below COMPACT_TOMBSTONE_RATIO (with --apply)")
+    ap.add_argument("--show", type=int, default=10, help="orphan ids to list in the diff")
+    args = ap.parse_args()
+    main(args.apply, args.compact, args.show)
@@ -0,0 +1,119 @@
+from __future__ import annotations
+from collections import OrderedDict
+from typing import List, Dict, Any, Tuple
+import threading, time
+
+from config import (
+    RERANK_MODEL, RERANK_BACKEND, RERANK_ONNX_FILE, RERANK_BATCH_SIZE, RERANK_BUDGET_MS, RERANK_CACHE_SIZE,
+    RERANK_MAX_CHARS,
+)
+from utils import sha256_text
+
+
+def _load_cross_encoder(model_name: str, backend: str):
+    """CrossEncoder on ONNX Runtime (int8 file from the model repo) when available, else PyTorch."""
+    from sentence_transformers import CrossEncoder
+    if backend == "onnx":
+        try:
+            return CrossEncoder(model_name, backend="onnx", model_kwargs={"file_name": RERANK_ONNX_FILE}), "onnx"
+        except Exception as e:  # older sentence-transformers, no onnxruntime/optimum, or file missing
+            print(f"[reranker] ONNX backend unavailable ({e}); using PyTorch.")
+    return CrossEncoder(model_name), "torch"
+
+
+class Reranker:
+    """
+    Cross-encoder rerank of a retrieval pool. Pairs are scored in batches under a
+    per-request time budget; if the budget runs out the pool keeps its bi-encoder
+    (fusion) order. Scores are cached per (query, chunk id), so partial work from
+    a timed-out request still speeds up the next identical one.
+    """
+    def __init__(self, model_name: str = RERANK_MODEL, backend: str = RERANK_BACKEND,
+                 batch_size: int = RERANK_BATCH_SIZE, budget_ms: float = RERANK_BUDGET_MS,
+                 cache_size: int = RERANK_CACHE_SIZE):
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = max(1, batch_size)
+        self.budget = budget_ms / 1000.0
+        self.cache_size = cache_size
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self.calls = 0
+        self.fallbacks = 0
+        self.cache_hits = 0
+        self.scored = 0
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    self._model, self.backend = _load_cross_encoder(self.model_name, self.backend)
+        return self._model
+
+    # ---- cache ----
+    def _cached(self, keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], float]:
+        out = {}
+        with self._lock:
+            for k in keys:
+                s = self._cache.get(k)
+                if s is not None:
+                    self._cache.move_to_end(k)
+                    out[k] = s
+            self.cache_hits += len(out)
+        return out
+
+    def _store(self, scores: Dict[Tuple[str, str], float]) -> None:
+        with self._lock:
+            self._cache.update(scores)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # ---- rerank ----
+    def rerank(self, query: str, items: List[Dict[str, Any]], top_k: int) -> List[Dict[str, Any]]:
+        """Top `top_k` of `items` by cross-encoder score (adds "rerank_score"), or the input order on timeout."""
+        if len(items) <= 1:
+            return items[:top_k]
+        model = self.model  # first-call load is not charged to the request budget
+        deadline = time.perf_counter() + self.budget
+        qh = sha256_text(query)
+        keys = [(qh, str(it["id"])) for it in items]
+        scores = self._cached(keys)
+        todo = [i for i, k in enumerate(keys) if k not in scores]
+
+        timed_out = False
+        for start in range(0, len(todo), self.batch_size):
+            if time.perf_counter() > deadline:
+                timed_out = True
+                break
+            idx = todo[start:start + self.batch_size]
+            pairs = [(query, items[i]["content"][:RERANK_MAX_CHARS]) for i in idx]
+            fresh = {keys[i]: float(s) for i, s in zip(idx, model.predict(pairs, batch_size=len(pairs)))}
+            self._store(fresh)
+            scores.update(fresh)
+            self.scored += len(fresh)
+
+        with self._lock:
+            self.calls += 1
+            if timed_out:
+                self.fallbacks += 1
+        if timed_out:
+            return items[:top_k]
+        ranked = sorted(
+            ({**it, "rerank_score": scores[k]} for it, k in zip(items, keys)),
+            key=lambda x: x["rerank_score"], reverse=True,
+        )
+        return ranked[:top_k]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "calls": self.calls,
+                "fallbacks": self.fallbacks,
+                "pairs_scored": self.scored,
+                "cache_hits": self.cache_hits,
+                "cache_size": len(self._cache),
+            }
@@ -0,0 +1,128 @@
+"""
+Client side of retrieval_server.py: drop-in stand-ins for Retriever,
+MemoryStore and the embedder that forward every call to the shared server.
+RAGEngine uses them when RETRIEVAL_SERVER_URL is set, so a web worker
+never opens vectorstore/ or loads the embedding model itself.
+"""
+from __future__ import annotations
+from http.client import HTTPConnection, HTTPException
+from typing import List, Dict, Any
+from urllib.parse import urlparse
+import json, threading, uuid
+
+import numpy as np
+
+from config import RETRIEVAL_SERVER_URL, RETRIEVAL_SERVER_TIMEOUT_S, TOP_MEMORY_AFTER_SCORE, MAX_MEMORY_CANDIDATES
+from tracing import span
+
+
+class RetrievalServerError(RuntimeError):
+    pass
+
+
+# safe to send twice: a request lost with its connection is retried once on a new one
+RETRY_SAFE = frozenset({
+    "embed", "kb.search", "kb.search_many", "memory.search_relevant", "memory.list_sessions",
+    "memory.get_recent_memory", "memory.flush",
+    "memory.save_message",  # carries a client-generated message_id
+})
+
+
+class RpcClient:
+    """
+    JSON-over-HTTP calls on one keep-alive connection per thread. Methods not
+    in RETRY_SAFE (delete/trim/compact) are never retried; they go out on a
+    fresh connection instead, so an idle one closed by the server can't fail them.
+    """
+    def __init__(self, url: str = RETRIEVAL_SERVER_URL, timeout: float = RETRIEVAL_SERVER_TIMEOUT_S):
+        u = urlparse(url)
+        self.host, self.port = u.hostname or "127.0.0.1", u.port or 80
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _conn(self, fresh: bool = False) -> HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or fresh:
+            if conn is not None:
+                conn.close()
+            conn = self._local.conn = HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def call(self, method: str, **kwargs) -> Any:
+        body = json.dumps(kwargs, ensure_ascii=False).encode("utf-8")
+        retry = method in RETRY_SAFE
+        with span(f"rpc.{method}"):
+            for attempt in ((0, 1) if retry else (0,)):
+                conn = self._conn(fresh=attempt > 0 or not retry)
+                try:
+                    conn.request("POST", f"/{method}", body, {"Content-Type": "application/json"})
+                    resp = conn.getresponse()
+                    data = resp.read()
+                    break
+                except (ConnectionError, HTTPException):
+                    if attempt or not retry:  # the server closed an idle keep-alive connection: retry once
+                        raise
+        out = json.loads(data or b"{}")
+        if resp.status != 200:
+            raise RetrievalServerError(f"{method}: {out.get('error') or resp.status}")
+        return out["result"]
+
+
+class RemoteEmbedder:
+    def __init__(self, rpc: RpcClient):
+        self.rpc = rpc
+
+    def embed_many(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self.rpc.call("embed", texts=list(texts)), dtype=np.float32)
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.embed_many([text])[0]
+
+
+class RemoteRetriever:
+    def __init__(self, url: str = RETRIEVAL_SERVER_URL, top_k: int = 5):
+        self.rpc = RpcClient(url)
+        self.embedder = RemoteEmbedder(self.rpc)
+        self.top_k = top_k
+
+    def search(self, query: str, top_k: int | None = None) -> List[Dict[str, Any]]:
+        return self.rpc.call("kb.search", query=query, top_k=top_k or self.top_k)
+
+    def search_many(self, queries: List[str], top_k: int | None = None) -> List[List[Dict[str, Any]]]:
+        return self.rpc.call("kb.search_many", queries=list(queries), top_k=top_k or self.top_k)
+
+
+class RemoteMemoryStore:
+    def __init__(self, url: str = RETRIEVAL_SERVER_URL):
+        self.rpc = RpcClient(url)
+
+    def save_message(self, *, user_id: str, session_id: str, role: str, content: str) -> str:
+        return self.rpc.call("memory.save_message", user_id=user_id, session_id=session_id, role=role, content=content,
+                             message_id=str(uuid.uuid4()))
+
+    def flush(self) -> int:
+        return self.rpc.call("memory.flush")
+
+    def search_relevant(self, *, user_id: str, session_id: str, query: str,
+                        n_candidates: int = MAX_MEMORY_CANDIDATES,
+                        top_k: int = TOP_MEMORY_AFTER_SCORE) -> List[Dict[str, Any]]:
+        return self.rpc.call("memory.search_relevant", user_id=user_id, session_id=session_id, query=query,
+                             n_candidates=n_candidates, top_k=top_k)
+
+    def delete_user(self, user_id: str):
+        return self.rpc.call("memory.delete_user", user_id=user_id)
+
+    def trim_user(self, user_id: str, keep_last: int = 500):
+        return self.rpc.call("memory.trim_user", user_id=user_id, keep_last=keep_last)
+
+    def compact(self, user_id: str | None = None, dry_run: bool = False, **options) -> Dict[str, int]:
+        """Run memory_compactor inside the server (the only process allowed to write)."""
+        return self.rpc.call("memory.compact", user_id=user_id, dry_run=dry_run, **options)
+
+    def list_sessions(self, *, user_id: str, limit: int = 50):
+        return self.rpc.call("memory.list_sessions", user_id=user_id, limit=limit)
+
+    def get_recent_memory(self, *, user_id: str, session_id: str = None, limit: int = 50,
+                          before_ts: float | None = None):
+        return self.rpc.call("memory.get_recent_memory", user_id=user_id, session_id=session_id, limit=limit,
+                             before_ts=before_ts)
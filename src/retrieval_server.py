@@ -0,0 +1,147 @@
+"""
+Shared retrieval + memory server for multi-worker deployments.
+
+    python src/retrieval_server.py --port 7861
+    # config.py: RETRIEVAL_SERVER_URL = "http://127.0.0.1:7861"  → workers use retrieval_client
+
+One process owns vectorstore/ (the Chroma client and its HNSW segments), the
+embedding model, the memory write-behind buffer and the session catalog. Web
+workers send JSON over local HTTP/1.1 (keep-alive): POST /<method> with the
+keyword arguments, and get back {"result": ...} or {"error": ...}. N workers
+thus share one index copy in RAM. All writes go through the single
+MemoryWriter here, and maintenance (delete/trim/compact) is serialised by a
+lock. Concurrent searches still batch: the embedder micro-batches the encodes
+of requests in flight, and kb.search_many sends one ANN query per batch.
+
+GET /healthz and GET /metrics (the tracing histograms of this process) are
+also served.
+"""
+from __future__ import annotations
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, Callable
+import argparse, json, threading, time
+
+import numpy as np
+
+from config import (
+    RETRIEVAL_SERVER_HOST, RETRIEVAL_SERVER_PORT, TOP_KB_SNIPPETS,
+    MEMORY_RECENT_TURNS, MEMORY_SESSION_IDLE_HOURS, MEMORY_SUMMARISER,
+)
+import tracing
+
+
+def _jsonable(o):
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, np.generic):
+        return o.item()
+    raise TypeError(f"{type(o).__name__} is not JSON serialisable")
+
+
+class RetrievalService:
+    """The methods exposed over RPC; arguments and results are plain JSON values."""
+    def __init__(self, top_k: int = TOP_KB_SNIPPETS):
+        from retriever import Retriever
+        from memory import MemoryStore
+        self.retriever = Retriever(top_k=top_k)
+        self.memory = MemoryStore()
+        self._write_lock = threading.Lock()
+        self.methods: Dict[str, Callable[..., Any]] = {
+            "embed": self.embed,
+            "kb.search": self.retriever.search,
+            "kb.search_many": self.retriever.search_many,
+            "memory.search_relevant": self.memory.search_relevant,
+            "memory.save_message": self.memory.save_message,
+            "memory.flush": self.memory.flush,
+            "memory.list_sessions": self.memory.list_sessions,
+            "memory.get_recent_memory": self.memory.get_recent_memory,
+            "memory.delete_user": self._locked(self.memory.delete_user),
+            "memory.trim_user": self._locked(self.memory.trim_user),
+            "memory.compact": self._locked(self.compact),
+        }
+
+    def _locked(self, fn):
+        def call(**kwargs):
+            with self._write_lock:
+                return fn(**kwargs)
+        return call
+
+    def embed(self, texts):
+        return self.retriever.embedder.embed_many(texts)
+
+    def compact(self, user_id: str | None = None, dry_run: bool = False, keep_recent: int = MEMORY_RECENT_TURNS,
+                idle_hours: float = MEMORY_SESSION_IDLE_HOURS, summariser: str = MEMORY_SUMMARISER):
+        from memory_compactor import MemoryCompactor, load_summariser
+        comp = MemoryCompactor(self.memory, load_summariser(summariser), keep_recent, idle_hours)
+        return comp.compact_user(user_id, dry_run) if user_id else comp.compact_all(dry_run)
+
+    def close(self):
+        self.memory.writer.close()
+
+
+def make_handler(service: RetrievalService):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive: one connection per worker thread
+
+        def _send(self, status: int, body: bytes, ctype: str = "application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.startswith("/healthz"):
+                self._send(200, b'{"ok": true}')
+            elif self.path.startswith("/metrics"):
+                self._send(200, tracing.render_metrics().encode("utf-8"), "text/plain; version=0.0.4")
+            else:
+                self._send(404, b'{"error": "not found"}')
+
+        def do_POST(self):
+            fn = service.methods.get(self.path.strip("/"))
+            try:
+                kwargs = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            except ValueError as e:
+                return self._send(400, json.dumps({"error": f"bad JSON: {e}"}).encode("utf-8"))
+            if fn is None:
+                return self._send(404, json.dumps({"error": f"unknown method {self.path!r}"}).encode("utf-8"))
+            try:
+                out = {"result": fn(**kwargs)}
+                status = 200
+            except TypeError as e:  # wrong/missing arguments
+                out, status = {"error": f"TypeError: {e}"}, 400
+            except Exception as e:
+                out, status = {"error": f"{type(e).__name__}: {e}"}, 500
+            self._send(status, json.dumps(out, ensure_ascii=False, default=_jsonable).encode("utf-8"))
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(host: str = RETRIEVAL_SERVER_HOST, port: int = RETRIEVAL_SERVER_PORT, top_k: int = TOP_KB_SNIPPETS):
+    t0 = time.perf_counter()
+    service = RetrievalService(top_k)
+    service.retriever.search("warm up", top_k=1)  # load the KB HNSW segment before taking traffic
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    print(f"✓ Retrieval server on http://{host}:{port} (ready in {time.perf_counter() - t0:.1f}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default=RETRIEVAL_SERVER_HOST)
+    ap.add_argument("--port", type=int, default=RETRIEVAL_SERVER_PORT)
+    ap.add_argument("--trace", action="store_true", help="collect stage histograms (served on /metrics)")
+    args = ap.parse_args()
+    if args.trace:
+        tracing.enable(True)
+    serve(args.host, args.port)
@@ -1,27 +1,124 @@
 from __future__ import annotations
 from typing import List, Dict, Any
-import chromadb
-from sentence_transformers import SentenceTransformer
 
-from config import VECTOR_DIR, KB_COLLECTION, EMB_MODEL
+from config import (
+    KB_COLLECTION, LEXICAL_DIR, HYBRID_SEARCH, HYBRID_CANDIDATES, RRF_K,
+    SECTION_INDEX_PATH, RERANK_ENABLED, RERANK_POOL,
+)
+from embeddings import get_embedder
+from vector_store import get_client, finish_swap
+from lexical_index import LexicalIndex, rrf_fuse
+from section_index import SectionIndex
+from reranker import Reranker
+from tracing import span, annotate
 
 class Retriever:
     def __init__(self, top_k: int = 5):
-        self.client = chromadb.PersistentClient(path=str(VECTOR_DIR))
+        self.client = get_client()
+        finish_swap(self.client, KB_COLLECTION)
         self.kb = self.client.get_or_create_collection(KB_COLLECTION)
-        self.embedder = SentenceTransformer(EMB_MODEL)
+        self.embedder = get_embedder()
         self.top_k = top_k
+        self.lexical = LexicalIndex.load(LEXICAL_DIR) if HYBRID_SEARCH else None
+        self.sections = SectionIndex.load(SECTION_INDEX_PATH)
+        self.reranker = Reranker() if RERANK_ENABLED else None
+
+    def _citation_search(self, query: str, k: int) -> List[Dict[str, Any]]:
+        # "IPC 302" / "Article 21": exact chunks by id, no embedding or ANN search
+        ids = self.sections.lookup(query)[:k] if self.sections else []
+        if not ids:
+            return []
+        with span("kb.citation", candidates=len(ids)):
+            res = self.kb.get(ids=ids, include=["documents", "metadatas"])
+        got = {i: (d, m) for i, d, m in zip(res.get("ids", []), res.get("documents", []), res.get("metadatas", []))}
+        return [
+            {"id": i, "content": got[i][0], "meta": got[i][1], "score": 1.0, "match": "citation"}
+            for i in ids if i in got
+        ]
+
+    def _vector_search(self, query: str, k: int) -> List[Dict[str, Any]]:
+        return self._vector_search_many([query], k)[0]
+
+    def _vector_search_many(self, queries: List[str], k: int) -> List[List[Dict[str, Any]]]:
+        # one batched encode and one kb.query with many query_embeddings
+        q_embs = self.embedder.embed_many(queries)
+        with span("kb.ann", candidates=k, queries=len(queries)):
+            res = self.kb.query(query_embeddings=list(q_embs), n_results=k)
+        out = []
+        for ids, docs, mets, dists in zip(res.get("ids", []), res.get("documents", []),
+                                          res.get("metadatas", []), res.get("distances", [])):
+            items = []
+            for i, d, m, dist in zip(ids, docs, mets, dists):
+                sim = 1.0 - float(dist)
+                items.append({"id": i, "content": d, "meta": m, "score": sim})
+            items.sort(key=lambda x: x["score"], reverse=True)
+            out.append(items)
+        return out
 
     def search(self, query: str, top_k: int | None = None) -> List[Dict[str, Any]]:
+        with span("kb.search") as sp:
+            items = self._search(query, top_k or self.top_k)
+            sp.set(results=len(items))
+            return items
+
+    def search_many(self, queries: List[str], top_k: int | None = None) -> List[List[Dict[str, Any]]]:
+        """search() for many queries at once: cited ones by id, the rest in one batched ANN query."""
         k = top_k or self.top_k
-        q_emb = self.embedder.encode([query])[0]
-        res = self.kb.query(query_embeddings=[q_emb], n_results=k)
-        docs = res.get("documents", [[]])[0]
-        mets = res.get("metadatas", [[]])[0]
-        dists = res.get("distances", [[]])[0]
+        with span("kb.search_many", candidates=len(queries)):
+            out = [self._citation_search(q, k) for q in queries]
+            todo = [i for i, items in enumerate(out) if not items]
+            if todo:
+                cand_k = max(k, RERANK_POOL) if self.reranker is not None else k
+                vecs = self._vector_search_many([queries[i] for i in todo], self._vector_pool(cand_k))
+                for i, vec in zip(todo, vecs):
+                    out[i] = self._finish(queries[i], k, cand_k, vec)
+            return out
+
+    def _search(self, query: str, k: int) -> List[Dict[str, Any]]:
+        exact = self._citation_search(query, k)
+        if exact:
+            annotate(match="citation")
+            return exact
+        cand_k = max(k, RERANK_POOL) if self.reranker is not None else k
+        return self._finish(query, k, cand_k)
+
+    def _finish(self, query: str, k: int, cand_k: int, vec: List[Dict[str, Any]] | None = None):
+        pool = self._candidates(query, cand_k, vec)
+        if self.reranker is None:
+            return pool
+        with span("kb.rerank", candidates=len(pool)):
+            return self.reranker.rerank(query, pool, k)
+
+    def _vector_pool(self, k: int) -> int:
+        return max(k, HYBRID_CANDIDATES) if self.lexical is not None else k
+
+    def _candidates(self, query: str, k: int, vec: List[Dict[str, Any]] | None = None) -> List[Dict[str, Any]]:
+        # `vec`: vector hits already fetched with n_results=_vector_pool(k) (batched path)
+        pool = self._vector_pool(k)
+        if vec is None:
+            vec = self._vector_search(query, pool)
+        if self.lexical is None:
+            return vec[:k]
+
+        # Hybrid: vector + BM25 pools fused with reciprocal rank fusion
+        with span("kb.bm25") as sp:
+            lex = self.lexical.search(query, pool)
+            sp.set(candidates=len(lex))
+        fused = rrf_fuse([[v["id"] for v in vec], [doc_id for doc_id, _ in lex]], k=RRF_K)[:k]
+
+        by_id = {v["id"]: v for v in vec}
+        missing = [doc_id for doc_id, _ in fused if doc_id not in by_id]
+        if missing:
+            # lexical-only hits: fetch their text from Chroma (ids may be stale → skipped)
+            res = self.kb.get(ids=missing, include=["documents", "metadatas"])
+            for i, d, m in zip(res.get("ids", []), res.get("documents", []), res.get("metadatas", [])):
+                by_id[i] = {"id": i, "content": d, "meta": m, "score": None}
+        bm25 = dict(lex)
+
         items = []
-        for d, m, dist in zip(docs, mets, dists):
-            sim = 1.0 - float(dist)
-            items.append({"content": d, "meta": m, "score": sim})
-        items.sort(key=lambda x: x["score"], reverse=True)
+        for doc_id, rrf in fused:
+            hit = by_id.get(doc_id)
+            if hit is None:
+                continue
+            items.append({**hit, "score": rrf, "vector_score": hit["score"], "bm25_score": bm25.get(doc_id)})
         return items
@@ -0,0 +1,129 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Dict, List, Tuple, Any
+import json, os, re
+
+from near_dup import parse_equivalents
+
+# act key (the `act` metadata, i.e. the processed file stem) -> names people use for it
+ACT_ALIASES: Dict[str, List[str]] = {
+    "IPC": ["ipc", "indian penal code", "penal code"],
+    "BNS_2023": ["bns", "bharatiya nyaya sanhita"],
+    "CrPC": ["crpc", "cr.p.c.", "cr.p.c", "code of criminal procedure"],
+    "BNSS_2023": ["bnss", "bharatiya nagarik suraksha sanhita"],
+    "CodeofCivilProcedure": ["cpc", "c.p.c.", "code of civil procedure"],
+    "IEA1872": ["iea", "evidence act", "indian evidence act"],
+    "BSA_2023": ["bsa", "bharatiya sakshya adhiniyam"],
+    "Constitution": ["constitution", "coi"],
+    "ContractAct1872": ["contract act", "indian contract act"],
+    "CompaniesAct2013": ["companies act"],
+    "ITAct2000": ["it act", "information technology act"],
+    "ConsumerProtectionAct2019": ["consumer protection act", "cpa"],
+    "RTIAct2005": ["rti act", "rti", "right to information act"],
+    "MotorVehiclesAct1988": ["motor vehicles act", "mv act", "mva"],
+    "Hindu&SpecialMarriageActs": ["special marriage act", "hindu marriage act", "sma", "hma"],
+    "DowryProhibitionAct1961": ["dowry prohibition act", "dowry act"],
+    "DomesticViolenceAct2005": ["domestic violence act", "dv act", "pwdva"],
+    "NarcoticDrugsAct1985": ["ndps act", "ndps", "narcotic drugs act"],
+}
+ARTICLE_ACT = "Constitution"
+
+_ALIAS_TO_ACT = {a: act for act, aliases in ACT_ALIASES.items() for a in aliases}
+_ALIAS_RE = "|".join(re.escape(a) for a in sorted(_ALIAS_TO_ACT, key=len, reverse=True))
+_NUM = r"(\d{1,3}[A-Za-z]{0,3})"
+_SEC = r"(?:section|sec\.?|s\.|§|u/s\.?)"
+
+# "Section 302 of the IPC", "s. 438 CrPC"
+CITE_SEC_OF_ACT = re.compile(rf"\b{_SEC}\s*{_NUM}\s*(?:of\s+)?(?:the\s+)?({_ALIAS_RE})(?![a-z])", re.IGNORECASE)
+# "IPC 302", "IPC section 498A", "CrPC s. 438"
+CITE_ACT_SEC = re.compile(rf"(?<![a-z])({_ALIAS_RE})\s*(?:{_SEC}\s*)?{_NUM}\b", re.IGNORECASE)
+# "Article 21", "Art. 14", "art 21A"
+CITE_ARTICLE = re.compile(rf"\b(?:article|art\.?)\s*{_NUM}\b", re.IGNORECASE)
+
+# Section headings inside statute text: "103. Punishment for murder.—" (strict) or a bare
+# "106. (1) Any police officer ..." (loose; skipped when packed like a table of contents)
+HEADING_STRICT = re.compile(r"(?m)^[ \t]*(?:\d+\[)?(\d{1,3}[A-Z]{0,3})\.\s+[A-Z][^\n]*(?:\n[^\n]*){0,3}?\s?[.:]\s?[—–-]{1,2}")
+HEADING_LOOSE = re.compile(r"(?m)^[ \t]*(?:\d+\[)?(\d{1,3}[A-Z]{0,3})\.\s+(?:\(1\)\s+)?[A-Z]")
+TOC_GAP = 120        # loose headings closer than this are treated as a contents listing
+LATE_HEADING = 0.6   # headings in the last 40% of a chunk also map to the next sub-chunk
+
+
+def _norm(num: str) -> str:
+    return num.upper()
+
+def _key(act: str, num: str) -> str:
+    return f"{act}|{_norm(num)}"
+
+def find_headings(text: str) -> List[Tuple[str, int]]:
+    """(section number, offset) for section headings that start inside this chunk."""
+    found = {m.group(1): m.start() for m in HEADING_STRICT.finditer(text)}
+    loose = list(HEADING_LOOSE.finditer(text))
+    for m, nxt in zip(loose, loose[1:] + [None]):
+        if nxt is not None and nxt.start() - m.start() < TOC_GAP:
+            continue
+        found.setdefault(m.group(1), m.start())
+    return list(found.items())
+
+def parse_citations(query: str) -> List[Tuple[str, str]]:
+    """[(act key, section number)] for every statute citation recognised in the query."""
+    out: List[Tuple[str, str]] = []
+    for m in CITE_SEC_OF_ACT.finditer(query):
+        out.append((_ALIAS_TO_ACT[m.group(2).lower()], _norm(m.group(1))))
+    for m in CITE_ACT_SEC.finditer(query):
+        out.append((_ALIAS_TO_ACT[m.group(1).lower()], _norm(m.group(2))))
+    for m in CITE_ARTICLE.finditer(query):
+        out.append((ARTICLE_ACT, _norm(m.group(1))))
+    return list(dict.fromkeys(out))
+
+
+class SectionIndexBuilder:
+    """Fed every chunk in make_docs() order; maps (act, section) -> chunk ids."""
+    def __init__(self):
+        self.sections: Dict[str, List[str]] = {}
+        self._carry: List[str] = []   # late headings to attach to the next sub-chunk
+
+    def _put(self, key: str, doc_id: str):
+        ids = self.sections.setdefault(key, [])
+        if doc_id not in ids:
+            ids.append(doc_id)
+
+    def add(self, doc_id: str, text: str, meta: Dict[str, Any]):
+        act = meta.get("act", "")
+        if meta.get("sub_index", 0) > 0:
+            for key in self._carry:
+                self._put(key, doc_id)
+        self._carry = []
+        if meta.get("section_number"):
+            self._put(_key(act, meta["section_number"]), doc_id)
+        for _, eq_act, eq_num in parse_equivalents(meta):
+            self._put(_key(eq_act, eq_num), doc_id)  # folded old-act section -> canonical chunk
+        for num, pos in find_headings(text):
+            key = _key(act, num)
+            self._put(key, doc_id)
+            if pos >= LATE_HEADING * len(text):
+                self._carry.append(key)
+
+    def save(self, path: Path) -> int:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"sections": self.sections}, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+        return len(self.sections)
+
+
+class SectionIndex:
+    def __init__(self, sections: Dict[str, List[str]]):
+        self.sections = sections
+
+    @classmethod
+    def load(cls, path: Path) -> "SectionIndex | None":
+        if not path.exists():
+            return None
+        return cls(json.loads(path.read_text(encoding="utf-8")).get("sections", {}))
+
+    def lookup(self, query: str) -> List[str]:
+        """Chunk ids for the sections cited in `query` (empty if none are cited/known)."""
+        ids: List[str] = []
+        for act, num in parse_citations(query):
+            ids.extend(self.sections.get(_key(act, num), []))
+        return list(dict.fromkeys(ids))
@@ -0,0 +1,206 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import List, Dict, Any, Iterable
+import sqlite3, threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    first_ts REAL,
+    last_ts REAL,
+    last_iso TEXT,
+    last_message_id TEXT,
+    PRIMARY KEY (user_id, session_id)
+);
+CREATE INDEX IF NOT EXISTS sessions_by_recency ON sessions (user_id, last_ts DESC);
+CREATE TABLE IF NOT EXISTS messages (
+    message_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    role TEXT,
+    ts REAL NOT NULL,
+    timestamp TEXT,
+    content TEXT,
+    turns INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS messages_by_session ON messages (user_id, session_id, ts DESC);
+CREATE INDEX IF NOT EXISTS messages_by_user ON messages (user_id, ts DESC);
+CREATE TABLE IF NOT EXISTS user_versions (
+    user_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+
+class SessionCatalog:
+    """
+    SQLite side-index of conversation memory, maintained on every save_message:
+    a per-session summary row (count, first/last ts, last message id) and a
+    time-ordered message index. Session lists and reverse-chronological pages
+    are index range scans, independent of how long the user's history is.
+
+    Every removal bumps the user's version, so a process caching a user's
+    vectors can tell when another one (compactor, trim, delete) changed them.
+
+    A compacted session's summary is one row standing for `turns` messages:
+    session counts add up `turns`, and trimming only ever drops raw turns.
+    """
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        cols = {r[1] for r in self.conn.execute("PRAGMA table_info(messages)")}
+        if "turns" not in cols:  # catalogs created before summaries carried their turn count
+            self.conn.execute("ALTER TABLE messages ADD COLUMN turns INTEGER NOT NULL DEFAULT 1")
+        self.conn.commit()
+        self._lock = threading.Lock()
+
+    # ---- write ----
+    def record(self, *, message_id: str, content: str, meta: Dict[str, Any]):
+        self.record_many([(message_id, content, meta)])
+
+    def record_many(self, rows: Iterable[tuple]):
+        with self._lock:
+            for mid, content, m in rows:
+                turns = int(m.get("turns") or 1)
+                cur = self.conn.execute(
+                    "INSERT OR IGNORE INTO messages"
+                    " (message_id, user_id, session_id, role, ts, timestamp, content, turns)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (mid, m["user_id"], m["session_id"], m.get("role"), m["ts"], m.get("timestamp"), content, turns),
+                )
+                if not cur.rowcount:
+                    continue  # already catalogued (replay/backfill)
+                self.conn.execute(
+                    "INSERT INTO sessions (user_id, session_id, count, first_ts, last_ts, last_iso, last_message_id)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (user_id, session_id) DO UPDATE SET"
+                    "  count = count + excluded.count,"
+                    "  first_ts = MIN(first_ts, excluded.first_ts),"
+                    "  last_iso = CASE WHEN excluded.last_ts >= last_ts THEN excluded.last_iso ELSE last_iso END,"
+                    "  last_message_id = CASE WHEN excluded.last_ts >= last_ts THEN excluded.last_message_id ELSE last_message_id END,"
+                    "  last_ts = MAX(last_ts, excluded.last_ts)",
+                    (m["user_id"], m["session_id"], turns, m["ts"], m["ts"], m.get("timestamp"), mid),
+                )
+            self.conn.commit()
+
+    def _bump(self, user_id: str):
+        self.conn.execute(
+            "INSERT INTO user_versions (user_id, version) VALUES (?, 1)"
+            " ON CONFLICT (user_id) DO UPDATE SET version = version + 1",
+            (user_id,),
+        )
+
+    def delete_user(self, user_id: str):
+        with self._lock:
+            self.conn.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+            self.conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+            self._bump(user_id)
+            self.conn.commit()
+
+    def delete_messages(self, user_id: str, message_ids: List[str]):
+        """Remove messages and recompute only the sessions they belonged to."""
+        if not message_ids:
+            return
+        with self._lock:
+            q = ",".join("?" * len(message_ids))
+            sessions = [r[0] for r in self.conn.execute(
+                f"SELECT DISTINCT session_id FROM messages WHERE message_id IN ({q})", message_ids)]
+            self.conn.execute(f"DELETE FROM messages WHERE message_id IN ({q})", message_ids)
+            for sid in sessions:
+                self._refresh_session(user_id, sid)
+            self._bump(user_id)
+            self.conn.commit()
+
+    def _refresh_session(self, user_id: str, session_id: str):
+        row = self.conn.execute(
+            "SELECT SUM(turns), MIN(ts), MAX(ts) FROM messages WHERE user_id = ? AND session_id = ?",
+            (user_id, session_id),
+        ).fetchone()
+        if not row[0]:
+            self.conn.execute("DELETE FROM sessions WHERE user_id = ? AND session_id = ?", (user_id, session_id))
+            return
+        last = self.conn.execute(
+            "SELECT message_id, timestamp FROM messages WHERE user_id = ? AND session_id = ? ORDER BY ts DESC LIMIT 1",
+            (user_id, session_id),
+        ).fetchone()
+        self.conn.execute(
+            "UPDATE sessions SET count = ?, first_ts = ?, last_ts = ?, last_iso = ?, last_message_id = ?"
+            " WHERE user_id = ? AND session_id = ?",
+            (row[0], row[1], row[2], last[1], last[0], user_id, session_id),
+        )
+
+    # ---- read ----
+    def list_sessions(self, user_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT session_id, count, first_ts, last_ts, last_iso, last_message_id FROM sessions"
+                " WHERE user_id = ? ORDER BY last_ts DESC LIMIT ?",
+                (user_id, limit),
+            ).fetchall()
+        return [
+            {"session_id": sid, "last_ts": iso or "", "count": n, "first_ts": first, "last_epoch": last,
+             "last_message_id": last_mid}
+            for sid, n, first, last, iso, last_mid in rows
+        ]
+
+    def recent(self, user_id: str, session_id: str | None = None, limit: int = 50,
+               before_ts: float | None = None) -> List[Dict[str, Any]]:
+        """Newest-first page of messages; pass the last item's meta["ts"] as before_ts for the next page."""
+        sql = "SELECT message_id, session_id, role, ts, timestamp, content FROM messages WHERE user_id = ?"
+        args: list = [user_id]
+        if session_id:
+            sql += " AND session_id = ?"
+            args.append(session_id)
+        if before_ts is not None:
+            sql += " AND ts < ?"
+            args.append(before_ts)
+        sql += " ORDER BY ts DESC LIMIT ?"
+        args.append(limit)
+        with self._lock:
+            rows = self.conn.execute(sql, args).fetchall()
+        return [
+            {"id": mid, "content": content,
+             "meta": {"user_id": user_id, "session_id": sid, "role": role, "timestamp": iso, "ts": ts}}
+            for mid, sid, role, ts, iso, content in rows
+        ]
+
+    def ids_beyond(self, user_id: str, keep_last: int) -> List[str]:
+        """Ids of the user's raw turns (never summaries) older than the newest `keep_last`."""
+        with self._lock:
+            return [r[0] for r in self.conn.execute(
+                "SELECT message_id FROM messages WHERE user_id = ? AND role IS NOT 'summary'"
+                " ORDER BY ts DESC LIMIT -1 OFFSET ?",
+                (user_id, keep_last),
+            )]
+
+    def session_messages(self, user_id: str, session_id: str) -> List[Dict[str, Any]]:
+        """All of a session's messages, oldest first (same shape as `recent`)."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT message_id, role, ts, timestamp, content FROM messages"
+                " WHERE user_id = ? AND session_id = ? ORDER BY ts",
+                (user_id, session_id),
+            ).fetchall()
+        return [
+            {"id": mid, "content": content,
+             "meta": {"user_id": user_id, "session_id": session_id, "role": role, "timestamp": iso, "ts": ts}}
+            for mid, role, ts, iso, content in rows
+        ]
+
+    def users(self) -> List[str]:
+        with self._lock:
+            return [r[0] for r in self.conn.execute("SELECT DISTINCT user_id FROM sessions")]
+
+    def version(self, user_id: str) -> int:
+        with self._lock:
+            row = self.conn.execute("SELECT version FROM user_versions WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def count_user(self, user_id: str) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM messages WHERE user_id = ?", (user_id,)).fetchone()[0]
@@ -0,0 +1,102 @@
+"""
+Worker startup: the RAG engine is built lazily (first request) or, with
+WARM_START, in a background thread while the UI already accepts connections.
+Each stage is timed and the breakdown is logged once the engine is ready;
+`readiness()` backs the /readyz probe.
+"""
+from __future__ import annotations
+from contextlib import contextmanager
+from typing import Dict, Any
+import os, threading, time
+
+from config import VECTOR_DIR, WARM_START, RETRIEVAL_SERVER_URL
+
+_t0 = time.perf_counter()
+_stages: Dict[str, float] = {}
+_engine = None
+_engine_lock = threading.Lock()
+_error: str | None = None
+_warm_thread: threading.Thread | None = None
+
+
+@contextmanager
+def stage(name: str):
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stages[name] = time.perf_counter() - t
+
+def log_breakdown(title: str = "startup") -> None:
+    parts = ", ".join(f"{k} {v:.2f}s" for k, v in _stages.items())
+    print(f"[{title}] ready after {time.perf_counter() - _t0:.2f}s — {parts}")
+
+def _prefetch(path) -> None:
+    # hint the kernel to pull the persisted Chroma files (sqlite + HNSW segments) into the page cache
+    if not hasattr(os, "posix_fadvise"):
+        return
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                fd = os.open(os.path.join(root, f), os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            finally:
+                os.close(fd)
+
+def get_engine():
+    """The process-wide RAGEngine, built on first call (blocks while a warm start is in progress)."""
+    global _engine, _error
+    if _engine is not None:
+        return _engine
+    with _engine_lock:
+        if _engine is None:
+            try:
+                if RETRIEVAL_SERVER_URL is None:  # else the retrieval server owns the index and the model
+                    with stage("prefetch vectorstore"):
+                        _prefetch(VECTOR_DIR)
+                with stage("import pipeline"):
+                    from rag_pipeline import RAGEngine
+                if RETRIEVAL_SERVER_URL is None:
+                    from embeddings import get_embedder
+                    from vector_store import get_client
+                    with stage("chroma client"):
+                        get_client()
+                    with stage("embedding model"):
+                        get_embedder()
+                with stage("engine"):
+                    engine = RAGEngine()
+                with stage("warm HNSW + query path"):
+                    # first query loads the KB HNSW segment and runs one encode end to end
+                    engine.retriever.search("warm up", top_k=1)
+                _engine, _error = engine, None
+            except Exception as e:
+                _error = f"{type(e).__name__}: {e}"
+                raise
+            log_breakdown()
+    return _engine
+
+def _warm():
+    try:
+        get_engine()
+        with stage("gemini client"):
+            _engine.model  # noqa: B018 — import + configure google.generativeai off the request path
+    except Exception as e:
+        print(f"[startup] warm start failed (will retry on first request): {e}")
+
+def start_warm(enabled: bool = WARM_START) -> None:
+    global _warm_thread
+    if enabled and _warm_thread is None:
+        _warm_thread = threading.Thread(target=_warm, name="warm-start", daemon=True)
+        _warm_thread.start()
+
+def readiness() -> Dict[str, Any]:
+    return {
+        "ready": _engine is not None,
+        "warming": _warm_thread is not None and _warm_thread.is_alive(),
+        "uptime_s": round(time.perf_counter() - _t0, 3),
+        "stages_s": {k: round(v, 3) for k, v in _stages.items()},
+        "error": _error,
+    }
@@ -1,22 +1,96 @@
-import json
+import json, sqlite3, threading
 from pathlib import Path
+from typing import Iterable, Iterator
 
 class StateRegistry:
-    def __init__(self, path: Path):
+    """
+    Registry of indexed chunks {chunk_sha: {meta, added_at}} backed by SQLite.
+
+    Membership checks are primary-key lookups, add() upserts only the given key,
+    and save() commits everything staged since the last save in one transaction,
+    so a crash never leaves a half-written registry. An old JSON registry
+    (state/kb_chunks.json) is imported once on first open.
+    """
+    def __init__(self, path: Path, legacy_json: Path | None = None):
         self.path = path
-        self.data = {"chunks": {}}  # {chunk_sha: {source_id, added_at}}
-        if path.exists():
-            try:
-                self.data = json.loads(path.read_text(encoding="utf-8"))
-            except Exception:
-                pass
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._lock = threading.RLock()  # the index builder checkpoints from a writer thread
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (sha TEXT PRIMARY KEY, data TEXT NOT NULL, added_at TEXT)"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS registry_info (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.commit()
+        if legacy_json is not None:
+            self._migrate_json(legacy_json)
+
+    def _migrate_json(self, legacy_json: Path):
+        if not legacy_json.exists() or self.get_info("migrated_from") == str(legacy_json.name):
+            return
+        try:
+            chunks = json.loads(legacy_json.read_text(encoding="utf-8")).get("chunks", {})
+        except Exception:
+            return
+        self.add_many(chunks.items())
+        self.set_info("migrated_from", legacy_json.name)
+        self.save()
+        print(f"Migrated {len(chunks)} registry entries from {legacy_json.name} → {self.path.name}")
 
+    # ---- membership ----
     def has(self, chunk_sha: str) -> bool:
-        return chunk_sha in self.data["chunks"]
+        with self._lock:
+            return self.conn.execute("SELECT 1 FROM chunks WHERE sha = ?", (chunk_sha,)).fetchone() is not None
+
+    __contains__ = has
+
+    def get(self, chunk_sha: str) -> dict | None:
+        with self._lock:
+            row = self.conn.execute("SELECT data FROM chunks WHERE sha = ?", (chunk_sha,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def shas(self) -> Iterator[str]:
+        with self._lock:
+            rows = self.conn.execute("SELECT sha FROM chunks").fetchall()
+        for (sha,) in rows:
+            yield sha
 
+    # ---- staged writes (durable on save) ----
     def add(self, chunk_sha: str, meta: dict):
-        self.data["chunks"][chunk_sha] = meta
+        self.add_many([(chunk_sha, meta)])
+
+    def add_many(self, items: Iterable[tuple]):
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO chunks (sha, data, added_at) VALUES (?, ?, ?)",
+                ((sha, json.dumps(m, ensure_ascii=False), m.get("added_at")) for sha, m in items),
+            )
+
+    def remove_many(self, shas: Iterable[str]):
+        with self._lock:
+            self.conn.executemany("DELETE FROM chunks WHERE sha = ?", ((s,) for s in shas))
+
+    def get_info(self, key: str) -> str | None:
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM registry_info WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_info(self, key: str, value: str):
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO registry_info (key, value) VALUES (?, ?)", (key, value))
 
     def save(self):
-        self.path.parent.mkdir(parents=True, exist_ok=True)
-        self.path.write_text(json.dumps(self.data, ensure_ascii=False, indent=2), encoding="utf-8")
+        with self._lock:
+            self.conn.commit()
+
+    def rollback(self):
+        with self._lock:
+            self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
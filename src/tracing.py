@@ -0,0 +1,317 @@
+"""
+Request-level tracing for the RAG stages.
+
+    with trace("answer", user_id=...):          # one per request (root)
+        with span("kb.search") as sp:            # any stage, any depth
+            ...
+            sp.set(candidates=len(items))
+
+Every finished span feeds Prometheus-style histograms (`rag_stage_seconds`
+per stage, plus `rag_candidates`, `rag_prompt_tokens` and the answer-cache
+counter from well-known attributes). Components that keep their own running
+stats (embedding batcher, answer cache) register an `add_collector` callback,
+read at scrape time whether tracing is on or not. Spans opened inside a trace
+are also collected into it, and the trace is appended to TRACE_LOG as one
+JSON line.
+With TRACING_ENABLED off, `trace`/`span` return a shared no-op object and
+`annotate` returns immediately.
+"""
+from __future__ import annotations
+from contextvars import ContextVar
+from typing import Dict, Any, List, Tuple, Callable
+import bisect, json, threading, time, uuid
+
+from config import TRACING_ENABLED, TRACE_LOG, METRICS_HOST, METRICS_PORT
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000)
+
+_enabled = TRACING_ENABLED
+_trace_var: ContextVar["_Trace | None"] = ContextVar("rag_trace", default=None)
+_span_var: ContextVar["_Span | None"] = ContextVar("rag_span", default=None)
+
+
+def enable(on: bool = True) -> None:
+    global _enabled
+    _enabled = on
+
+def enabled() -> bool:
+    return _enabled
+
+
+# ---- metrics ----
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, v)] += 1
+        self.sum += v
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Bucket upper bound containing the q-quantile (coarse, for logs/benchmarks)."""
+        if not self.count:
+            return 0.0
+        need, acc = q * self.count, 0
+        for bound, c in zip(self.buckets + (float("inf"),), self.counts):
+            acc += c
+            if acc >= need:
+                return bound
+        return float("inf")
+
+
+_metrics_lock = threading.Lock()
+_histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Histogram] = {}
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+_HELP = {
+    "rag_stage_seconds": ("histogram", "Duration of each RAG stage"),
+    "rag_candidates": ("histogram", "Candidates handled by a stage"),
+    "rag_prompt_tokens": ("histogram", "Estimated prompt tokens sent to the LLM"),
+    "rag_answer_cache_total": ("counter", "Answer cache lookups by result"),
+    "rag_embed_batches_total": ("counter", "Micro-batches encoded by the embedding batcher"),
+    "rag_embed_items_total": ("counter", "Texts encoded through the embedding batcher"),
+    "rag_embed_batch_size_avg": ("gauge", "Mean texts per embedding micro-batch"),
+    "rag_embed_batch_size_max": ("gauge", "Largest embedding micro-batch so far"),
+    "rag_embed_queue_depth": ("gauge", "Texts waiting for the embedding batcher"),
+    "rag_answer_cache_entries": ("gauge", "Answers held in the semantic cache"),
+    "rag_answer_cache_hit_ratio": ("gauge", "Answer cache hits / lookups since start"),
+    "rag_answer_cache_saved_seconds_total": ("counter", "LLM generation time saved by cache hits"),
+}
+# name -> fn() returning [(metric, labels, value)]; re-registering a name replaces it
+_collectors: Dict[str, Callable[[], List[Tuple[str, Dict[str, str], float]]]] = {}
+
+def add_collector(name: str, fn: Callable[[], List[Tuple[str, Dict[str, str], float]]]) -> None:
+    """Values computed at scrape time (gauges/counters kept by a component itself)."""
+    with _metrics_lock:
+        _collectors[name] = fn
+
+def _observe(metric: str, labels: Dict[str, str], value: float, buckets) -> None:
+    key = (metric, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = Histogram(buckets)
+        h.observe(value)
+
+def _inc(metric: str, labels: Dict[str, str], by: float = 1.0) -> None:
+    key = (metric, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0.0) + by
+
+def _record(name: str, seconds: float, attrs: Dict[str, Any]) -> None:
+    _observe("rag_stage_seconds", {"stage": name}, seconds, SECONDS_BUCKETS)
+    if isinstance(attrs.get("candidates"), (int, float)):
+        _observe("rag_candidates", {"stage": name}, attrs["candidates"], COUNT_BUCKETS)
+    if isinstance(attrs.get("prompt_tokens"), (int, float)):
+        _observe("rag_prompt_tokens", {}, attrs["prompt_tokens"], COUNT_BUCKETS)
+    if "cache_hit" in attrs:
+        _inc("rag_answer_cache_total", {"result": "hit" if attrs["cache_hit"] else "miss"})
+
+def stage_histograms() -> Dict[str, Histogram]:
+    with _metrics_lock:
+        return {dict(k[1])["stage"]: h for k, h in _histograms.items() if k[0] == "rag_stage_seconds"}
+
+def reset_metrics() -> None:
+    with _metrics_lock:
+        _histograms.clear()
+        _counters.clear()
+
+def _fmt_labels(labels, le: str | None = None) -> str:
+    parts = [f'{k}="{v}"' for k, v in labels] + ([f'le="{le}"'] if le is not None else [])
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def render_metrics() -> str:
+    """Prometheus text exposition format."""
+    lines: List[str] = []
+    with _metrics_lock:
+        hist = sorted(_histograms.items())
+        ctrs = sorted(_counters.items())
+        collectors = list(_collectors.values())
+    seen = set()
+    for (metric, labels), h in hist:
+        if metric not in seen:
+            seen.add(metric)
+            lines += [f"# HELP {metric} {_HELP[metric][1]}", f"# TYPE {metric} histogram"]
+        acc = 0
+        for bound, c in zip(h.buckets, h.counts):
+            acc += c
+            lines.append(f"{metric}_bucket{_fmt_labels(labels, str(bound))} {acc}")
+        lines.append(f"{metric}_bucket{_fmt_labels(labels, '+Inf')} {h.count}")
+        lines.append(f"{metric}_sum{_fmt_labels(labels)} {h.sum}")
+        lines.append(f"{metric}_count{_fmt_labels(labels)} {h.count}")
+    for (metric, labels), v in ctrs:
+        if metric not in seen:
+            seen.add(metric)
+            lines += [f"# HELP {metric} {_HELP[metric][1]}", f"# TYPE {metric} counter"]
+        lines.append(f"{metric}{_fmt_labels(labels)} {v}")
+    for fn in collectors:
+        for metric, labels, v in fn():
+            if metric not in seen:
+                seen.add(metric)
+                kind, help_ = _HELP[metric]
+                lines += [f"# HELP {metric} {help_}", f"# TYPE {metric} {kind}"]
+            lines.append(f"{metric}{_fmt_labels(sorted(labels.items()))} {v}")
+    return "\n".join(lines) + "\n"
+
+
+# ---- spans / traces ----
+class _Noop:
+    __slots__ = ()
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+    def set(self, **attrs): pass
+    def start(self): return self
+    def finish(self, error: str | None = None): pass
+
+_NOOP = _Noop()
+
+
+class _Span:
+    __slots__ = ("name", "attrs", "t0", "_token")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        self._token = _span_var.set(self)
+        return self
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def __exit__(self, exc_type, exc, tb):
+        dt = time.perf_counter() - self.t0
+        try:
+            _span_var.reset(self._token)
+        except ValueError:  # exited from another context (e.g. an async generator closed elsewhere)
+            _span_var.set(None)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        _record(self.name, dt, self.attrs)
+        tr = _trace_var.get()
+        if tr is not None:
+            tr.add(self.name, self.t0, dt, self.attrs)
+        return False
+
+
+class _Trace:
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()  # spans may finish on worker threads (asyncio.to_thread)
+
+    def add(self, name: str, t0: float, dt: float, attrs: Dict[str, Any]) -> None:
+        with self._lock:
+            self.spans.append({"name": name, "start_ms": round((t0 - self.t0) * 1000, 3),
+                               "ms": round(dt * 1000, 3), **attrs})
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def start(self):
+        self.t0 = time.perf_counter()
+        self.wall = time.time()
+        _trace_var.set(self)
+        return self
+
+    def finish(self, error: str | None = None) -> None:
+        dt = time.perf_counter() - self.t0
+        if _trace_var.get() is self:
+            _trace_var.set(None)
+        if error:
+            self.attrs["error"] = error
+        _record(self.name, dt, self.attrs)
+        if TRACE_LOG is None and not _sinks:
+            return
+        rec = {"trace_id": self.trace_id, "name": self.name, "ts": self.wall, "total_ms": round(dt * 1000, 3),
+               **self.attrs, "spans": sorted(self.spans, key=lambda s: s["start_ms"])}
+        if TRACE_LOG is not None:
+            _write_trace(rec)
+        for fn in list(_sinks):
+            fn(rec)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish(exc_type.__name__ if exc_type else None)
+        return False
+
+
+_log_lock = threading.Lock()
+_sinks: List[Callable[[Dict[str, Any]], None]] = []
+
+def add_sink(fn: Callable[[Dict[str, Any]], None]) -> None:
+    """Also hand every finished trace record to `fn` (e.g. the benchmark collecting raw timings)."""
+    _sinks.append(fn)
+
+def remove_sink(fn: Callable[[Dict[str, Any]], None]) -> None:
+    if fn in _sinks:
+        _sinks.remove(fn)
+
+def _write_trace(rec: Dict[str, Any]) -> None:
+    line = json.dumps(rec, ensure_ascii=False, default=str)
+    with _log_lock:
+        TRACE_LOG.parent.mkdir(parents=True, exist_ok=True)
+        with TRACE_LOG.open("a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def span(name: str, **attrs):
+    """Time one stage; nests under the current trace when there is one."""
+    return _Span(name, attrs) if _enabled else _NOOP
+
+def trace(name: str, **attrs):
+    """Root of a request. Use as a context manager, or start()/finish() across an async generator."""
+    return _Trace(name, attrs) if _enabled else _NOOP
+
+def record(name: str, seconds: float, **attrs) -> None:
+    """Report a stage timed by hand (e.g. one that spans yields of an async generator)."""
+    if _enabled:
+        _record(name, seconds, attrs)
+        tr = _trace_var.get()
+        if tr is not None:
+            tr.add(name, time.perf_counter() - seconds, seconds, attrs)
+
+def annotate(**attrs) -> None:
+    """Attach attributes to the innermost open span (no-op when tracing is off)."""
+    if _enabled:
+        sp = _span_var.get()
+        if sp is not None:
+            sp.attrs.update(attrs)
+
+
+# ---- standalone exporter (processes without the web app) ----
+_server = None
+
+def serve_metrics(port: int | None = METRICS_PORT, host: str = METRICS_HOST) -> None:
+    """Expose /metrics on `host:port` from a daemon thread (no-op if port is None or already serving)."""
+    global _server
+    if port is None or _server is not None:
+        return
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render_metrics().encode("utf-8")
+            self.send_response(200 if self.path.startswith("/metrics") else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    _server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
@@ -0,0 +1,90 @@
+"""
+Check an embedding backend against the fp32 vectors already in the KB collection
+before switching EMB_BACKEND:
+
+    python src/validate_embedder.py --backend onnx-int8 --samples 300 --k 10
+
+Queries are taken from sampled chunks (their first words). For each query the
+reference top-k comes from the torch encoder, the candidate top-k from the chosen
+backend, both searched against the existing index. Reports recall@k overlap,
+document-vector cosine to the stored vectors, and encode throughput.
+"""
+from __future__ import annotations
+import argparse, json, random, time
+
+import numpy as np
+
+from config import KB_COLLECTION, EMB_MODEL
+from embeddings import load_encoder
+from vector_store import get_client
+
+
+def _query_from(text: str, words: int) -> str:
+    return " ".join(text.split()[:words])
+
+def _timed_encode(encoder, texts, batch_size: int):
+    t0 = time.perf_counter()
+    vecs = np.asarray(encoder.encode(texts, batch_size=batch_size), dtype=np.float32)
+    return vecs, time.perf_counter() - t0
+
+def _unit(v: np.ndarray) -> np.ndarray:
+    return v / np.clip(np.linalg.norm(v, axis=1, keepdims=True), 1e-12, None)
+
+def validate(backend: str, samples: int = 300, k: int = 10, words: int = 16, seed: int = 0,
+             batch_size: int = 32) -> dict:
+    client = get_client()
+    kb = client.get_collection(KB_COLLECTION)
+    all_ids = kb.get(include=[])["ids"]
+    if not all_ids:
+        raise SystemExit(f"'{KB_COLLECTION}' is empty — build the index first.")
+    picked = random.Random(seed).sample(all_ids, min(samples, len(all_ids)))
+    res = kb.get(ids=picked, include=["documents", "embeddings"])
+    rows = list(zip(res["ids"], res["documents"], res["embeddings"]))
+    docs = [d for _, d, _ in rows]
+    stored = _unit(np.asarray([e for _, _, e in rows], dtype=np.float32))
+    queries = [_query_from(d, words) for d in docs]
+
+    ref = load_encoder(EMB_MODEL, "torch")
+    cand = load_encoder(EMB_MODEL, backend)
+    ref_q, ref_q_s = _timed_encode(ref, queries, batch_size)
+    cand_q, cand_q_s = _timed_encode(cand, queries, batch_size)
+    cand_d, cand_d_s = _timed_encode(cand, docs, batch_size)
+
+    def topk(vecs):
+        res = kb.query(query_embeddings=[v.tolist() for v in vecs], n_results=k, include=[])
+        return [set(ids) for ids in res["ids"]]
+
+    ref_top, cand_top = topk(ref_q), topk(cand_q)
+    overlap = [len(a & b) / max(1, len(a)) for a, b in zip(ref_top, cand_top)]
+    self_hit = [rid in c for (rid, _, _), c in zip(rows, cand_top)]
+    doc_cos = np.sum(_unit(cand_d) * stored, axis=1)
+    q_cos = np.sum(_unit(cand_q) * _unit(ref_q), axis=1)
+
+    return {
+        "backend": backend,
+        "samples": len(rows),
+        "k": k,
+        f"recall@{k}_vs_fp32": float(np.mean(overlap)),
+        f"recall@{k}_min": float(np.min(overlap)),
+        f"source_chunk_hit@{k}": float(np.mean(self_hit)),
+        "query_cosine_mean": float(q_cos.mean()),
+        "doc_cosine_to_index_mean": float(doc_cos.mean()),
+        "doc_cosine_to_index_min": float(doc_cos.min()),
+        "fp32_queries_per_s": len(queries) / ref_q_s,
+        "candidate_queries_per_s": len(queries) / cand_q_s,
+        "candidate_docs_per_s": len(docs) / cand_d_s,
+        "speedup": ref_q_s / cand_q_s if cand_q_s else 0.0,
+    }
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--backend", default="onnx-int8", choices=["torch", "onnx", "onnx-int8"])
+    ap.add_argument("--samples", type=int, default=300)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--words", type=int, default=16, help="words per synthetic query")
+    ap.add_argument("--batch-size", type=int, default=32)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    report = validate(args.backend, samples=args.samples, k=args.k, words=args.words, seed=args.seed,
+                      batch_size=args.batch_size)
+    print(json.dumps(report, indent=2))
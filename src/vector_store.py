@@ -0,0 +1,45 @@
+from __future__ import annotations
+import threading
+
+from config import VECTOR_DIR
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """
+    One chromadb.PersistentClient per process for `vectorstore/`, shared by the
+    retriever, the memory store and the maintenance scripts. chromadb is
+    imported on first use so importing this module stays cheap.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import chromadb
+                _client = chromadb.PersistentClient(path=str(VECTOR_DIR))
+    return _client
+
+def finish_swap(client, name: str) -> bool:
+    """
+    Complete a collection swap (reconcile.compact) interrupted between dropping
+    `name` and renaming the verified copy `<name>__compact` to it: if `name` is
+    gone or empty while the copy exists, the copy takes over the name. Returns
+    True if it did. With `name` still holding rows the copy is unfinished and
+    is left for compact() to discard.
+    """
+    try:
+        tmp = client.get_collection(f"{name}__compact")
+    except Exception:
+        return False
+    try:
+        cur = client.get_collection(name)
+    except Exception:
+        cur = None
+    if cur is not None:
+        if cur.count():
+            return False
+        client.delete_collection(name)  # recreated empty by a get_or_create after the crash
+    tmp.modify(name=name)
+    print(f"✓ Finished an interrupted compaction of '{name}' ({tmp.count()} rows)")
+    return True
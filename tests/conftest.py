@@ -0,0 +1,4 @@
+import pathlib, sys
+
+# modules in src/ import each other flat (`from config import ...`), as when run from there
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
@@ -0,0 +1,73 @@
+import numpy as np
+
+import answer_cache
+from answer_cache import AnswerCache, grounding_key
+
+KB = [{"id": "sha:b"}, {"id": "sha:a"}]
+
+
+def test_grounding_key_without_memory_is_shared():
+    assert grounding_key(KB, []) == grounding_key(list(reversed(KB)), [])
+
+
+def test_grounding_key_with_packed_memory():
+    with_mem = grounding_key(KB, ["m1", "m2"])
+    assert with_mem != grounding_key(KB, [])
+    assert with_mem == grounding_key(KB, ["m2", "m1"])
+    assert with_mem != grounding_key(KB, ["m1"])
+    assert grounding_key(KB, []) != grounding_key([{"id": "sha:c"}], [])
+
+
+def _vec(*xs):
+    return np.asarray(xs, dtype=np.float32)
+
+
+def test_threshold(tmp_path):
+    cache = AnswerCache(tmp_path / "a.sqlite3", threshold=0.9, ttl_hours=1, max_entries=10)
+    g = grounding_key(KB, [])
+    cache.put(_vec(1, 0), g, "q", "answer", 2.0)
+    hit = cache.lookup(_vec(1, 0.1), g)                       # cos ~ 0.995
+    assert hit and hit["answer"] == "answer" and hit["saved_s"] == 2.0
+    assert cache.lookup(_vec(1, 1), g) is None                # cos ~ 0.71
+    assert cache.lookup(_vec(1, 0), grounding_key(KB, ["m1"])) is None
+    st = cache.stats()
+    assert (st["hits"], st["misses"], st["saved_latency_s"]) == (1, 2, 2.0)
+
+
+def test_ttl_expiry(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "time", lambda: now[0])
+    cache = AnswerCache(tmp_path / "a.sqlite3", threshold=0.9, ttl_hours=1, max_entries=10)
+    cache.put(_vec(1, 0), "g", "q", "answer", 1.0)
+    now[0] += 3599
+    assert cache.lookup(_vec(1, 0), "g")
+    now[0] += 2
+    assert cache.lookup(_vec(1, 0), "g") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_lru_eviction_and_persistence(tmp_path):
+    path = tmp_path / "a.sqlite3"
+    cache = AnswerCache(path, threshold=0.9, ttl_hours=1, max_entries=2)
+    cache.put(_vec(1, 0), "g1", "q1", "a1", 1.0)
+    cache.put(_vec(1, 0), "g2", "q2", "a2", 1.0)
+    assert cache.lookup(_vec(1, 0), "g1")                     # g1 is now the most recently used
+    cache.put(_vec(1, 0), "g3", "q3", "a3", 1.0)
+    assert cache.lookup(_vec(1, 0), "g2") is None
+    assert cache.lookup(_vec(1, 0), "g1")["answer"] == "a1"
+
+    reopened = AnswerCache(path, threshold=0.9, ttl_hours=1, max_entries=2)
+    assert reopened.lookup(_vec(1, 0), "g3")["answer"] == "a3"
+    assert reopened.lookup(_vec(1, 0), "g2") is None
+
+
+def test_stats_reach_metrics(tmp_path):
+    import tracing
+    cache = AnswerCache(tmp_path / "a.sqlite3", threshold=0.9, ttl_hours=1, max_entries=10)
+    cache.put(_vec(1, 0), "g", "q", "answer", 1.5)
+    cache.lookup(_vec(1, 0), "g")
+    cache.lookup(_vec(0, 1), "g")
+    text = tracing.render_metrics()
+    assert "rag_answer_cache_entries 1" in text
+    assert "rag_answer_cache_hit_ratio 0.5" in text
+    assert "rag_answer_cache_saved_seconds_total 1.5" in text
@@ -0,0 +1,43 @@
+from context_builder import _merge_adjacent
+
+SHARED = "the offence shall be punishable with imprisonment for a term of seven years"  # > MIN_MERGE_OVERLAP
+
+
+def _kb(content, sub_index, rank, **meta):
+    base = {"act": "IPC", "section_number": "302", "source_file": "ipc.pdf", "sub_index": sub_index}
+    return {"type": "kb", "content": content, "meta": {**base, **meta}, "relevance": 1.0 - rank / 10, "rank": rank}
+
+
+def test_structure_parts_of_one_record_are_joined():
+    out = _merge_adjacent([
+        _kb("(2) second clause", 1, 0, record="r1", chunker="structure"),
+        _kb("(1) first clause", 0, 3, record="r1", chunker="structure"),
+    ])
+    assert len(out) == 1
+    assert out[0]["content"] == "(1) first clause\n(2) second clause"
+    assert out[0]["rank"] == 0 and out[0]["meta"]["sub_index_end"] == 1
+
+
+def test_structure_parts_without_record_stay_apart():
+    # same (act, section, file) can be two different records: sub_index alone proves nothing
+    out = _merge_adjacent([
+        _kb("(1) first clause", 0, 0, chunker="structure"),
+        _kb("(2) second clause", 1, 1, chunker="structure"),
+    ])
+    assert [b["content"] for b in out] == ["(1) first clause", "(2) second clause"]
+
+
+def test_records_are_grouped_apart_even_with_the_same_section():
+    out = _merge_adjacent([
+        _kb("A " + SHARED, 0, 0, record="r1"),
+        _kb(SHARED + " B", 1, 1, record="r2"),
+    ])
+    assert len(out) == 2
+
+
+def test_fallback_sliding_parts_merge_only_on_overlap():
+    merged = _merge_adjacent([_kb("A " + SHARED, 0, 0), _kb(SHARED + " B", 1, 1)])
+    assert [b["content"] for b in merged] == ["A " + SHARED + " B"]
+
+    apart = _merge_adjacent([_kb("A " + SHARED, 0, 0), _kb("unrelated window text B", 1, 1)])
+    assert len(apart) == 2
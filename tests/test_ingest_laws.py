@@ -0,0 +1,49 @@
+"""The parallel ingest path must write exactly what `--serial` writes."""
+import pathlib, random, sys
+
+import pytest
+
+SRC = pathlib.Path(__file__).resolve().parents[1] / "src"
+sys.path.insert(0, str(SRC))
+pytest.importorskip("pypdf")
+pytest.importorskip("requests")
+pytest.importorskip("tqdm")
+
+from ingest_laws import (  # noqa: E402
+    clean_pages, clean_stream, clean_text, extract_shard, iter_sections, page_texts, pdf_to_text, split_sections,
+)
+
+RAW = SRC.parent / "data" / "raw"
+ATOMS = ["Section", "Article", "section", " ", "\t", "\n", "\n", "\n", "1", "23", "/", " / ", "12 / 340",
+         "A", "foo.", "_", "-", "\x00", "\xa0", "5A", "Section 12 Title\n", "\nArticle\n\n3"]
+
+
+def serial(pages):
+    return split_sections(clean_text("\n".join(pages)))
+
+
+def test_page_boundaries_match_serial():
+    rng = random.Random(7)
+    for _ in range(20000):
+        pages = ["".join(rng.choice(ATOMS) for _ in range(rng.randint(0, 12))) for _ in range(rng.randint(0, 6))]
+        assert "".join(clean_stream(pages)) == clean_text("\n".join(pages)), pages
+        assert list(iter_sections(clean_stream(pages))) == serial(pages), pages
+
+
+def test_heading_split_across_pieces():
+    text = "preamble\nSection\n12 Title\nbody one\nSection 13-A\nbody two"
+    for i in range(len(text) + 1):
+        assert list(iter_sections([text[:i], text[i:]])) == split_sections(text), i
+
+
+@pytest.mark.parametrize("name", ["DowryProhibitionAct1961.pdf"])
+def test_pdf_matches_serial(name):
+    pdf = RAW / name
+    if not pdf.exists():
+        pytest.skip(f"{pdf} not downloaded")
+    expected = split_sections(clean_text(pdf_to_text(pdf)))
+    assert list(iter_sections(clean_pages(pdf))) == expected
+
+    n = len(list(page_texts(pdf)))
+    shards = [t for a in range(0, n, 2) for t in extract_shard(pdf, a, min(a + 2, n))]
+    assert list(iter_sections(clean_stream(shards))) == expected
@@ -0,0 +1,73 @@
+import json
+import os
+import subprocess
+import sys
+
+from memory_writer import MemoryWriter
+
+
+class FakeCollection:
+    def __init__(self):
+        self.rows = {}
+
+    def upsert(self, ids, documents, embeddings, metadatas):
+        self.rows.update(zip(ids, documents))
+
+
+class FakeEmbedder:
+    def embed_many(self, texts):
+        return [[0.0, 0.0] for _ in texts]
+
+
+def _journal(path, *ids):
+    path.write_text("".join(
+        json.dumps({"id": i, "document": f"doc {i}", "metadata": {"user_id": "u"}}) + "\n" for i in ids
+    ) + '{"id": "torn', encoding="utf-8")
+
+
+def _dead_pid():
+    p = subprocess.Popen([sys.executable, "-c", "pass"])
+    p.wait()
+    return p.pid
+
+
+def _writer(base, col):
+    return MemoryWriter(lambda user_id: col, FakeEmbedder(), base, flush_every=1000, flush_ms=60_000)
+
+
+def test_replays_legacy_journal(tmp_path):
+    base = tmp_path / "memory_journal.jsonl"
+    _journal(base, "a", "b")
+    col = FakeCollection()
+    w = _writer(base, col)
+    try:
+        assert col.rows == {"a": "doc a", "b": "doc b"}  # the torn last line is skipped
+        assert not base.exists()
+    finally:
+        w.close()
+
+
+def test_adopts_dead_process_journal_only(tmp_path):
+    base = tmp_path / "memory_journal.jsonl"
+    dead = tmp_path / f"memory_journal.{_dead_pid()}.jsonl"
+    live = tmp_path / f"memory_journal.{os.getppid()}.jsonl"
+    _journal(dead, "d")
+    _journal(live, "l")
+    col = FakeCollection()
+    w = _writer(base, col)
+    try:
+        assert set(col.rows) == {"d"}
+        assert not dead.exists()
+        assert live.exists()  # another running process is still appending to it
+    finally:
+        w.close()
+
+
+def test_close_flushes_and_removes_own_journal(tmp_path):
+    col = FakeCollection()
+    w = _writer(tmp_path / "memory_journal.jsonl", col)
+    w.enqueue(mid="m1", document="hello", metadata={"user_id": "u"})
+    assert w.pending_for("u") and w.journal_path.exists()
+    w.close()
+    assert col.rows == {"m1": "hello"}
+    assert not w.journal_path.exists()
@@ -0,0 +1,25 @@
+from near_dup import find_equivalents, shingles
+
+MURDER = ("Whoever commits murder shall be punished with death or imprisonment for life, and shall also "
+          "be liable to fine, as provided in section {} of this Code, save where the court otherwise directs")
+THEFT = ("Whoever, intending to take dishonestly any movable property out of the possession of any person "
+         "without that person's consent, moves that property in order to such taking, is said to commit theft")
+DOWRY = ("If any person, after the commencement of this Act, gives or takes or abets the giving or taking "
+         "of dowry, he shall be punishable with imprisonment for a term which shall not be less than five years")
+
+
+def test_renumbered_section_is_found():
+    old = {"302": shingles(MURDER.format(300)), "498A": shingles(DOWRY)}
+    new = {"103": shingles(MURDER.format(101)), "303": shingles(THEFT)}
+    out = find_equivalents(old, new)
+    assert set(out) == {"302"}  # digits are dropped, so the cross-reference renumbering still matches
+    assert out["302"][0] == "103" and out["302"][1] == 1.0
+
+
+def test_edited_section_respects_threshold():
+    edited = MURDER.format(101).replace("save where the court otherwise directs", "unless the court directs")
+    old, new = {"302": shingles(MURDER.format(300))}, {"103": shingles(edited)}
+    score = find_equivalents(old, new, threshold=0.0)["302"][1]
+    assert 0.5 < score < 1.0
+    assert find_equivalents(old, new, threshold=score) == {"302": ("103", score)}
+    assert find_equivalents(old, new, threshold=min(1.0, score + 0.01)) == {}
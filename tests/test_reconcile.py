@@ -0,0 +1,61 @@
+import chromadb
+import pytest
+
+from reconcile import diff, delete_orphans
+from state_registry import StateRegistry
+from build_or_update_index import doc_id_for
+from vector_store import finish_swap
+
+SHA = {k: k * 64 for k in "abcd"}  # fake chunk hashes
+
+
+@pytest.fixture
+def client(tmp_path):
+    return chromadb.PersistentClient(path=str(tmp_path / "chroma"))
+
+
+def _add(col, keys, act="IPC"):
+    col.add(ids=[doc_id_for(SHA[k]) for k in keys], documents=list(keys), embeddings=[[1.0, 0.0]] * len(keys),
+            metadatas=[{"act": act}] * len(keys))
+
+
+def test_diff_finds_orphans_without_changing_anything(client, tmp_path):
+    col = client.create_collection("kb_test")
+    _add(col, "ab")
+    _add(col, "c", act="BNS_2023")
+    state = StateRegistry(tmp_path / "state.sqlite3")
+    state.add_many([(SHA[k], {"added_at": "t"}) for k in "abc"])
+    state.save()
+    live = {doc_id_for(SHA[k]): {} for k in "ad"}  # b, c gone from the sources; d not indexed yet
+
+    d = diff(col, state, live)
+    assert d["orphan_ids"] == sorted(doc_id_for(SHA[k]) for k in "bc")
+    assert sorted(d["orphan_shas"]) == [SHA["b"], SHA["c"]]
+    assert d["orphans_by_act"] == {"IPC": 1, "BNS_2023": 1}
+    assert (d["live"], d["in_collection"], d["in_registry"], d["missing"]) == (2, 3, 3, 1)
+    assert col.count() == 3 and len(state) == 3  # dry run
+
+    assert delete_orphans(col, state, d) == 2
+    assert col.get()["ids"] == [doc_id_for(SHA["a"])]
+    assert list(state.shas()) == [SHA["a"]]
+
+
+def test_finish_swap_resumes_after_drop(client):
+    _add(client.create_collection("kb_test__compact"), "ab")
+    assert finish_swap(client, "kb_test")
+    assert client.get_collection("kb_test").count() == 2
+    assert not finish_swap(client, "kb_test")  # nothing left to finish
+
+
+def test_finish_swap_replaces_recreated_empty_collection(client):
+    client.create_collection("kb_test")
+    _add(client.create_collection("kb_test__compact"), "a")
+    assert finish_swap(client, "kb_test")
+    assert client.get_collection("kb_test").count() == 1
+
+
+def test_finish_swap_leaves_unfinished_copy(client):
+    _add(client.create_collection("kb_test"), "abc")
+    _add(client.create_collection("kb_test__compact"), "a")
+    assert not finish_swap(client, "kb_test")
+    assert client.get_collection("kb_test").count() == 3
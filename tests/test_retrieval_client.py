@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from retrieval_client import RETRY_SAFE, RpcClient
+
+
+class FakeResponse:
+    status = 200
+
+    def read(self):
+        return json.dumps({"result": "ok"}).encode("utf-8")
+
+
+class FakeConn:
+    """Drops the first `fail` requests like a keep-alive connection the server already closed."""
+    def __init__(self, fail):
+        self.fail = fail
+        self.requests = []
+
+    def request(self, verb, path, body, headers):
+        self.requests.append(path)
+        if len(self.requests) <= self.fail:
+            raise ConnectionResetError("closed by peer")
+
+    def getresponse(self):
+        return FakeResponse()
+
+
+@pytest.fixture
+def rpc(monkeypatch):
+    client = RpcClient("http://127.0.0.1:1")
+    conn = FakeConn(fail=1)
+    client.fresh = []
+
+    def _conn(fresh=False):
+        client.fresh.append(fresh)
+        return conn
+
+    monkeypatch.setattr(client, "_conn", _conn)
+    client.fake = conn
+    return client
+
+
+def test_safe_method_retries_once_on_new_connection(rpc):
+    assert "kb.search" in RETRY_SAFE
+    assert rpc.call("kb.search", query="bail") == "ok"
+    assert rpc.fake.requests == ["/kb.search", "/kb.search"]
+    assert rpc.fresh == [False, True]
+
+
+def test_unsafe_method_is_never_resent(rpc):
+    assert "memory.delete_user" not in RETRY_SAFE
+    with pytest.raises(ConnectionResetError):
+        rpc.call("memory.delete_user", user_id="u")
+    assert rpc.fake.requests == ["/memory.delete_user"]
+    assert rpc.fresh == [True]  # always a fresh connection instead
+
+
+def test_safe_method_gives_up_after_one_retry(rpc):
+    rpc.fake.fail = 2
+    with pytest.raises(ConnectionResetError):
+        rpc.call("embed", texts=["x"])
+    assert len(rpc.fake.requests) == 2
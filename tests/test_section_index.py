@@ -0,0 +1,31 @@
+import pytest
+
+from section_index import parse_citations
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("What is Section 302 of the IPC?", [("IPC", "302")]),
+    ("bail under s. 438 CrPC", [("CrPC", "438")]),
+    ("IPC 498a cruelty", [("IPC", "498A")]),
+    ("BNS section 103 and IPC 302", [("BNS_2023", "103"), ("IPC", "302")]),
+    ("u/s 125 crpc maintenance", [("CrPC", "125")]),
+    ("Article 21 right to life", [("Constitution", "21")]),
+    ("Art. 14 equality", [("Constitution", "14")]),
+    ("art 21 privacy", [("Constitution", "21")]),
+    ("Art 21A education", [("Constitution", "21A")]),
+])
+def test_parse_citations(query, expected):
+    assert parse_citations(query) == expected
+
+
+@pytest.mark.parametrize("query", [
+    "what is the punishment for murder",
+    "my landlord kept 3 months deposit",   # bare numbers aren't citations
+    "the party started at 21",             # "art" inside a word
+])
+def test_no_citation(query):
+    assert parse_citations(query) == []
+
+
+def test_duplicates_collapse():
+    assert parse_citations("Section 302 of IPC, i.e. IPC 302") == [("IPC", "302")]
@@ -0,0 +1,48 @@
+import sqlite3
+
+from session_catalog import SessionCatalog
+
+
+def _meta(session_id, ts, role="user", **extra):
+    return {"user_id": "u", "session_id": session_id, "role": role, "ts": ts, "timestamp": str(ts), **extra}
+
+
+def _compact(cat, session_id, ids, ts, turns):
+    cat.delete_messages("u", ids)
+    cat.record(message_id=f"summary:{session_id}", content="earlier",
+               meta=_meta(session_id, ts, role="summary", turns=turns))
+
+
+def test_summary_counts_its_turns(tmp_path):
+    cat = SessionCatalog(tmp_path / "c.sqlite3")
+    cat.record_many([(f"m{i}", "hi", _meta("s1", float(i))) for i in range(4)])
+    _compact(cat, "s1", ["m0", "m1", "m2"], 2.0, turns=3)
+    assert cat.list_sessions("u")[0]["count"] == 4  # summary of 3 + the one raw turn left
+
+    cat.record(message_id="m9", content="again", meta=_meta("s1", 9.0))
+    assert cat.list_sessions("u")[0]["count"] == 5
+
+
+def test_trim_never_picks_summaries(tmp_path):
+    cat = SessionCatalog(tmp_path / "c.sqlite3")
+    cat.record_many([(f"m{i}", "hi", _meta("s1", float(i))) for i in range(3)])
+    _compact(cat, "s1", ["m0", "m1", "m2"], 2.0, turns=3)
+    cat.record_many([(f"n{i}", "hi", _meta("s2", 10.0 + i)) for i in range(3)])
+
+    assert cat.ids_beyond("u", 2) == ["n0"]
+    assert cat.ids_beyond("u", 3) == []  # the older summary neither takes a slot nor gets dropped
+
+
+def test_old_catalog_gains_turns_column(tmp_path):
+    path = tmp_path / "c.sqlite3"
+    conn = sqlite3.connect(str(path))
+    conn.execute("CREATE TABLE messages (message_id TEXT PRIMARY KEY, user_id TEXT NOT NULL, session_id TEXT NOT NULL,"
+                 " role TEXT, ts REAL NOT NULL, timestamp TEXT, content TEXT)")
+    conn.execute("INSERT INTO messages VALUES ('m0', 'u', 's1', 'user', 1.0, '1.0', 'hi')")
+    conn.commit()
+    conn.close()
+
+    cat = SessionCatalog(path)
+    cat.record(message_id="m1", content="hi", meta=_meta("s1", 2.0))
+    cat.delete_messages("u", ["m1"])
+    assert cat.list_sessions("u")[0]["count"] == 1